@@ -0,0 +1,343 @@
+"""
+ Benchmark for the TerrariumPI history collector. Run this script in the contrib folder with the same python version as TerrariumPI
+
+ python3 collector_benchmark.py --sensors 10 --years 1
+
+ Use --compare to run the same benchmark on the default and the compact sensor storage.
+
+ It will generate a history database with realistic sensor, switch, door, weather and system data in /tmp and
+ measures the history queries, the power and water usage totals and the insert speed.
+ The results are printed as JSON, so they can be compared between versions.
+
+ Do not run this on a running TerrariumPI, as it will use a lot of CPU and disk IO. Your own history.db is not used.
+"""
+
+import argparse
+import configparser
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import time
+
+# The collector needs the logging configuration from the TerrariumPI folder
+TERRARIUMPI_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(TERRARIUMPI_FOLDER)
+sys.path.insert(0,TERRARIUMPI_FOLDER)
+
+import terrariumLogging
+from terrariumCollector import terrariumCollector
+
+SENSOR_TYPES = ['temperature','humidity','moisture','light','ph','co2']
+PERIODS = ['day','week','month','year','all']
+
+def percentile(values, percentage):
+  values = sorted(values)
+  index = (len(values) - 1) * (percentage / 100.0)
+  lower = math.floor(index)
+  upper = math.ceil(index)
+  return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+def terrariumpi_version():
+  config = configparser.ConfigParser()
+  config.read('defaults.cfg')
+  return config.get('terrariumpi','version')
+
+def peak_rss():
+  # Linux reports the max resident set size in KB
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+class CollectorBenchmark():
+
+  def __init__(self, database = '/tmp/terrariumpi_benchmark.db', sensors = 10, years = 1.0, switches = 4, doors = 1, runs = 10, seed = 1, **collector_settings):
+    self.database = database
+    self.sensors = sensors
+    self.years = years
+    self.switches = switches
+    self.doors = doors
+    self.runs = runs
+    self.collector_settings = collector_settings
+    self.collector = None
+    self.random = random.Random(seed)
+
+    self.stoptime = int(time.time())
+    self.stoptime -= self.stoptime % terrariumCollector.STORE_MODULO
+    self.starttime = self.stoptime - int(self.years * 365 * 24 * 60 * 60)
+    self.starttime -= self.starttime % terrariumCollector.STORE_MODULO
+
+    self.sensor_ids = [('{:032x}'.format(self.random.getrandbits(128)),SENSOR_TYPES[counter % len(SENSOR_TYPES)]) for counter in range(self.sensors)]
+    # The limits and alarm values are changed a couple of times a year
+    self.sensor_limits = {id : (self.starttime,None) for id, type in self.sensor_ids}
+    self.switch_ids = ['{:032x}'.format(self.random.getrandbits(128)) for counter in range(self.switches)]
+    self.door_ids = [counter + 1 for counter in range(self.doors)]
+
+    self.results = {'settings' : {'sensors' : self.sensors,
+                                  'years' : self.years,
+                                  'switches' : self.switches,
+                                  'doors' : self.doors,
+                                  'runs' : self.runs,
+                                  'store_modulo' : terrariumCollector.STORE_MODULO,
+                                  'collector' : self.collector_settings},
+                    'database' : {},
+                    'history' : {},
+                    'totals' : {},
+                    'insert' : {}}
+
+  def __remove_database(self):
+    for extension in ['','-wal','-shm','-journal']:
+      if os.path.isfile(self.database + extension):
+        os.remove(self.database + extension)
+
+  def start(self):
+    timer = time.time()
+    terrariumCollector.DATABASE = self.database
+    self.collector = terrariumCollector(terrariumpi_version(),**self.collector_settings)
+
+    # Wait for the background jobs of the collector, else they are measured as well
+    while not self.__rollups_ready() or not self.__sensor_data_moved():
+      time.sleep(1)
+
+    self.results['database']['collector_setup_duration'] = time.time() - timer
+    self.results['database']['size'] = os.path.getsize(self.database)
+
+  def __sensor_value(self, type, timestamp):
+    # Day and night cycle with some noise
+    cycle = math.sin(((timestamp % 86400) / 86400.0) * 2 * math.pi)
+    ranges = {'temperature' : (24.0,6.0), 'humidity' : (60.0,20.0), 'moisture' : (40.0,10.0), 'light' : (500.0,500.0), 'ph' : (7.0,0.5), 'co2' : (600.0,200.0)}
+    base, amplitude = ranges[type]
+    return round(base + amplitude * cycle + self.random.uniform(-amplitude / 10.0,amplitude / 10.0),2)
+
+  def __insert(self, db, sql, rows):
+    db.executemany(sql,rows)
+    return len(rows)
+
+  def generate(self):
+    self.__remove_database()
+    # Let the collector create the database structure and version
+    self.start()
+    self.collector.stop()
+
+    timer = time.time()
+    rows = 0
+    db = sqlite3.connect(self.database)
+    db.execute('PRAGMA journal_mode = MEMORY')
+    # The intervals and rollups are created by the collector from the generated data
+    db.execute('DELETE FROM metadata')
+
+    sensor_sql = 'INSERT INTO sensor_data (id, type, timestamp, current, limit_min, limit_max, alarm_min, alarm_max, alarm) VALUES (?,?,?,?,?,?,?,?,?)'
+    weather_sql = 'INSERT INTO weather_data (timestamp, wind_speed, temperature, pressure, wind_direction, weather, icon) VALUES (?,?,?,?,?,?,?)'
+    system_sql = 'INSERT INTO system_data (timestamp, load_load1, load_load5, load_load15, uptime, temperature, cores, memory_total, memory_used, memory_free, disk_total, disk_used, disk_free) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)'
+    switch_sql = 'INSERT OR REPLACE INTO switch_data (id, timestamp, state, power_wattage, water_flow) VALUES (?,?,?,?,?)'
+    door_sql = 'INSERT OR REPLACE INTO door_data (id, timestamp, state) VALUES (?,?,?)'
+
+    switch_states = {id : (self.starttime,0) for id in self.switch_ids}
+    door_states = {id : (self.starttime,'closed') for id in self.door_ids}
+
+    # Work in chunks of a day, like the collector would have stored it
+    chunk = 24 * 60 * 60
+    for chunk_start in range(self.starttime,self.stoptime,chunk):
+      sensor_rows = []
+      weather_rows = []
+      system_rows = []
+      switch_rows = []
+      door_rows = []
+
+      for timestamp in range(chunk_start,min(chunk_start + chunk,self.stoptime + 1),terrariumCollector.STORE_MODULO):
+        for id, type in self.sensor_ids:
+          value = self.__sensor_value(type,timestamp)
+          changed, limits = self.sensor_limits[id]
+          if timestamp >= changed:
+            limits = (value - 5,value + 5,value - 10,value + 10)
+            self.sensor_limits[id] = (timestamp + self.random.randint(30,120) * 86400,limits)
+
+          sensor_rows.append((id,type,timestamp,value) + limits + (0,))
+
+        weather_rows.append((timestamp,self.random.uniform(0,10),self.__sensor_value('temperature',timestamp),1013.0,'N','clear sky','01d'))
+        system_rows.append((timestamp,0.5,0.4,0.3,timestamp - self.starttime,45.0,'4',1024 ** 3,512 * 1024 ** 2,512 * 1024 ** 2,32 * 1024 ** 3,8 * 1024 ** 3,24 * 1024 ** 3))
+
+        # Switches toggle every 10 minutes till 2 hours
+        for id in self.switch_ids:
+          changed, state = switch_states[id]
+          if timestamp >= changed:
+            state = 0 if state > 0 else 100
+            switch_rows.append((id,timestamp,state,50.0 if state > 0 else 0.0,2.0 if state > 0 else 0.0))
+            switch_states[id] = (timestamp + self.random.randint(10,120) * 60,state)
+
+        # Doors are opened a couple of times a day for a few minutes
+        for id in self.door_ids:
+          changed, state = door_states[id]
+          if timestamp >= changed:
+            state = 'open' if 'closed' == state else 'closed'
+            door_rows.append((id,timestamp,state))
+            door_states[id] = (timestamp + (self.random.randint(1,15) * 60 if 'open' == state else self.random.randint(2,12) * 3600),state)
+
+      with db:
+        rows += self.__insert(db,sensor_sql,sensor_rows)
+        rows += self.__insert(db,weather_sql,weather_rows)
+        rows += self.__insert(db,system_sql,system_rows)
+        rows += self.__insert(db,switch_sql,switch_rows)
+        rows += self.__insert(db,door_sql,door_rows)
+
+    db.close()
+    duration = time.time() - timer
+
+    self.results['database']['rows'] = rows
+    self.results['database']['generate_duration'] = duration
+    self.results['database']['generate_rows_per_second'] = rows / duration if duration > 0 else 0.0
+
+    # Start the collector again, so the intervals, totals and rollups are created
+    self.start()
+
+  def __rollups_ready(self):
+    with sqlite3.connect(self.database) as db:
+      return db.execute('SELECT value FROM metadata WHERE key = ?',('rollups_backfilled',)).fetchone() is not None
+
+  def __sensor_data_moved(self):
+    if 'true' != str(self.collector_settings.get('compact_sensor_data','false')).lower():
+      return True
+
+    with sqlite3.connect(self.database) as db:
+      return db.execute('SELECT timestamp FROM sensor_data LIMIT 1').fetchone() is None and \
+             db.execute('SELECT name FROM sqlite_master WHERE type = ? AND name GLOB ?',('table','sensor_data_[0-9][0-9][0-9][0-9][0-9][0-9]')).fetchone() is None
+
+  def __table_sizes(self):
+    # The dbstat table is not available in every SQLite version
+    try:
+      with sqlite3.connect(self.database) as db:
+        return {row[0] : row[1] for row in db.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name ORDER BY name')}
+    except sqlite3.OperationalError:
+      return None
+
+  def __measure(self, action):
+    timings = []
+    for counter in range(self.runs):
+      timer = time.time()
+      action()
+      timings.append(time.time() - timer)
+
+    return {'p50' : percentile(timings,50),
+            'p95' : percentile(timings,95),
+            'min' : min(timings),
+            'max' : max(timings),
+            'runs' : len(timings)}
+
+  def history(self):
+    sensor_id, sensor_type = self.sensor_ids[0]
+    variants = {}
+    for period in PERIODS:
+      variants['sensors_' + period] = ['sensors',period]
+      variants['sensors_average_' + period] = ['sensors','average',period]
+      variants['sensors_average_type_' + period] = ['sensors','average',sensor_type,period]
+      variants['sensors_type_' + period] = ['sensors',sensor_type,period]
+      variants['sensors_single_id_' + period] = ['sensors',sensor_type,sensor_id,period]
+      variants['switches_' + period] = ['switches',period]
+      variants['switches_single_id_' + period] = ['switches',self.switch_ids[0],period]
+      variants['doors_' + period] = ['doors',period]
+      variants['weather_' + period] = ['weather',period]
+      variants['system_' + period] = ['system',period]
+
+    for name in variants:
+      # The collector will change the parameters list, so use a new copy every run
+      self.results['history'][name] = self.__measure(lambda: self.collector.get_history(list(variants[name])))
+      self.results['history'][name]['peak_rss'] = peak_rss()
+
+  def totals(self):
+    self.results['totals']['get_total_power_water_usage'] = self.__measure(self.collector.get_total_power_water_usage)
+    self.results['totals']['recalculate_total_power_water_usage'] = self.__measure(self.collector.recalculate_total_power_water_usage)
+
+  def insert(self, amount = 10000):
+    # Log the generated sensors over and over, like the engine loop does
+    timer = time.time()
+    for counter in range(amount):
+      id, type = self.sensor_ids[counter % len(self.sensor_ids)]
+      value = self.__sensor_value(type,self.stoptime)
+      self.collector.log_sensor_data({'id' : id, 'type' : type, 'current' : value,
+                                      'limit_min' : 0, 'limit_max' : 100, 'alarm_min' : 0, 'alarm_max' : 100, 'alarm' : False})
+
+    queued = time.time() - timer
+    self.collector.flush()
+    duration = time.time() - timer
+
+    self.results['insert'] = {'rows' : amount,
+                              'queue_duration' : queued,
+                              'duration' : duration,
+                              'rows_per_second' : amount / duration if duration > 0 else 0.0,
+                              'write_queue' : self.collector.get_write_queue_stats()}
+
+  def stop(self):
+    if self.collector is not None:
+      self.collector.stop()
+
+    # Moved and deleted data leaves free pages, so measure the size after a vacuum as well
+    with sqlite3.connect(self.database) as db:
+      db.execute('VACUUM')
+
+    self.results['database']['size_vacuumed'] = os.path.getsize(self.database)
+    self.results['database']['tables'] = self.__table_sizes()
+    self.results['peak_rss'] = peak_rss()
+
+
+parser = argparse.ArgumentParser(description='Benchmark the TerrariumPI history collector with a generated database')
+parser.add_argument('--database', default='/tmp/terrariumpi_benchmark.db', help='generated database file. Will be overwritten')
+parser.add_argument('--sensors', type=int, default=10, help='amount of sensors')
+parser.add_argument('--years', type=float, default=1.0, help='amount of years of history')
+parser.add_argument('--switches', type=int, default=4, help='amount of power switches')
+parser.add_argument('--doors', type=int, default=1, help='amount of doors')
+parser.add_argument('--runs', type=int, default=10, help='amount of runs per measurement')
+parser.add_argument('--inserts', type=int, default=10000, help='amount of sensor readings for the insert measurement')
+parser.add_argument('--keep', action='store_true', help='reuse an existing generated database')
+parser.add_argument('--compare', action='store_true', help='compare the default and the compact sensor storage with the same generated data')
+parser.add_argument('--output', help='write the JSON results to this file')
+parser.add_argument('--collector', action='append', default=[], metavar='KEY=VALUE', help='collector setting like wal_mode=true. Can be used multiple times')
+parser.add_argument('--verbose', action='store_true', help='show the TerrariumPI log messages')
+arguments = parser.parse_args()
+
+if not arguments.verbose:
+  terrariumLogging.logging.disable(terrariumLogging.logging.WARNING)
+
+# The history cache is disabled by default, else only the first run would query the database
+collector_settings = {'history_cache_size' : 0}
+collector_settings.update(dict(setting.split('=',1) for setting in arguments.collector))
+
+def run(benchmark):
+  benchmark.history()
+  benchmark.totals()
+  benchmark.insert(arguments.inserts)
+  benchmark.stop()
+  return benchmark.results
+
+if arguments.compare:
+  # The compact storage starts with a copy of the generated data, so both are measured with the same data
+  compact_database = arguments.database.replace('.db','.compact.db')
+  benchmark = CollectorBenchmark(arguments.database,arguments.sensors,arguments.years,arguments.switches,arguments.doors,arguments.runs,**dict(collector_settings,compact_sensor_data='false'))
+  if not (arguments.keep and os.path.isfile(arguments.database)):
+    benchmark.generate()
+    benchmark.collector.stop()
+
+  shutil.copyfile(arguments.database,compact_database)
+  compact_benchmark = CollectorBenchmark(compact_database,arguments.sensors,arguments.years,arguments.switches,arguments.doors,arguments.runs,**dict(collector_settings,compact_sensor_data='true'))
+
+  benchmark.start()
+  results = {'default' : run(benchmark)}
+  compact_benchmark.start()
+  results['compact'] = run(compact_benchmark)
+
+else:
+  benchmark = CollectorBenchmark(arguments.database,arguments.sensors,arguments.years,arguments.switches,arguments.doors,arguments.runs,**collector_settings)
+  if arguments.keep and os.path.isfile(arguments.database):
+    benchmark.start()
+  else:
+    benchmark.generate()
+
+  results = run(benchmark)
+
+results = json.dumps(results,indent=2)
+if arguments.output is not None:
+  with open(arguments.output,'w') as output:
+    output.write(results)
+
+print(results)
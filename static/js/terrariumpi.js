@@ -9,6 +9,7 @@ var globals = {
   graphs: {},
   graph_cache: 1 * 60,
   websocket_timer: null,
+  websocket_state: {},
   online_timer: null,
   current_version: null,
   language: null,
@@ -411,10 +412,45 @@ function sortByKey(array, key) {
 /* General functions - End numbers, currency, etc formatting  */
 
 /* General functions - Websockets  */
+function merge_websocket_delta(message) {
+  // Delta messages only hold the changed items and fields. Merge them with the earlier messages to get the full items back
+  if (message.delta === undefined) {
+    return message;
+  }
+
+  if (globals.websocket_state[message.type] === undefined) {
+    globals.websocket_state[message.type] = {};
+  }
+  var state = globals.websocket_state[message.type];
+
+  if ('fields' == message.delta) {
+    state.value = $.isPlainObject(message.data) ? $.extend(state.value || {}, message.data) : message.data;
+    message.data = $.isPlainObject(state.value) ? $.extend(true, {}, state.value) : state.value;
+
+  } else if ($.isArray(message.data)) {
+    var items = [];
+    $.each(message.data, function(index, item) {
+      state['list_' + item.id] = $.extend(state['list_' + item.id] || {}, item);
+      items.push($.extend(true, {}, state['list_' + item.id]));
+    });
+    message.data = items;
+
+  } else {
+    $.each(message.data, function(key, item) {
+      state['dict_' + key] = $.extend(state['dict_' + key] || {}, item);
+      message.data[key] = $.extend(true, {}, state['dict_' + key]);
+    });
+  }
+
+  return message;
+}
+
 function websocket_init(reconnect) {
   websocket_connect();
 
   globals.websocket.onopen = function(evt) {
+    // The server starts with a full snapshot for new clients
+    globals.websocket_state = {};
     websocket_message({
       'type': 'client_init',
       'reconnect': reconnect
@@ -428,7 +464,7 @@ function websocket_init(reconnect) {
     }
 
     online_updater();
-    var data = JSON.parse(evt.data);
+    var data = merge_websocket_delta(JSON.parse(evt.data));
     switch (data.type) {
       case 'logtail':
         update_logtail(data.data);
@@ -475,6 +511,9 @@ function websocket_init(reconnect) {
       case 'update_weather':
         update_weather(data.data);
         break;
+      case 'history_graph':
+        update_history_graphs(data);
+        break;
     }
   };
   globals.websocket.onclose = function(evt) {
@@ -1039,6 +1078,85 @@ function movingAvg(array, count, qualifier){
     return result;
 }
 
+function merge_history_data(data, new_data, period_start) {
+  // Add the points of an incremental history request and remove the points that are older than the graph period
+  if ($.isArray(data)) {
+    return data.concat($.isArray(new_data) ? new_data : []).filter(function(point) {
+      return point[0] >= period_start;
+    });
+  }
+
+  $.each(new_data, function(key, value) {
+    if ($.isArray(value)) {
+      data[key] = (data[key] || []).concat(value);
+    } else if ($.isPlainObject(value)) {
+      data[key] = merge_history_data(data[key] || {}, value, period_start);
+    } else {
+      data[key] = value;
+    }
+  });
+
+  $.each(data, function(key, value) {
+    if ($.isArray(value)) {
+      data[key] = value.filter(function(point) {
+        return point[0] >= period_start;
+      });
+    }
+  });
+
+  return data;
+}
+
+function last_history_timestamp(data) {
+  var timestamp = 0;
+  if ($.isArray(data)) {
+    return data.length > 0 && $.isArray(data[data.length - 1]) ? data[data.length - 1][0] : 0;
+  }
+
+  $.each(data, function(key, value) {
+    if ($.isArray(value) || $.isPlainObject(value)) {
+      timestamp = Math.max(timestamp, last_history_timestamp(value));
+    }
+  });
+
+  return timestamp;
+}
+
+function update_history_graph(id, type, data_url, online_data) {
+  // Add the new points of an incremental history request to the graph, and remove the points that are outside the graph period
+  var now = + new Date();
+  var periods = {'day' : 1, 'week' : 7, 'month' : 30, 'year' : 365, 'all' : 3650};
+  var period_start = now - (periods[data_url.split('/').pop()] || 1) * 24 * 3600 * 1000;
+
+  globals.graphs[id].data = merge_history_data(globals.graphs[id].data, {}, period_start);
+  $.each(online_data, function(dummy, value) {
+    $.each(value, function(dummy, data_array) {
+      globals.graphs[id].data = merge_history_data(globals.graphs[id].data, data_array, period_start);
+    });
+  });
+  globals.graphs[id].timestamp = now;
+  history_graph(id, globals.graphs[id].data, type);
+
+  clearTimeout(globals.graphs[id].timer);
+  globals.graphs[id].timer = setTimeout(function() {
+    load_history_graph(id,type,data_url);
+  }, globals.graph_cache * 1000);
+}
+
+function update_history_graphs(message) {
+  // Answer of a history_graph websocket message. Update the graphs that show this history
+  if (message.since === null || message.since === undefined) {
+    return;
+  }
+
+  var data_url = '/api/history/' + message.parameters.join('/');
+  $.each(globals.graphs, function(id, graph) {
+    if (graph.url === data_url) {
+      update_history_graph(id, graph.type, data_url, message.data);
+    }
+  });
+}
+
 function load_history_graph(id,type,data_url,nocache) {
   if ($('#' + id + ' .history_graph').length === 1) {
     var now = + new Date();
@@ -1052,6 +1170,7 @@ function load_history_graph(id,type,data_url,nocache) {
     if (globals.graphs[id] === undefined) {
       globals.graphs[id] = {'timestamp' : 0,
                             'type' : type,
+                            'url' : null,
                             'data' : [],
                             'timer': null };
     }
@@ -1096,8 +1215,30 @@ function load_history_graph(id,type,data_url,nocache) {
           load_history_graph(id,type,data_url);
       }, globals.graph_cache * 1000);
 
+    } else if (nocache === 0 && globals.graphs[id].url === data_url && ['switch','door'].indexOf(type) === -1 && !globals.graphs[id].data.light_average &&
+               last_history_timestamp(globals.graphs[id].data) > 0) {
+      // Only load the new points since the last refresh. Switches and doors have totals over the full period
+      var since = Math.floor(last_history_timestamp(globals.graphs[id].data) / 1000);
+
+      if (globals.websocket && globals.websocket.readyState === WebSocket.OPEN) {
+        // The new points are send back with a history_graph message. Try again later when there is no answer
+        websocket_message({
+          'type': 'history_graph',
+          'data': {'parameters': data_url.replace('/api/history/','').split('/'), 'since': since}
+        });
+        clearTimeout(globals.graphs[id].timer);
+        globals.graphs[id].timer = setTimeout(function() {
+          load_history_graph(id,type,data_url);
+        }, globals.graph_cache * 1000);
+      } else {
+        $.getJSON(data_url + '?since=' + since, function(online_data) {
+          update_history_graph(id, type, data_url, online_data);
+        });
+      }
+
     } else {
       // Load fresh data...
+      globals.graphs[id].url = data_url;
       $.getJSON(data_url, function(online_data) {
         $.each(online_data, function(dummy, value) {
           $.each(value, function(dummy, data_array) {
@@ -1149,6 +1290,37 @@ function load_history_graph(id,type,data_url,nocache) {
   return false;
 }
 
+function load_history_graphs(graphs,data_url) {
+  // Load the history of multiple sensors in one request. Every graph is then shown from the loaded data like a cached graph
+  var now = + new Date();
+  var ids = $.map(graphs, function(graph) { return graph.sensor_id; });
+  if (ids.length === 0) {
+    return false;
+  }
+
+  $.getJSON(data_url + '?ids=' + ids.map(encodeURIComponent).join(','), function(online_data) {
+    $.each(graphs, function(index, graph) {
+      globals.graphs[graph.id] = {'timestamp' : 0,
+                                  'type' : graph.type,
+                                  'url' : null,
+                                  'data' : [],
+                                  'timer': null };
+
+      $.each(online_data, function(dummy, value) {
+        if (value[graph.sensor_id] !== undefined) {
+          globals.graphs[graph.id].timestamp = now;
+          globals.graphs[graph.id].url = graph.data_url;
+          globals.graphs[graph.id].data = value[graph.sensor_id];
+        }
+      });
+
+      load_history_graph(graph.id, graph.type, graph.data_url);
+    });
+  });
+
+  return false;
+}
+
 function history_graph(name, data, type) {
   function getMin(ret, thisVal) {
     thisVal = thisVal[1] || ret;
@@ -1496,12 +1668,13 @@ function history_graph(name, data, type) {
   }
 
   if (smooth && globals.graph_smooth_value > 0) {
-    graph_data[0].data = movingAvg(graph_data[0].data.reverse(),globals.graph_smooth_value);
+    // Work on copies, as the graph data is reused for incremental updates
+    graph_data[0].data = movingAvg(graph_data[0].data.slice().reverse(),globals.graph_smooth_value);
     try {
-      graph_data[1].data = graph_data[1].data.splice(globals.graph_smooth_value);
+      graph_data[1].data = graph_data[1].data.slice(globals.graph_smooth_value);
     } catch (e) {}
     try {
-      graph_data[2].data = graph_data[2].data.splice(globals.graph_smooth_value);
+      graph_data[2].data = graph_data[2].data.slice(globals.graph_smooth_value);
     } catch (e) {}
   }
 
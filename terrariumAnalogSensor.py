@@ -11,6 +11,7 @@ from terrariumSensor import terrariumSensorSource
 class terrariumAnalogSensor(terrariumSensorSource):
   TYPE = None
   VALID_SENSOR_TYPES = []
+  BUS = 'spi'
 
   def load_data(self):
     data = None
@@ -16,6 +16,7 @@ from terrariumSensor import terrariumSensorSource, terrariumSensorCache
 class terrariumMiFloraSensor(terrariumSensorSource):
   TYPE = 'miflora'
   VALID_SENSOR_TYPES = ['temperature','light','moisture','fertility']
+  BUS = 'bluetooth'
 
   __SCANTIME = 5
   __MIN_DB = -90
@@ -129,6 +130,7 @@ class terrariumMiFloraSensor(terrariumSensorSource):
 class terrariumMiTempSensor(terrariumSensorSource):
   TYPE = 'mitemp'
   VALID_SENSOR_TYPES = ['temperature','humidity']
+  BUS = 'bluetooth'
 
   __SCANTIME = 5
   __MIN_DB = -90
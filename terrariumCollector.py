@@ -2,32 +2,283 @@
 import terrariumLogging
 logger = terrariumLogging.logging.getLogger(__name__)
 
+try:
+  import thread as _thread
+except ImportError as ex:
+  import _thread
 import sqlite3
+import threading
 import time
+import datetime
 import copy
 import os
+import sys
+import json
+import array
+import struct
+import math
+import heapq
+import bisect
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import Queue
+from gevent import sleep
+
+try:
+  import numpy
+except ImportError as ex:
+  numpy = None
 
 from terrariumUtils import terrariumUtils
+from terrariumStatistics import terrariumSensorStatistics
+
+class terrariumHistoryBuffer(object):
+  # Ring buffer with the recent history of a single sensor. The timestamps and values are stored in fixed size arrays,
+  # where empty values are stored as NaN
+  FIELDS = ['current','limit_min','limit_max','alarm_min','alarm_max']
+
+  def __init__(self,size):
+    self.__size = size
+    self.__start = 0
+    self.__length = 0
+    self.__timestamps = array.array('q',[0]) * size
+    self.__values = {field : array.array('d',[0.0]) * size for field in terrariumHistoryBuffer.FIELDS}
+
+  def __len__(self):
+    return self.__length
+
+  def __position(self,index):
+    return (self.__start + index) % self.__size
+
+  def __find(self,timestamp):
+    # Index of the first value at or after the timestamp
+    low = 0
+    high = self.__length
+    while low < high:
+      middle = (low + high) // 2
+      if self.__timestamps[self.__position(middle)] < timestamp:
+        low = middle + 1
+      else:
+        high = middle
+
+    return low
+
+  def append(self,timestamp,data):
+    if self.__length > 0 and self.__timestamps[self.__position(self.__length - 1)] >= timestamp:
+      if self.__timestamps[self.__position(self.__length - 1)] > timestamp:
+        # Values are only added in time order
+        return
+
+      # A new value in the same minute replaces the previous value, like in the database
+      position = self.__position(self.__length - 1)
+    elif self.__length < self.__size:
+      position = self.__position(self.__length)
+      self.__length += 1
+    else:
+      # Overwrite the oldest value
+      position = self.__start
+      self.__start = (self.__start + 1) % self.__size
+
+    self.__timestamps[position] = timestamp
+    for field in terrariumHistoryBuffer.FIELDS:
+      try:
+        self.__values[field][position] = float(data[field])
+      except (TypeError, ValueError) as ex:
+        self.__values[field][position] = float('nan')
+
+  def get_history(self,id,type,stoptime,starttime):
+    history = []
+    for index in range(self.__find(stoptime),self.__find(starttime + 1)):
+      position = self.__position(index)
+      row = {'id' : id, 'type' : type, 'timestamp' : self.__timestamps[position]}
+      for field in terrariumHistoryBuffer.FIELDS:
+        value = self.__values[field][position]
+        row[field] = None if math.isnan(value) else value
+
+      history.append(row)
+
+    return history
 
 class terrariumCollector(object):
   DATABASE = 'history.db'
   # Store data every Xth minute. Except switches and doors
   STORE_MODULO = 1 * 60
-
-  def __init__(self,versionid):
+  # Max amount of rows waiting in the write queue before it is flushed directly
+  WRITE_QUEUE_SIZE = 1000
+  # Flush the write queue every X milliseconds
+  WRITE_FLUSH_INTERVAL = 1000
+  # Amount of read only connections used in WAL mode
+  READ_CONNECTIONS = 3
+  # Automatic WAL checkpoint after X pages. Zero will disable automatic checkpoints
+  WAL_CHECKPOINT_PAGES = 1000
+  # Run a WAL checkpoint every X seconds from the write loop. Zero will disable timed checkpoints
+  WAL_CHECKPOINT_INTERVAL = 300
+  # Rollup tables with min/avg/max sensor data per bucket size in seconds. From fine to coarse
+  ROLLUP_TABLES = [('sensor_data_5min', 5 * 60),
+                   ('sensor_data_hour', 60 * 60),
+                   ('sensor_data_day',  24 * 60 * 60)]
+  # Amount of rows per page that are copied at once during a database recovery
+  RECOVERY_PAGE_SIZE = 1000
+  # Maximum amount of rows that are kept in the write queue during a recovery. The oldest rows are dropped when the recovery takes longer
+  RECOVERY_QUEUE_SIZE = 50000
+  # A rollup table is used for history when it still returns at least X points for the requested period
+  ROLLUP_MIN_POINTS = 300
+  # History tables that can be stored in monthly partitions (tables like sensor_data_202001)
+  PARTITION_TABLES = ['sensor_data','sensor_values','weather_data','system_data']
+  # Max amount of history results that are kept in memory. Zero will disable the history cache
+  HISTORY_CACHE_SIZE = 50
+  # Sensors with a deadband store an unchanged value at least every X seconds, when the sensor has no heartbeat set
+  DEADBAND_HEARTBEAT = 15 * 60
+  # Max seconds between two stored values of a sensor with a deadband. Bigger gaps in the history are not filled
+  DEADBAND_MAX_HEARTBEAT = 60 * 60
+  # Value that is used to select the points when the history is downsampled. System history uses the first requested field in this list
+  DOWNSAMPLE_FIELDS = {'sensors' : ['current'],
+                       'weather' : ['temperature'],
+                       'system'  : ['load_load1','temperature','uptime','memory_used','disk_used','cores']}
+  # Use NumPy for downsampling buckets with at least X points
+  DOWNSAMPLE_NUMPY_MIN = 32
+  # The sensor statistics are per local day. Changed statistics are stored every X seconds, and when a new day starts
+  STATISTICS_STORE_INTERVAL = 15 * 60
+  # Sensor id of the average values per sensor type that are logged by the engine
+  AVERAGE_ID = 'average'
+  # Sensor types that are stored in the sensor_data table
+  SENSOR_TYPES = ['humidity','moisture','temperature','distance','ph','conductivity','light','uva','uvb','uvi','fertility','co2','volume']
+  # Sensor types that can be selected in the history API
+  HISTORY_SENSOR_TYPES = ['temperature','humidity','distance','ph','conductivity','light','uva','uvb','uvi','fertility']
+  # Keep the last X seconds of sensor history in memory. This includes the longest deadband heartbeat for filling the history
+  HISTORY_BUFFER_PERIOD = 24 * 60 * 60
+
+  def __init__(self,versionid,**kwargs):
     logger.info('Setting up collector database %s' % (terrariumCollector.DATABASE,))
     self.__recovery = False
+
+    self.__write_queue = []
+    self.__write_queue_size = int(kwargs.get('write_queue_size',terrariumCollector.WRITE_QUEUE_SIZE))
+    self.__write_flush_interval = float(kwargs.get('write_flush_interval',terrariumCollector.WRITE_FLUSH_INTERVAL)) / 1000.0
+    self.__write_lock = threading.RLock()
+    self.__write_stats = {'flushes' : 0,
+                          'rows' : 0,
+                          'last_flush_rows' : 0,
+                          'last_flush_duration' : 0.0,
+                          'max_flush_duration' : 0.0,
+                          'total_flush_duration' : 0.0,
+                          'dropped' : 0}
+
+    self.__wal_mode = terrariumUtils.is_true(kwargs.get('wal_mode',False))
+    self.__wal_checkpoint_pages = int(kwargs.get('wal_checkpoint_pages',terrariumCollector.WAL_CHECKPOINT_PAGES))
+    self.__wal_checkpoint_interval = int(kwargs.get('wal_checkpoint_interval',terrariumCollector.WAL_CHECKPOINT_INTERVAL))
+    self.__read_connections = int(kwargs.get('read_connections',terrariumCollector.READ_CONNECTIONS))
+    self.__read_pool = None
+
+    self.__rollup_pending = {}
+    self.__rollup_buckets = {}
+    self.__open_intervals = {}
+    self.__open_alarms = {}
+    self.__statistics = {}
+    self.__statistics_lock = threading.RLock()
+    self.__switch_totals = {}
+
+    self.__partitions_enabled = terrariumUtils.is_true(kwargs.get('partitions',False))
+    self.__retention_months = int(kwargs.get('retention_months',0))
+    self.__partitions = {}
+    self.__partition_base = {}
+
+    self.__compact_sensor_data = terrariumUtils.is_true(kwargs.get('compact_sensor_data',False))
+    self.__sensor_keys = {}
+    self.__sensor_limits = {}
+    self.__deadband_values = {}
+    self.__deadband_periods = {}
+
+    self.__history_buffer_enabled = terrariumUtils.is_true(kwargs.get('history_buffer',True))
+    self.__history_buffer_size = (terrariumCollector.HISTORY_BUFFER_PERIOD + terrariumCollector.DEADBAND_MAX_HEARTBEAT) // terrariumCollector.STORE_MODULO + 2
+    self.__history_buffers = {}
+    self.__history_buffer_since = None
+    self.__history_buffer_lock = threading.Lock()
+
+    self.__history_cache = OrderedDict()
+    self.__history_cache_size = int(kwargs.get('history_cache_size',terrariumCollector.HISTORY_CACHE_SIZE))
+    self.__history_cache_lock = threading.Lock()
+    self.__history_cache_generation = 0
+    self.__history_cache_stats = {'hits' : 0,
+                                  'misses' : 0,
+                                  'extensions' : 0,
+                                  'invalidations' : 0}
+
     self.__connect()
     self.__create_database_structure()
     self.__upgrade(int(versionid.replace('.','')))
+    self.__load_partitions()
+    self.__load_sensor_keys()
+
+    self.__load_intervals()
+    self.__load_switch_totals()
+    self.__load_alarms()
+
+    # The history is only filled in the periods that a sensor is stored with a deadband
+    self.__load_deadbands()
+
+    # The average history is read from the stored averages after the first stored average
+    self.__average_since = self.__get_metadata('average_since')
+    self.__average_since = None if self.__average_since is None else int(self.__average_since)
+
+    self.__load_history_buffers()
+
+    self.__running = True
+    _thread.start_new_thread(self.__write_loop, ())
+
+    if self.__partitions_enabled and True in self.__partition_base.values():
+      _thread.start_new_thread(self.__migrate_partitions, ())
+
+    if self.__compact_sensor_data and (self.__partition_base['sensor_data'] or len(self.__partitions['sensor_data']) > 0):
+      _thread.start_new_thread(self.__compact_sensor_history, ())
+
+    self.__rollups_ready = self.__get_metadata('rollups_backfilled') is not None
+    if not self.__rollups_ready:
+      with self.__read_connection() as db:
+        begin = db.execute('SELECT MIN(timestamp) AS timestamp FROM ' + self.__get_partition_source('sensor_data')).fetchone()['timestamp']
+
+      if begin is None:
+        # New database, nothing to backfill
+        self.__set_metadata('rollups_backfilled',int(time.time()))
+        self.__rollups_ready = True
+      else:
+        _thread.start_new_thread(self.__backfill_rollups, (begin,))
+
+    if self.__get_metadata('sensor_statistics_backfilled') is None:
+      with self.__read_connection() as db:
+        begin = db.execute('SELECT MIN(timestamp) AS timestamp FROM ' + self.__get_partition_source('sensor_data')).fetchone()['timestamp']
+
+      if begin is None:
+        self.__set_metadata('sensor_statistics_backfilled',int(time.time()))
+      else:
+        _thread.start_new_thread(self.__backfill_statistics, (begin,))
+
+    if self.__get_metadata('sensor_alarms_backfilled') is None:
+      with self.__read_connection() as db:
+        begin = db.execute('SELECT MIN(timestamp) AS timestamp FROM ' + self.__get_partition_source('sensor_data')).fetchone()['timestamp']
+
+      if begin is None:
+        self.__set_metadata('sensor_alarms_backfilled',int(time.time()))
+      else:
+        _thread.start_new_thread(self.__backfill_alarms, (begin,))
+
     logger.info('TerrariumPI Collecter is ready')
 
   def __connect(self):
-    self.db = sqlite3.connect(terrariumCollector.DATABASE)
+    # The connection is shared between the engine, webserver and the write queue threads
+    self.db = sqlite3.connect(terrariumCollector.DATABASE,check_same_thread=False)
     # https://www.whoishostingthis.com/compare/sqlite/optimize/
     with self.db as db:
       cur = db.cursor()
-      cur.execute('PRAGMA journal_mode = MEMORY')
+      if self.__wal_mode:
+        cur.execute('PRAGMA journal_mode = WAL')
+        # In WAL mode normal sync is safe against corruption. Only the last transactions can be lost at a power failure
+        cur.execute('PRAGMA synchronous = NORMAL')
+        cur.execute('PRAGMA wal_autocheckpoint = ' + str(self.__wal_checkpoint_pages))
+      else:
+        cur.execute('PRAGMA journal_mode = MEMORY')
+
       cur.execute('PRAGMA temp_store = MEMORY')
       # Line below is not safe for a Pi. As this can/will corrupt the database when the Pi crashes....
       # cur.execute('PRAGMA synchronous = OFF')
@@ -35,6 +286,52 @@ class terrariumCollector(object):
     self.db.row_factory = sqlite3.Row
     logger.info('Database connection created to database %s' % (terrariumCollector.DATABASE,))
 
+    if self.__wal_mode:
+      self.__close_read_connections()
+      self.__read_pool = Queue()
+      for counter in range(max(1,self.__read_connections)):
+        read_db = sqlite3.connect('file:{}?mode=ro'.format(terrariumCollector.DATABASE),uri=True,check_same_thread=False)
+        read_db.row_factory = sqlite3.Row
+        read_db.execute('PRAGMA temp_store = MEMORY')
+        self.__read_pool.put(read_db)
+
+      logger.info('Database is running in WAL mode with %s read only connections' % (self.__read_pool.qsize(),))
+
+  def __close_read_connections(self):
+    if self.__read_pool is None:
+      return
+
+    while not self.__read_pool.empty():
+      self.__read_pool.get().close()
+
+    self.__read_pool = None
+
+  @contextmanager
+  def __read_connection(self):
+    # Without WAL mode all reads will use the shared connection
+    if self.__read_pool is None:
+      with self.db as db:
+        yield db
+
+      return
+
+    # Wait for a free read only connection. WAL readers are not blocked by the writer
+    read_db = self.__read_pool.get()
+    try:
+      yield read_db
+    finally:
+      # Close any open read transaction so the checkpoints can continue
+      read_db.rollback()
+      self.__read_pool.put(read_db)
+
+  def __checkpoint(self):
+    timer = time.time()
+    with self.__write_lock:
+      with self.db as db:
+        row = db.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+
+    logger.debug('Timing: WAL checkpoint wrote %s of %s pages in %s seconds.' % (row[2],row[1],time.time()-timer))
+
   def __create_database_structure(self):
     with self.db as db:
       cur = db.cursor()
@@ -54,6 +351,32 @@ class terrariumCollector(object):
       cur.execute('CREATE INDEX IF NOT EXISTS sensor_data_avg ON sensor_data(type,timestamp ASC)')
       cur.execute('CREATE INDEX IF NOT EXISTS sensor_data_id ON sensor_data(id,timestamp ASC)')
 
+      # Compact sensor storage. The sensor id and type are stored once with a small integer key. The limits and alarm values
+      # are stored as intervals, as they hardly change. The values are clustered per sensor, so no extra indexes are needed
+      cur.execute('''CREATE TABLE IF NOT EXISTS sensor_keys
+                      (key INTEGER PRIMARY KEY,
+                       id VARCHAR(50),
+                       type VARCHAR(15))''')
+
+      cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS sensor_keys_unique ON sensor_keys(id,type)')
+
+      cur.execute('''CREATE TABLE IF NOT EXISTS sensor_values
+                      (sensor_key INTEGER,
+                       timestamp INTEGER(4),
+                       current FLOAT(4),
+                       alarm INTEGER(1),
+                       PRIMARY KEY (sensor_key,timestamp)) WITHOUT ROWID''')
+
+      cur.execute('''CREATE TABLE IF NOT EXISTS sensor_limits
+                      (sensor_key INTEGER,
+                       timestamp INTEGER(4),
+                       timestamp_end INTEGER(4),
+                       limit_min FLOAT(4),
+                       limit_max FLOAT(4),
+                       alarm_min FLOAT(4),
+                       alarm_max FLOAT(4),
+                       PRIMARY KEY (sensor_key,timestamp)) WITHOUT ROWID''')
+
       cur.execute('''CREATE TABLE IF NOT EXISTS switch_data
                       (id VARCHAR(50),
                        timestamp INTEGER(4),
@@ -103,8 +426,111 @@ class terrariumCollector(object):
 
       cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS system_data_unique ON system_data(timestamp ASC)')
 
+      for rollup_table, period in terrariumCollector.ROLLUP_TABLES:
+        cur.execute('''CREATE TABLE IF NOT EXISTS ''' + rollup_table + '''
+                        (id VARCHAR(50),
+                         type VARCHAR(15),
+                         timestamp INTEGER(4),
+                         current FLOAT(4),
+                         current_min FLOAT(4),
+                         current_max FLOAT(4),
+                         limit_min FLOAT(4),
+                         limit_max FLOAT(4),
+                         alarm_min FLOAT(4),
+                         alarm_max FLOAT(4),
+                         alarm INTEGER(1),
+                         amount INTEGER(4))''')
+
+        cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS ' + rollup_table + '_unique ON ' + rollup_table + '(id,type,timestamp ASC)')
+        cur.execute('CREATE INDEX IF NOT EXISTS ' + rollup_table + '_avg ON ' + rollup_table + '(type,timestamp ASC)')
+
+      cur.execute('''CREATE TABLE IF NOT EXISTS switch_intervals
+                      (id VARCHAR(50),
+                       timestamp INTEGER(4),
+                       timestamp_end INTEGER(4),
+                       state INTERGER(1),
+                       power_wattage FLOAT(2),
+                       water_flow FLOAT(2))''')
+
+      cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS switch_intervals_unique ON switch_intervals(id,timestamp ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS switch_intervals_end ON switch_intervals(timestamp_end ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS switch_intervals_id_end ON switch_intervals(id,timestamp_end ASC)')
+
+      cur.execute('''CREATE TABLE IF NOT EXISTS door_intervals
+                      (id INTEGER(4),
+                       timestamp INTEGER(4),
+                       timestamp_end INTEGER(4),
+                       state TEXT CHECK( state IN ('open','closed') ) NOT NULL DEFAULT 'closed')''')
+
+      cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS door_intervals_unique ON door_intervals(id,timestamp ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS door_intervals_end ON door_intervals(timestamp_end ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS door_intervals_id_end ON door_intervals(id,timestamp_end ASC)')
+
+      # Alarm periods per sensor. The alarm field is 'min' or 'max' and the peak is the furthest value outside the alarm limit
+      cur.execute('''CREATE TABLE IF NOT EXISTS sensor_alarms
+                      (id VARCHAR(50),
+                       type VARCHAR(15),
+                       timestamp INTEGER(4),
+                       timestamp_end INTEGER(4),
+                       alarm VARCHAR(3),
+                       peak FLOAT(4))''')
+
+      cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS sensor_alarms_unique ON sensor_alarms(id,type,timestamp ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS sensor_alarms_end ON sensor_alarms(timestamp_end ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS sensor_alarms_id_end ON sensor_alarms(id,timestamp_end ASC)')
+
+      # Online statistics per sensor per day. The sketch contains the (JSON) quantile sketch for the percentiles
+      cur.execute('''CREATE TABLE IF NOT EXISTS sensor_statistics
+                      (id VARCHAR(50),
+                       type VARCHAR(15),
+                       timestamp INTEGER(4),
+                       amount INTEGER(4),
+                       mean FLOAT(4),
+                       m2 FLOAT(4),
+                       min FLOAT(4),
+                       max FLOAT(4),
+                       sketch TEXT,
+                       timestamp_last INTEGER(4))''')
+
+      cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS sensor_statistics_unique ON sensor_statistics(id,type,timestamp ASC)')
+      cur.execute('CREATE INDEX IF NOT EXISTS sensor_statistics_timestamp ON sensor_statistics(timestamp ASC)')
+
+      cur.execute('''CREATE TABLE IF NOT EXISTS switch_totals
+                      (id VARCHAR(50) PRIMARY KEY,
+                       duration INTEGER(4),
+                       power_wattage FLOAT(4),
+                       water_flow FLOAT(4),
+                       timestamp_first INTEGER(4),
+                       timestamp_last INTEGER(4))''')
+
+      # Periods in which a sensor is stored with a deadband. Only in these periods the history of the sensor is filled
+      cur.execute('''CREATE TABLE IF NOT EXISTS sensor_deadbands
+                      (id VARCHAR(50),
+                       type VARCHAR(15),
+                       timestamp INTEGER(4),
+                       timestamp_end INTEGER(4),
+                       heartbeat INTEGER(4))''')
+
+      cur.execute('CREATE UNIQUE INDEX IF NOT EXISTS sensor_deadbands_unique ON sensor_deadbands(id,type,timestamp ASC)')
+
+      cur.execute('''CREATE TABLE IF NOT EXISTS metadata
+                      (key VARCHAR(50) PRIMARY KEY,
+                       value TEXT)''')
+
     db.commit()
 
+  def __get_metadata(self,key):
+    with self.__read_connection() as db:
+      row = db.execute('SELECT value FROM metadata WHERE key = ?',(key,)).fetchone()
+
+    return None if row is None else row['value']
+
+  def __set_metadata(self,key,value):
+    with self.__write_lock:
+      with self.db as db:
+        db.execute('REPLACE INTO metadata (key, value) VALUES (?,?)',(key,str(value)))
+        db.commit()
+
   def __upgrade(self,to_version):
     # Set minimal version to 3.0.0
     current_version = 300
@@ -208,122 +634,1355 @@ class terrariumCollector(object):
       logger.info('Collector database upgrade for version 3.8.0 succeeded! Removed duplicate records')
 
   def __recover(self):
+    with self.__write_lock:
+      if self.__recovery:
+        return
+
+      # Enable recovery status. New data is buffered in the write queue till the recovery is done
+      self.__recovery = True
+
+    logger.warning('TerrariumPI Collecter recovery mode is starting! New data will be stored when the recovery is done')
+    _thread.start_new_thread(self.__recover_database, ())
+
+  def __recover_database(self):
     starttime = time.time()
-    # Based on: http://www.dosomethinghere.com/2013/02/20/fixing-the-sqlite-error-the-database-disk-image-is-malformed/
-    # Enable recovery status
-    self.__recovery = True
-    logger.warn('TerrariumPI Collecter recovery mode is starting! %s', (self.__recovery,))
-
-    # Create empty sql dump variable
-    sqldump = ''
-    lines = 0
-    with open('.recovery.sql', 'w') as f:
-      # Dump SQL data line for line
-      for line in self.db.iterdump():
-        lines += 1
-        sqldump += line + "\n"
-        f.write('%s\n' % line)
-
-    logger.warn('TerrariumPI Collecter recovery mode created SQL dump of %s lines and %s bytes!', (lines,strlen(sqldump),))
-
-    # Delete broken db
-    os.remove(terrariumCollector.DATABASE)
-    logger.warn('TerrariumPI Collecter recovery mode deleted faulty database from disk %s', (terrariumCollector.DATABASE,))
-
-    # Reconnect will recreate the db
-    logger.warn('TerrariumPI Collecter recovery mode starts reconnecting database to create a new clean database at %s', (terrariumCollector.DATABASE,))
-    self.__connect()
-    self.__create_database_structure()
-    cur = self.db.cursor()
-    # Load the SQL data back to db
-    cur.executescript(sqldump)
-    logger.warn('TerrariumPI Collecter recovery mode restored the old data in a new database. %s', (terrariumCollector.DATABASE,))
+    # Salvage the data table by table in small pages to a new database. This will use little memory,
+    # skips the broken pages and a restart will continue where the previous recovery stopped
+    recovery_file = terrariumCollector.DATABASE + '.recovery'
+    recovery_db = sqlite3.connect(recovery_file,check_same_thread=False)
+    recovery_db.execute('CREATE TABLE IF NOT EXISTS recovery_progress (name VARCHAR(50) PRIMARY KEY, last_rowid INTEGER(8), done INTEGER(1))')
+    progress = {row[0] : (row[1],row[2]) for row in recovery_db.execute('SELECT name, last_rowid, done FROM recovery_progress')}
+    if len(progress) > 0:
+      logger.warning('TerrariumPI Collecter recovery mode continues with the previous recovery in %s' % (recovery_file,))
 
-    # Return to normal mode
-    self.__recovery = False
-    logger.warn('TerrariumPI Collecter recovery mode is finished in %s seconds!', (time.time()-starttime,))
+    try:
+      with self.__write_lock:
+        schema = self.db.execute('SELECT type, name, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE ? ORDER BY type DESC',('sqlite_%',)).fetchall()
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+    except sqlite3.DatabaseError as ex:
+      # Without the database structure there is nothing to salvage. A new empty database will be created
+      logger.error('TerrariumPI Collecter recovery mode could not read the database structure: %s' % (ex,))
+      schema = []
+      version = 0
 
-  def __log_data(self,type,id,newdata):
+    existing = [row[0] for row in recovery_db.execute('SELECT name FROM sqlite_master')]
+    for item in schema:
+      if item['name'] not in existing:
+        recovery_db.execute(item['sql'])
+
+    recovery_db.commit()
+
+    for table in [item['name'] for item in schema if 'table' == item['type']]:
+      last_rowid, done = progress.get(table,(0,0))
+      if done:
+        continue
+
+      if 'WITHOUT ROWID' in [item['sql'] for item in schema if item['name'] == table][0].upper():
+        if not self.__recover_table_by_key(recovery_db,table,last_rowid):
+          return
+
+        continue
+
+      try:
+        columns = [column['name'] for column in self.db.execute('PRAGMA table_info(' + table + ')')]
+        max_rowid = self.db.execute('SELECT MAX(rowid) FROM ' + table).fetchone()[0]
+      except sqlite3.DatabaseError as ex:
+        logger.error('TerrariumPI Collecter recovery mode could not read table %s: %s' % (table,ex))
+        continue
+
+      sql = 'INSERT OR REPLACE INTO ' + table + ' (rowid, ' + ', '.join(columns) + ') VALUES (?' + (',?' * len(columns)) + ')'
+      rows = 0
+      errors = 0
+      percentage = 0
+      logger.warning('TerrariumPI Collecter recovery mode is salvaging table %s' % (table,))
+
+      while max_rowid is not None and last_rowid < max_rowid:
+        if not self.__running:
+          recovery_db.close()
+          logger.warning('TerrariumPI Collecter recovery mode is stopped. It will continue on the next recovery')
+          return
+
+        try:
+          with self.__write_lock:
+            data = self.db.execute('SELECT rowid, ' + ', '.join(columns) + ' FROM ' + table + ' WHERE rowid > ? ORDER BY rowid ASC LIMIT ?',
+                                   (last_rowid,terrariumCollector.RECOVERY_PAGE_SIZE)).fetchall()
+        except sqlite3.DatabaseError as ex:
+          # Skip the broken page and try the next one
+          errors += 1
+          last_rowid += terrariumCollector.RECOVERY_PAGE_SIZE
+          continue
+
+        if len(data) == 0:
+          break
+
+        recovery_db.executemany(sql,[tuple(row) for row in data])
+        last_rowid = data[-1][0]
+        rows += len(data)
+        recovery_db.execute('REPLACE INTO recovery_progress (name, last_rowid, done) VALUES (?,?,?)',(table,last_rowid,0))
+        recovery_db.commit()
+
+        new_percentage = min(100,int((last_rowid / float(max_rowid)) * 100))
+        if new_percentage >= percentage + 10:
+          percentage = new_percentage
+          logger.info('TerrariumPI Collecter recovery mode is at {}% for table {}'.format(percentage,table))
+
+        # Make time for other processes
+        sleep(0.01)
+
+      recovery_db.execute('REPLACE INTO recovery_progress (name, last_rowid, done) VALUES (?,?,?)',(table,last_rowid,1))
+      recovery_db.commit()
+      logger.warning('TerrariumPI Collecter recovery mode salvaged %s rows from table %s with %s broken pages' % (rows,table,errors))
+
+    recovery_db.execute('DROP TABLE recovery_progress')
+    recovery_db.execute('PRAGMA user_version = ' + str(version))
+    recovery_db.commit()
+    recovery_db.close()
+
+    # Replace the broken database with the recovered database. The broken database is kept for manual inspection
+    with self.__write_lock:
+      self.__close_read_connections()
+      self.db.close()
+      os.replace(terrariumCollector.DATABASE,terrariumCollector.DATABASE + '.malformed')
+      for wal_file in [terrariumCollector.DATABASE + '-wal',terrariumCollector.DATABASE + '-shm']:
+        if os.path.isfile(wal_file):
+          os.remove(wal_file)
+
+      os.replace(recovery_file,terrariumCollector.DATABASE)
+      logger.warning('TerrariumPI Collecter recovery mode moved the faulty database to %s' % (terrariumCollector.DATABASE + '.malformed',))
+
+      self.__connect()
+      self.__create_database_structure()
+      self.__load_partitions()
+      self.__load_sensor_keys()
+
+      # Return to normal mode
+      self.__recovery = False
+
+    self.__invalidate_history_cache()
+
+    # Store the data that is logged during the recovery
+    self.flush()
+    logger.warning('TerrariumPI Collecter recovery mode is finished in %.3f seconds!' % (time.time()-starttime,))
+
+  def __recover_table_by_key(self,recovery_db,table,last_key):
+    # Tables without rowid are copied in pages by their primary key. The last copied key is stored as JSON in the recovery progress
+    last_key = json.loads(last_key) if isinstance(last_key,str) else None
+    try:
+      table_info = self.db.execute('PRAGMA table_info(' + table + ')').fetchall()
+    except sqlite3.DatabaseError as ex:
+      logger.error('TerrariumPI Collecter recovery mode could not read table %s: %s' % (table,ex))
+      return True
+
+    columns = [column['name'] for column in table_info]
+    key_columns = [column['name'] for column in sorted(table_info,key=lambda column: column['pk']) if column['pk'] > 0]
+    key_positions = [columns.index(column) for column in key_columns]
+    sql = 'INSERT OR REPLACE INTO ' + table + ' (' + ', '.join(columns) + ') VALUES (?' + (',?' * (len(columns) - 1)) + ')'
+    rows = 0
+    logger.warning('TerrariumPI Collecter recovery mode is salvaging table %s' % (table,))
+
+    while True:
+      if not self.__running:
+        recovery_db.close()
+        logger.warning('TerrariumPI Collecter recovery mode is stopped. It will continue on the next recovery')
+        return False
+
+      try:
+        with self.__write_lock:
+          data = self.db.execute('SELECT ' + ', '.join(columns) + ' FROM ' + table +
+                                 ('' if last_key is None else ' WHERE (' + ', '.join(key_columns) + ') > (?' + (',?' * (len(key_columns) - 1)) + ')') +
+                                 ' ORDER BY ' + ', '.join(key_columns) + ' LIMIT ?',
+                                 ([] if last_key is None else last_key) + [terrariumCollector.RECOVERY_PAGE_SIZE]).fetchall()
+      except sqlite3.DatabaseError as ex:
+        # Without a rowid the broken page cannot be skipped, so stop with this table
+        logger.error('TerrariumPI Collecter recovery mode could not read table %s after %s rows: %s' % (table,rows,ex))
+        break
+
+      if len(data) == 0:
+        break
+
+      recovery_db.executemany(sql,[tuple(row) for row in data])
+      last_key = [data[-1][position] for position in key_positions]
+      rows += len(data)
+      recovery_db.execute('REPLACE INTO recovery_progress (name, last_rowid, done) VALUES (?,?,?)',(table,json.dumps(last_key),0))
+      recovery_db.commit()
+
+      # Make time for other processes
+      sleep(0.01)
+
+    recovery_db.execute('REPLACE INTO recovery_progress (name, last_rowid, done) VALUES (?,?,?)',(table,json.dumps(last_key),1))
+    recovery_db.commit()
+    logger.warning('TerrariumPI Collecter recovery mode salvaged %s rows from table %s' % (rows,table))
+    return True
+
+  def __queue_data(self,sql,data):
+    with self.__write_lock:
+      self.__write_queue.append((sql,data))
+      queue_full = len(self.__write_queue) >= self.__write_queue_size
+
+      if self.__recovery:
+        # The data is kept till the recovery is done, so flushing is useless
+        queue_full = False
+        if len(self.__write_queue) > terrariumCollector.RECOVERY_QUEUE_SIZE:
+          # Drop a batch of the oldest rows at once, so the queue is not shifted for every new row
+          dropped = len(self.__write_queue) - terrariumCollector.RECOVERY_QUEUE_SIZE + self.__write_queue_size
+          del(self.__write_queue[:dropped])
+          self.__write_stats['dropped'] += dropped
+          logger.warning('TerrariumPI Collecter recovery is taking long. Dropped the oldest %s rows from the write queue' % (dropped,))
+
+    if queue_full:
+      # Do not wait for the write loop when the queue is full
+      logger.debug('Collector write queue is full with %s rows. Flushing directly' % (self.__write_queue_size,))
+      self.flush()
+
+  def __write_loop(self):
+    logger.info('Start terrariumPI collector write queue')
+    last_checkpoint = time.time()
+    last_statistics = time.time()
+    while self.__running:
+      sleep(self.__write_flush_interval)
+      if time.time() - last_statistics >= terrariumCollector.STATISTICS_STORE_INTERVAL:
+        self.__store_changed_statistics()
+        last_statistics = time.time()
+
+      self.flush()
+
+      if self.__wal_mode and self.__wal_checkpoint_interval > 0 and time.time() - last_checkpoint >= self.__wal_checkpoint_interval:
+        try:
+          self.__checkpoint()
+        except sqlite3.DatabaseError as ex:
+          logger.error('TerrariumPI Collecter exception! %s', (ex,))
+
+        last_checkpoint = time.time()
+
+  def __update_rollups(self,id,type,timestamp,newdata):
+    key = (id,type)
+    pending = self.__rollup_pending.get(key)
+    self.__rollup_pending[key] = (timestamp,newdata['current'],newdata['limit_min'],newdata['limit_max'],newdata['alarm_min'],newdata['alarm_max'],newdata['alarm'])
+
+    # A minute can be logged multiple times, where the last value wins. So only aggregate the previous minute when a new minute starts
+    if pending is not None and pending[0] != timestamp:
+      self.__aggregate_rollups(key,pending)
+
+  def __aggregate_rollups(self,key,data):
+    timestamp, current, limit_min, limit_max, alarm_min, alarm_max, alarm = data
+    if current is None:
+      return
+
+    self.__update_statistics(key,timestamp,current)
+
+    for rollup_table, period in terrariumCollector.ROLLUP_TABLES:
+      bucket = timestamp - (timestamp % period)
+      aggregate = self.__rollup_buckets.get((rollup_table,) + key)
+      if aggregate is None or aggregate['timestamp'] != bucket:
+        aggregate = {'timestamp' : bucket, 'sum' : 0.0, 'amount' : 0, 'min' : None, 'max' : None, 'alarm' : False}
+        if (rollup_table,) + key not in self.__rollup_buckets:
+          # First time after startup. Continue with the data that is already stored in this bucket
+          with self.__read_connection() as db:
+            row = db.execute('SELECT SUM(current) AS total, COUNT(current) AS amount, MIN(current) AS current_min, MAX(current) AS current_max, MAX(alarm) AS alarm FROM ' + self.__get_partition_source('sensor_data',bucket,timestamp) + ' WHERE id = ? AND type = ? AND timestamp >= ? AND timestamp < ?',
+                             key + (bucket,timestamp)).fetchone()
+
+          if row['amount'] > 0:
+            aggregate.update({'sum' : float(row['total']), 'amount' : row['amount'], 'min' : row['current_min'], 'max' : row['current_max'], 'alarm' : row['alarm'] == 1})
+
+        self.__rollup_buckets[(rollup_table,) + key] = aggregate
+
+      aggregate['sum'] += current
+      aggregate['amount'] += 1
+      aggregate['min'] = current if aggregate['min'] is None else min(aggregate['min'],current)
+      aggregate['max'] = current if aggregate['max'] is None else max(aggregate['max'],current)
+      aggregate['alarm'] = aggregate['alarm'] or alarm
+
+      self.__queue_data('REPLACE INTO ' + rollup_table + ' (id, type, timestamp, current, current_min, current_max, limit_min, limit_max, alarm_min, alarm_max, alarm, amount) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)',
+                        key + (bucket, aggregate['sum'] / aggregate['amount'], aggregate['min'], aggregate['max'], limit_min, limit_max, alarm_min, alarm_max, aggregate['alarm'], aggregate['amount']))
+
+  @staticmethod
+  def __get_statistics_period(timestamp,days = 0):
+    # Start of the local day of the timestamp, moved X days
+    day = datetime.date.fromtimestamp(timestamp) + datetime.timedelta(days=days)
+    return int(time.mktime(day.timetuple()))
+
+  def __store_statistics(self,key,statistics):
+    statistics['changed'] = False
+    self.__queue_data('REPLACE INTO sensor_statistics (id, type, timestamp, amount, mean, m2, min, max, sketch, timestamp_last) VALUES (?,?,?,?,?,?,?,?,?,?)',
+                      key + (statistics['period'], statistics['data'].amount, statistics['data'].mean, statistics['data'].m2, statistics['data'].minimum, statistics['data'].maximum,
+                             statistics['data'].sketch.to_json(), statistics['timestamp']))
+
+  def __store_changed_statistics(self):
+    with self.__statistics_lock:
+      for key in self.__statistics:
+        if self.__statistics[key]['changed']:
+          self.__store_statistics(key,self.__statistics[key])
+
+  def __update_statistics(self,key,timestamp,current):
+    period = terrariumCollector.__get_statistics_period(timestamp)
+    with self.__statistics_lock:
+      statistics = self.__statistics.get(key)
+      if statistics is None or statistics['period'] != period:
+        if statistics is not None and statistics['changed']:
+          # Store the last values of the previous day
+          self.__store_statistics(key,statistics)
+
+        # Continue with the statistics that are already stored for this period
+        with self.__read_connection() as db:
+          row = db.execute('SELECT amount, mean, m2, min, max, sketch, timestamp_last FROM sensor_statistics WHERE id = ? AND type = ? AND timestamp = ?',key + (period,)).fetchone()
+
+        statistics = {'period' : period,
+                      'data' : terrariumSensorStatistics() if row is None else terrariumSensorStatistics.from_row(row),
+                      'timestamp' : None if row is None else row['timestamp_last'],
+                      'changed' : False}
+        self.__statistics[key] = statistics
+
+      if statistics['timestamp'] is not None and timestamp <= statistics['timestamp']:
+        # Already added before a restart
+        return
+
+      statistics['data'].add(current)
+      statistics['timestamp'] = timestamp
+      statistics['changed'] = True
+
+  def __backfill_statistics(self,begin):
+    starttime = time.time()
+    # Only backfill till now. Newer values are added by the collector itself
+    stoptime = int(starttime)
+    stoptime -= stoptime % terrariumCollector.STORE_MODULO
+    # Work in local days, like the statistics periods
+    begin = terrariumCollector.__get_statistics_period(begin)
+    logger.warning('Creating the sensor statistics from {:%Y-%m-%d} till now. This can take some time.'.format(datetime.datetime.fromtimestamp(begin)))
+
+    progress = 0
+    chunk_start = begin
+    while chunk_start < stoptime:
+      if not self.__running:
+        logger.info('Stopped creating the sensor statistics. Will start again on the next start')
+        return
+
+      chunk_end = min(terrariumCollector.__get_statistics_period(chunk_start,1),stoptime)
+      statistics = {}
+      with self.__read_connection() as db:
+        for row in db.execute('SELECT id, type, timestamp, current FROM ' + self.__get_partition_source('sensor_data',chunk_start,chunk_end) +
+                              ' WHERE timestamp >= ? AND timestamp < ? AND current IS NOT NULL ORDER BY timestamp ASC',(chunk_start,chunk_end)):
+
+          key = (row['id'],row['type'])
+          if key not in statistics:
+            statistics[key] = {'period' : chunk_start, 'data' : terrariumSensorStatistics(), 'timestamp' : None, 'changed' : True}
+
+          statistics[key]['data'].add(row['current'])
+          statistics[key]['timestamp'] = row['timestamp']
+
+      with self.__statistics_lock:
+        for key in statistics:
+          live = self.__statistics.get(key)
+          if live is not None and live['period'] == chunk_start:
+            # The collector already started with this period, so add the older values
+            live['data'].merge(statistics[key]['data'])
+            live['timestamp'] = max(live['timestamp'],statistics[key]['timestamp'])
+            statistics[key] = live
+          elif chunk_end == stoptime:
+            self.__statistics[key] = statistics[key]
+
+          self.__store_statistics(key,statistics[key])
+
+      new_progress = int(((chunk_end - begin) / float(stoptime - begin)) * 100)
+      if new_progress >= progress + 10:
+        progress = new_progress
+        logger.info('Creating the sensor statistics is at {}%'.format(progress))
+
+      chunk_start = chunk_end
+      # Make time for other processes
+      sleep(0.1)
+
+    self.__set_metadata('sensor_statistics_backfilled',int(starttime))
+    logger.info('Created the sensor statistics in %.3f seconds' % (time.time()-starttime,))
+
+  def __backfill_rollups(self,begin):
+    starttime = time.time()
+    # Only backfill till the start of the current bucket of every rollup table. The open buckets are aggregated by the collector itself
+    stoptimes = {rollup_table : int(starttime) - (int(starttime) % period) for rollup_table, period in terrariumCollector.ROLLUP_TABLES}
+    stoptime = max(stoptimes.values())
+
+    # Work in chunks of whole days, so a bucket is never split over two chunks
+    chunk = terrariumCollector.ROLLUP_TABLES[-1][1]
+    begin -= begin % chunk
+    logger.warning('Creating sensor history rollup tables from {:%Y-%m-%d} till now. This can take some time, graphs will use the raw data till it is done.'.format(datetime.datetime.fromtimestamp(begin)))
+
+    progress = 0
+    for chunk_start in range(begin,stoptime,chunk):
+      if not self.__running:
+        logger.info('Stopped creating sensor history rollup tables. Will start again on the next start')
+        return
+
+      chunk_end = min(chunk_start + chunk,stoptime)
+      with self.__write_lock:
+        with self.db as db:
+          for rollup_table, period in terrariumCollector.ROLLUP_TABLES:
+            if chunk_start >= stoptimes[rollup_table]:
+              continue
+
+            db.execute('''REPLACE INTO ''' + rollup_table + ''' (id, type, timestamp, current, current_min, current_max, limit_min, limit_max, alarm_min, alarm_max, alarm, amount)
+                          SELECT id, type, timestamp - (timestamp % ?) AS bucket, AVG(current), MIN(current), MAX(current), MAX(limit_min), MAX(limit_max), MAX(alarm_min), MAX(alarm_max), MAX(alarm), COUNT(current)
+                          FROM ''' + self.__get_partition_source('sensor_data',chunk_start,chunk_end) + ''' WHERE timestamp >= ? AND timestamp < ? AND current IS NOT NULL
+                          GROUP BY id, type, bucket''',(period,chunk_start,min(chunk_end,stoptimes[rollup_table])))
+
+          db.commit()
+
+      new_progress = int(((chunk_end - begin) / float(stoptime - begin)) * 100)
+      if new_progress >= progress + 10:
+        progress = new_progress
+        logger.info('Creating sensor history rollup tables is at {}%'.format(progress))
+
+      # Make time for other processes
+      sleep(0.1)
+
+    self.__set_metadata('rollups_backfilled',int(starttime))
+    self.__rollups_ready = True
+    self.__invalidate_history_cache('sensors')
+    logger.info('Created sensor history rollup tables in %.3f seconds' % (time.time()-starttime,))
+
+  def __load_intervals(self):
+    for interval_table, source_table, fields in [('switch_intervals','switch_data',['state','power_wattage','water_flow']),
+                                                 ('door_intervals',  'door_data',  ['state'])]:
+
+      if self.__get_metadata(interval_table + '_backfilled') is None:
+        # Create the intervals from the existing history. Every record is valid till the next record of the same id
+        starttime = time.time()
+        logger.warning('Creating {} from the existing history. This can take some time.'.format(interval_table))
+        sql = 'REPLACE INTO ' + interval_table + ' (id, timestamp, timestamp_end, ' + ', '.join(fields) + ') VALUES (?,?,?' + (',?' * len(fields)) + ')'
+        with self.__read_connection() as db:
+          prev_row = None
+          intervals = []
+          for row in db.execute('SELECT id, timestamp, ' + ', '.join(fields) + ' FROM ' + source_table + ' ORDER BY id ASC, timestamp ASC'):
+            if prev_row is not None:
+              intervals.append((prev_row['id'], prev_row['timestamp'], row['timestamp'] if prev_row['id'] == row['id'] else None) + tuple(prev_row[field] for field in fields))
+
+            prev_row = row
+            if len(intervals) >= terrariumCollector.WRITE_QUEUE_SIZE:
+              with self.__write_lock:
+                with self.db as write_db:
+                  write_db.executemany(sql,intervals)
+
+              intervals = []
+
+          if prev_row is not None:
+            intervals.append((prev_row['id'], prev_row['timestamp'], None) + tuple(prev_row[field] for field in fields))
+
+        with self.__write_lock:
+          with self.db as write_db:
+            write_db.executemany(sql,intervals)
+
+        self.__set_metadata(interval_table + '_backfilled',int(starttime))
+        logger.info('Created {} in {:.3f} seconds'.format(interval_table,time.time()-starttime))
+
+      with self.__read_connection() as db:
+        for row in db.execute('SELECT id, timestamp, ' + ', '.join(fields) + ' FROM ' + interval_table + ' WHERE timestamp_end IS NULL'):
+          self.__open_intervals[(interval_table,row['id'])] = (row['timestamp'],) + tuple(row[field] for field in fields)
+
+  def __load_switch_totals(self):
+    if self.__get_metadata('switch_totals_calculated') is None:
+      self.recalculate_total_power_water_usage()
+      return
+
+    with self.__read_connection() as db:
+      for row in db.execute('SELECT id, duration, power_wattage, water_flow, timestamp_first, timestamp_last FROM switch_totals'):
+        self.__switch_totals[row['id']] = dict(row)
+
+  def __update_switch_totals(self,id,timestamp,timestamp_end,state,power_wattage,water_flow):
+    if state is None or float(state) <= 0:
+      return
+
+    duration = timestamp_end - timestamp
+    if id not in self.__switch_totals:
+      self.__switch_totals[id] = {'id' : id, 'duration' : 0, 'power_wattage' : 0.0, 'water_flow' : 0.0, 'timestamp_first' : timestamp, 'timestamp_last' : timestamp_end}
+
+    totals = self.__switch_totals[id]
+    totals['duration'] += duration
+    totals['power_wattage'] += duration * float(power_wattage)
+    # Devide by 60 to get Liters water used per minute based on seconds durations
+    totals['water_flow'] += (duration / 60.0) * float(water_flow)
+    totals['timestamp_first'] = min(totals['timestamp_first'],timestamp)
+    totals['timestamp_last'] = max(totals['timestamp_last'],timestamp_end)
+
+    self.__queue_data('REPLACE INTO switch_totals (id, duration, power_wattage, water_flow, timestamp_first, timestamp_last) VALUES (?,?,?,?,?,?)',
+                      (id, totals['duration'], totals['power_wattage'], totals['water_flow'], totals['timestamp_first'], totals['timestamp_last']))
+
+  def __load_alarms(self):
+    with self.__read_connection() as db:
+      for row in db.execute('SELECT id, type, timestamp, alarm, peak FROM sensor_alarms WHERE timestamp_end IS NULL'):
+        self.__open_alarms[(row['id'],row['type'])] = (row['timestamp'],row['alarm'],row['peak'])
+
+  @staticmethod
+  def __get_alarm(data):
+    # Returns 'min' or 'max' when the current value is outside the alarm limits
+    if data['current'] is None:
+      return None
+
+    if data['alarm_min'] is not None and data['current'] < data['alarm_min']:
+      return 'min'
+
+    if data['alarm_max'] is not None and data['current'] > data['alarm_max']:
+      return 'max'
+
+    return None
+
+  @staticmethod
+  def __update_alarms(open_alarms,id,type,timestamp,data):
+    # Returns the alarm periods that are changed by the new value. Open alarm periods have no end timestamp
+    changes = []
+    alarm = terrariumCollector.__get_alarm(data)
+    open_alarm = open_alarms.get((id,type))
+    if open_alarm is not None and open_alarm[1] != alarm:
+      changes.append((id,type,open_alarm[0],timestamp) + open_alarm[1:])
+      del(open_alarms[(id,type)])
+      open_alarm = None
+
+    if alarm is not None:
+      if open_alarm is None:
+        open_alarm = (timestamp,alarm,data['current'])
+      elif ('min' == alarm and data['current'] < open_alarm[2]) or ('max' == alarm and data['current'] > open_alarm[2]):
+        open_alarm = (open_alarm[0],alarm,data['current'])
+      else:
+        return changes
+
+      open_alarms[(id,type)] = open_alarm
+      changes.append((id,type,open_alarm[0],None) + open_alarm[1:])
+
+    return changes
+
+  def __backfill_alarms(self,begin):
+    starttime = time.time()
+    # Only backfill till now. Newer alarms are stored by the collector itself
+    stoptime = int(starttime)
+    stoptime -= stoptime % terrariumCollector.STORE_MODULO
+    chunk = 24 * 60 * 60
+    begin -= begin % chunk
+    logger.warning('Creating the sensor alarm history from {:%Y-%m-%d} till now. This can take some time.'.format(datetime.datetime.fromtimestamp(begin)))
+
+    sql = 'REPLACE INTO sensor_alarms (id, type, timestamp, timestamp_end, alarm, peak) VALUES (?,?,?,?,?,?)'
+    open_alarms = {}
+    last_timestamps = {}
+    progress = 0
+    for chunk_start in range(begin,stoptime,chunk):
+      if not self.__running:
+        logger.info('Stopped creating the sensor alarm history. Will start again on the next start')
+        return
+
+      chunk_end = min(chunk_start + chunk,stoptime)
+      alarms = []
+      with self.__read_connection() as db:
+        for row in db.execute('SELECT id, type, timestamp, current, alarm_min, alarm_max FROM ' + self.__get_partition_source('sensor_data',chunk_start,chunk_end) +
+                              ' WHERE timestamp >= ? AND timestamp < ? AND id != ? ORDER BY timestamp ASC',(chunk_start,chunk_end,terrariumCollector.AVERAGE_ID)):
+
+          alarms += [alarm for alarm in terrariumCollector.__update_alarms(open_alarms,row['id'],row['type'],row['timestamp'],row) if alarm[3] is not None]
+          last_timestamps[(row['id'],row['type'])] = row['timestamp']
+
+      if len(alarms) > 0:
+        with self.__write_lock:
+          with self.db as db:
+            db.executemany(sql,alarms)
+
+      new_progress = int(((chunk_end - begin) / float(stoptime - begin)) * 100)
+      if new_progress >= progress + 10:
+        progress = new_progress
+        logger.info('Creating the sensor alarm history is at {}%'.format(progress))
+
+      # Make time for other processes
+      sleep(0.1)
+
+    # Alarms that are still active are closed at the last stored value. New alarms are started by the collector
+    with self.__write_lock:
+      with self.db as db:
+        db.executemany(sql,[(id,type,open_alarm[0],last_timestamps[(id,type)]) + open_alarm[1:] for (id,type), open_alarm in open_alarms.items()])
+
+    self.__set_metadata('sensor_alarms_backfilled',int(starttime))
+    logger.info('Created the sensor alarm history in %.3f seconds' % (time.time()-starttime,))
+
+  def __update_interval(self,interval_table,id,timestamp,data):
+    # Close the current open interval and start a new one. Both are stored with the same query so the order is kept in the write queue
+    sql = 'REPLACE INTO ' + interval_table + ' (id, timestamp, timestamp_end, ' + ('state, power_wattage, water_flow' if 'switch_intervals' == interval_table else 'state') + ') VALUES (?,?,?' + (',?' * len(data)) + ')'
+    open_interval = self.__open_intervals.get((interval_table,id))
+    if open_interval is not None and open_interval[0] < timestamp:
+      self.__queue_data(sql,(id,open_interval[0],timestamp) + open_interval[1:])
+      if 'switch_intervals' == interval_table:
+        self.__update_switch_totals(id,open_interval[0],timestamp,*open_interval[1:])
+
+    self.__open_intervals[(interval_table,id)] = (timestamp,) + data
+    self.__queue_data(sql,(id,timestamp,None) + data)
+
+  def __get_sensor_table(self,stoptime,starttime):
+    sensor_table = self.__get_partition_source('sensor_data',stoptime,starttime)
+    if self.__rollups_ready:
+      if self.__partitions_enabled and self.__retention_months > 0 and stoptime < self.__get_retention_cutoff():
+        # The raw data is (partly) expired, so use the finest rollup table which is not affected by the retention
+        sensor_table = terrariumCollector.ROLLUP_TABLES[0][0]
+
+      for rollup_table, period in terrariumCollector.ROLLUP_TABLES:
+        if (starttime - stoptime) / period >= terrariumCollector.ROLLUP_MIN_POINTS:
+          sensor_table = rollup_table
+
+    return sensor_table
+
+  def __get_partition_range(self,timestamp):
+    # Partitions are per month in local time
+    begin = datetime.datetime.fromtimestamp(timestamp).replace(day=1,hour=0,minute=0,second=0,microsecond=0)
+    end = (begin + datetime.timedelta(days=32)).replace(day=1)
+    return (int(time.mktime(begin.timetuple())),int(time.mktime(end.timetuple())))
+
+  def __load_partitions(self):
+    with self.__read_connection() as db:
+      for table in terrariumCollector.PARTITION_TABLES:
+        self.__partitions[table] = []
+        for row in db.execute('SELECT name FROM sqlite_master WHERE type = ? AND name LIKE ? ORDER BY name ASC',('table',table + '_%')):
+          # Rollup tables like sensor_data_hour are not partitions
+          if len(row['name']) == len(table) + 7 and row['name'][-6:].isdigit():
+            begin = int(time.mktime(datetime.datetime.strptime(row['name'][-6:],'%Y%m').timetuple()))
+            self.__partitions[table].append((row['name'],) + self.__get_partition_range(begin))
+
+        # The original table is used as partition for the data from before partitioning was enabled
+        self.__partition_base[table] = db.execute('SELECT timestamp FROM ' + table + ' LIMIT 1').fetchone() is not None
+
+    if self.__partitions_enabled:
+      logger.info('Collector history is stored in monthly partitions. Found %s partitions%s' % (sum([len(partitions) for partitions in self.__partitions.values()]),
+                  ' with a retention of {} months'.format(self.__retention_months) if self.__retention_months > 0 else ''))
+      self.__expire_partitions()
+
+    elif self.__retention_months > 0:
+      logger.warning('Collector history retention only works with partitions enabled. Retention of %s months is ignored' % (self.__retention_months,))
+
+  def __create_partition(self,table,timestamp):
+    begin, end = self.__get_partition_range(timestamp)
+    partition = table + datetime.datetime.fromtimestamp(begin).strftime('_%Y%m')
+
+    with self.__write_lock:
+      if partition in [item[0] for item in self.__partitions[table]]:
+        return partition
+
+      # Copy the table and index layout from the original table
+      with self.db as db:
+        for row in db.execute('SELECT sql FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type DESC',(table,)).fetchall():
+          db.execute(row['sql'].replace(table,partition))
+
+        db.commit()
+
+      self.__partitions[table] = sorted(self.__partitions[table] + [(partition,begin,end)])
+
+    logger.info('Created new history partition %s' % (partition,))
+    self.__expire_partitions()
+    return partition
+
+  def __get_partition_table(self,table,timestamp):
+    if not self.__partitions_enabled:
+      self.__partition_base[table] = True
+      return table
+
+    for partition, begin, end in self.__partitions[table]:
+      if begin <= timestamp < end:
+        return partition
+
+    return self.__create_partition(table,timestamp)
+
+  def __get_partition_tables(self,table,stoptime = None,starttime = None):
+    # Only read the partitions that overlap with the requested period
+    tables = [table] if self.__partition_base[table] else []
+    tables += [partition for partition, begin, end in self.__partitions[table] if (stoptime is None or end > stoptime) and (starttime is None or begin <= starttime)]
+    return tables
+
+  def __get_partition_source(self,table,stoptime = None,starttime = None):
+    queries = ['SELECT * FROM ' + partition for partition in self.__get_partition_tables(table,stoptime,starttime)]
+
+    if 'sensor_data' == table:
+      # Compact sensor data is shown with the same columns as the sensor_data table. The CROSS JOIN forces SQLite to loop over the
+      # few sensors first, so the values are read by their primary key. The limits are the last change before the value
+      queries += ['''SELECT k.id, k.type, v.timestamp, v.current, l.limit_min, l.limit_max, l.alarm_min, l.alarm_max, v.alarm
+                     FROM sensor_keys k CROSS JOIN ''' + partition + ''' v ON v.sensor_key = k.key
+                     LEFT JOIN sensor_limits l ON l.sensor_key = v.sensor_key AND l.timestamp = (SELECT MAX(timestamp) FROM sensor_limits WHERE sensor_key = v.sensor_key AND timestamp <= v.timestamp)'''
+                  for partition in self.__get_partition_tables('sensor_values',stoptime,starttime)]
+
+    if len(queries) == 0:
+      return table
+
+    if len(queries) == 1 and queries[0].startswith('SELECT * FROM '):
+      return queries[0][len('SELECT * FROM '):]
+
+    return '(' + ' UNION ALL '.join(queries) + ')'
+
+  def __get_retention_cutoff(self):
+    # Keep the current month and X full months before that
+    month = datetime.datetime.fromtimestamp(self.__get_partition_range(time.time())[0])
+    months = month.year * 12 + month.month - 1 - self.__retention_months
+    return int(time.mktime(datetime.datetime(months // 12,(months % 12) + 1,1).timetuple()))
+
+  def __expire_partitions(self):
+    if self.__retention_months <= 0:
+      return
+
+    cutoff = self.__get_retention_cutoff()
+    with self.__write_lock:
+      for table in terrariumCollector.PARTITION_TABLES:
+        for partition, begin, end in self.__partitions[table]:
+          if end > cutoff:
+            continue
+
+          try:
+            # Dropping a whole table is instant compared to deleting all the rows. The free space will be reused for new data
+            with self.db as db:
+              db.execute('DROP TABLE IF EXISTS ' + partition)
+              db.commit()
+
+            self.__partitions[table] = [item for item in self.__partitions[table] if item[0] != partition]
+            self.__invalidate_history_cache()
+            logger.info('Removed expired history partition %s' % (partition,))
+          except sqlite3.DatabaseError as ex:
+            # The table can be locked by a running query. Try again at the next partition check
+            logger.warning('Could not remove expired history partition %s: %s' % (partition,ex))
+
+  def __migrate_partitions(self):
+    # Move the history in the original tables to the monthly partitions. Work in chunks of a day so the write queue is not blocked too long
+    starttime = time.time()
+    chunk = 24 * 60 * 60
+    for table in terrariumCollector.PARTITION_TABLES:
+      # The old sensor data is moved to the compact tables, which are partitioned themselves
+      if not self.__partition_base[table] or (self.__compact_sensor_data and 'sensor_data' == table):
+        continue
+
+      with self.__read_connection() as db:
+        row = db.execute('SELECT MIN(timestamp) AS begin, MAX(timestamp) AS end FROM ' + table).fetchone()
+
+      logger.warning('Moving {} history from {:%Y-%m-%d} till {:%Y-%m-%d} to monthly partitions. This can take some time.'.format(table,datetime.datetime.fromtimestamp(row['begin']),datetime.datetime.fromtimestamp(row['end'])))
+      for chunk_start in range(row['begin'] - (row['begin'] % chunk),row['end'] + 1,chunk):
+        if not self.__running:
+          logger.info('Stopped moving history to monthly partitions. Will start again on the next start')
+          return
+
+        # Split the chunk at the month border, as the partitions are in local time
+        borders = sorted(set([chunk_start,min(self.__get_partition_range(chunk_start)[1],chunk_start + chunk),chunk_start + chunk]))
+        for part_start, part_end in zip(borders[:-1],borders[1:]):
+          partition = self.__get_partition_table(table,part_start)
+          with self.__write_lock:
+            with self.db as db:
+              db.execute('REPLACE INTO ' + partition + ' SELECT * FROM ' + table + ' WHERE timestamp >= ? AND timestamp < ?',(part_start,part_end))
+              db.execute('DELETE FROM ' + table + ' WHERE timestamp >= ? AND timestamp < ?',(part_start,part_end))
+              db.commit()
+
+        # Make time for other processes
+        sleep(0.1)
+
+      with self.__write_lock:
+        with self.db as db:
+          self.__partition_base[table] = db.execute('SELECT timestamp FROM ' + table + ' LIMIT 1').fetchone() is not None
+
+    logger.info('Moved the history to monthly partitions in %.3f seconds' % (time.time()-starttime,))
+
+  def __load_sensor_keys(self):
+    with self.__read_connection() as db:
+      self.__sensor_keys = {(row['id'],row['type']) : row['key'] for row in db.execute('SELECT key, id, type FROM sensor_keys')}
+      open_limits = db.execute('SELECT sensor_key, timestamp, limit_min, limit_max, alarm_min, alarm_max FROM sensor_limits WHERE timestamp_end IS NULL').fetchall()
+
+    if not self.__compact_sensor_data:
+      if len(open_limits) > 0:
+        # Close the open limits, as new sensor data is stored in the sensor_data table from now on
+        with self.__write_lock:
+          with self.db as db:
+            db.execute('UPDATE sensor_limits SET timestamp_end = ? WHERE timestamp_end IS NULL',(int(time.time()),))
+            db.commit()
+
+      return
+
+    self.__sensor_limits = {row['sensor_key'] : (row['timestamp'],row['limit_min'],row['limit_max'],row['alarm_min'],row['alarm_max']) for row in open_limits}
+    logger.info('Collector sensor history is stored in compact tables with %s sensors' % (len(self.__sensor_keys),))
+
+  def __get_sensor_key(self,id,type):
+    key = self.__sensor_keys.get((id,type))
+    if key is None:
+      # A new sensor is stored directly, as the key is needed for the queued data
+      with self.__write_lock:
+        with self.db as db:
+          db.execute('INSERT OR IGNORE INTO sensor_keys (id, type) VALUES (?,?)',(id,type))
+          key = db.execute('SELECT key FROM sensor_keys WHERE id = ? AND type = ?',(id,type)).fetchone()['key']
+          db.commit()
+
+        self.__sensor_keys[(id,type)] = key
+
+    return key
+
+  def __update_sensor_limits(self,sensor_key,timestamp,limits):
+    # Only store the limits and alarm values when they are changed. The previous values are valid till the new values
+    sql = 'REPLACE INTO sensor_limits (sensor_key, timestamp, timestamp_end, limit_min, limit_max, alarm_min, alarm_max) VALUES (?,?,?,?,?,?,?)'
+    open_limits = self.__sensor_limits.get(sensor_key)
+    if open_limits is not None:
+      if open_limits[1:] == limits:
+        return
+
+      if open_limits[0] < timestamp:
+        self.__queue_data(sql,(sensor_key,open_limits[0],timestamp) + open_limits[1:])
+      else:
+        timestamp = open_limits[0]
+
+    self.__sensor_limits[sensor_key] = (timestamp,) + limits
+    self.__queue_data(sql,(sensor_key,timestamp,None) + limits)
+
+  def __compact_sensor_history(self):
+    # Move the sensor data from the sensor_data table(s) to the compact tables. Work in chunks of a day so the write queue is not blocked too long
+    starttime = time.time()
+    chunk = 24 * 60 * 60
+    with self.__read_connection() as db:
+      row = db.execute('SELECT MIN(timestamp) AS begin, MAX(timestamp) AS end FROM ' + ' UNION ALL SELECT MIN(timestamp), MAX(timestamp) FROM '.join(self.__get_partition_tables('sensor_data'))).fetchall()
+
+    begin = min([item[0] for item in row if item[0] is not None] + [int(starttime)])
+    end = max([item[1] for item in row if item[1] is not None] + [begin])
+    logger.warning('Moving sensor history from {:%Y-%m-%d} till {:%Y-%m-%d} to the compact sensor tables. This can take some time.'.format(datetime.datetime.fromtimestamp(begin),datetime.datetime.fromtimestamp(end)))
+
+    sql = 'REPLACE INTO sensor_limits (sensor_key, timestamp, timestamp_end, limit_min, limit_max, alarm_min, alarm_max) VALUES (?,?,?,?,?,?,?)'
+    sensor_limits = {}
+    progress = 0
+    for chunk_start in range(begin - (begin % chunk),end + 1,chunk):
+      if not self.__running:
+        logger.info('Stopped moving sensor history to the compact sensor tables. Will start again on the next start')
+        return
+
+      tables = self.__get_partition_tables('sensor_data',chunk_start,chunk_start + chunk)
+      if len(tables) == 0:
+        continue
+
+      values = {}
+      limits = {}
+      with self.__read_connection() as db:
+        # Only read the sensor_data tables, as the source for sensor_data also contains the compact tables
+        for row in db.execute('SELECT * FROM (' + ' UNION ALL '.join(['SELECT * FROM ' + table for table in tables]) + ') WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp ASC',
+                              (chunk_start,chunk_start + chunk)).fetchall():
+
+          sensor_key = self.__get_sensor_key(row['id'],row['type'])
+          partition = self.__get_partition_table('sensor_values',row['timestamp'])
+          if partition not in values:
+            values[partition] = []
+
+          values[partition].append((sensor_key,row['timestamp'],row['current'],row['alarm']))
+
+          # Keep the limits valid till the last moved value, so they will not overlap with the limits of new sensor data
+          row_limits = (row['limit_min'],row['limit_max'],row['alarm_min'],row['alarm_max'])
+          previous = sensor_limits.get(sensor_key)
+          if previous is not None and previous[2:] != row_limits:
+            limits[(sensor_key,previous[0])] = (sensor_key,previous[0],row['timestamp']) + previous[2:]
+            previous = None
+
+          sensor_limits[sensor_key] = (row['timestamp'] if previous is None else previous[0],row['timestamp'] + 1) + row_limits
+          limits[(sensor_key,sensor_limits[sensor_key][0])] = (sensor_key,) + sensor_limits[sensor_key]
+
+      with self.__write_lock:
+        with self.db as db:
+          for partition in values:
+            db.executemany('REPLACE INTO ' + partition + ' (sensor_key, timestamp, current, alarm) VALUES (?,?,?,?)',values[partition])
+
+          # The limits of the new sensor data take over when the moved data overlaps with it
+          for sensor_key, limits_start, limits_end, limit_min, limit_max, alarm_min, alarm_max in limits.values():
+            if sensor_key in self.__sensor_limits:
+              limits_end = min(limits_end,self.__sensor_limits[sensor_key][0])
+
+            if limits_end > limits_start:
+              db.execute(sql,(sensor_key,limits_start,limits_end,limit_min,limit_max,alarm_min,alarm_max))
+          for table in tables:
+            db.execute('DELETE FROM ' + table + ' WHERE timestamp >= ? AND timestamp < ?',(chunk_start,chunk_start + chunk))
+
+          db.commit()
+
+      new_progress = int(((chunk_start - begin) / float(max(1,end - begin))) * 100)
+      if new_progress >= progress + 10:
+        progress = new_progress
+        logger.info('Moving sensor history to the compact sensor tables is at {}%'.format(progress))
+
+      # Make time for other processes
+      sleep(0.1)
+
+    # Remove the empty sensor_data partitions
+    with self.__write_lock:
+      with self.db as db:
+        for partition, partition_begin, partition_end in self.__partitions['sensor_data']:
+          db.execute('DROP TABLE IF EXISTS ' + partition)
+
+        db.commit()
+
+      self.__partitions['sensor_data'] = []
+      self.__partition_base['sensor_data'] = False
+
+    self.__invalidate_history_cache('sensors')
+    logger.info('Moved the sensor history to the compact sensor tables in %.3f seconds' % (time.time()-starttime,))
+
+  def __load_deadbands(self):
+    with self.__read_connection() as db:
+      for row in db.execute('SELECT id, type, timestamp, timestamp_end, heartbeat FROM sensor_deadbands ORDER BY timestamp ASC'):
+        key = (row['id'],row['type'])
+        if key not in self.__deadband_periods:
+          self.__deadband_periods[key] = []
+
+        self.__deadband_periods[key].append({'timestamp' : row['timestamp'], 'timestamp_end' : row['timestamp_end'], 'heartbeat' : row['heartbeat']})
+
+    for key in self.__deadband_periods:
+      period = self.__deadband_periods[key][-1]
+      if period['timestamp_end'] is None:
+        # TerrariumPI did not stop normally. The skipped values are lost, so the period ends at the last stored value
+        with self.__read_connection() as db:
+          row = db.execute('SELECT MAX(timestamp) AS timestamp FROM ' + self.__get_partition_source('sensor_data',period['timestamp']) + ' WHERE id = ? AND type = ?',key).fetchone()
+
+        self.__end_deadband_period(key,period['timestamp'] if row['timestamp'] is None else max(period['timestamp'],row['timestamp']))
+
+  def __end_deadband_period(self,key,timestamp):
+    period = self.__deadband_periods[key][-1]
+    period['timestamp_end'] = timestamp
+    self.__queue_data('REPLACE INTO sensor_deadbands (id, type, timestamp, timestamp_end, heartbeat) VALUES (?,?,?,?,?)',
+                      key + (period['timestamp'],period['timestamp_end'],period['heartbeat']))
+
+  def __close_deadband(self,id,type):
+    # The sensor is not stored with a deadband anymore. Store the last skipped value, so the filled history ends with the last real value
+    stored = self.__deadband_values.pop((id,type),None)
+    periods = self.__deadband_periods.get((id,type))
+    if periods is None or periods[-1]['timestamp_end'] is not None:
+      return
+
+    timestamp = periods[-1]['timestamp']
+    if stored is not None:
+      timestamp = max(timestamp,stored['timestamp'])
+      if stored['skipped'] is not None:
+        timestamp = stored['skipped'][0]
+        self.__store_sensor_data(id,type,stored['skipped'][0],stored['skipped'][1])
+
+    self.__end_deadband_period((id,type),timestamp)
+    self.__invalidate_history_cache('sensors',type,id)
+
+  def __deadband_changed(self,id,type,timestamp,newdata):
+    deadband = float(newdata.get('deadband') or 0)
+    heartbeat = int(newdata.get('heartbeat') or 0)
+    if (deadband <= 0 and heartbeat <= 0) or newdata.get('error'):
+      # All values are stored without a deadband, and when the sensor is in error
+      self.__close_deadband(id,type)
+      return True
+
+    heartbeat = min(heartbeat if heartbeat > 0 else terrariumCollector.DEADBAND_HEARTBEAT,terrariumCollector.DEADBAND_MAX_HEARTBEAT)
+    # Changed limits or alarm values are always stored
+    values = (newdata['limit_min'], newdata['limit_max'], newdata['alarm_min'], newdata['alarm_max'], newdata['alarm'])
+    stored = self.__deadband_values.get((id,type))
+    if stored is not None and timestamp - (stored['timestamp'] if stored['skipped'] is None else stored['skipped'][0]) > \
+       max(int(newdata.get('update_interval') or 0),terrariumCollector.STORE_MODULO) + terrariumCollector.STORE_MODULO:
+      # The sensor did not report for a while, so the filled history ends at the last received value
+      self.__close_deadband(id,type)
+      stored = None
+
+    if stored is None or stored['timestamp'] == timestamp or timestamp - stored['timestamp'] >= heartbeat or stored['values'] != values or \
+       stored['current'] is None or newdata['current'] is None or abs(newdata['current'] - stored['current']) > deadband:
+
+      self.__deadband_values[(id,type)] = {'timestamp' : timestamp, 'current' : newdata['current'], 'values' : values, 'skipped' : None}
+      return True
+
+    # The last skipped value is the end of the filled history, and is stored when the deadband period ends
+    stored['skipped'] = (timestamp,newdata)
+
+    periods = self.__deadband_periods.get((id,type))
+    if periods is None or periods[-1]['timestamp_end'] is not None:
+      # Start a new period from the last stored value
+      if periods is None:
+        periods = self.__deadband_periods[(id,type)] = []
+
+      periods.append({'timestamp' : stored['timestamp'], 'timestamp_end' : None, 'heartbeat' : heartbeat})
+      self.__queue_data('REPLACE INTO sensor_deadbands (id, type, timestamp, timestamp_end, heartbeat) VALUES (?,?,?,?,?)',
+                        (id, type, stored['timestamp'], None, heartbeat))
+      # The cached sensor history is not filled yet
+      self.__invalidate_history_cache('sensors')
+
+    elif heartbeat > periods[-1]['heartbeat']:
+      periods[-1]['heartbeat'] = heartbeat
+      self.__queue_data('REPLACE INTO sensor_deadbands (id, type, timestamp, timestamp_end, heartbeat) VALUES (?,?,?,?,?)',
+                        (id, type, periods[-1]['timestamp'], None, heartbeat))
+
+    return False
+
+  def __get_deadband_period(self,id,type,timestamp):
+    # The heartbeat and end of the deadband period of the sensor at the timestamp. Open periods end at the last received value
+    for period in reversed(self.__deadband_periods.get((id,type),[])):
+      if period['timestamp'] > timestamp:
+        continue
+
+      timestamp_end = period['timestamp_end']
+      if timestamp_end is None:
+        stored = self.__deadband_values.get((id,type))
+        timestamp_end = period['timestamp'] if stored is None else (stored['timestamp'] if stored['skipped'] is None else stored['skipped'][0])
+
+      return (period['heartbeat'],timestamp_end) if timestamp <= timestamp_end else None
+
+    return None
+
+  def __get_deadband_heartbeat(self,stoptime,starttime):
+    # The longest heartbeat of the deadband periods in the history period. Zero when the history does not need to be filled
+    heartbeat = 0
+    for key in self.__deadband_periods:
+      for period in self.__deadband_periods[key]:
+        if period['timestamp'] <= starttime and (period['timestamp_end'] is None or period['timestamp_end'] >= stoptime - period['heartbeat']):
+          heartbeat = max(heartbeat,period['heartbeat'])
+
+    return heartbeat
+
+  def __load_history_buffers(self):
+    if not self.__history_buffer_enabled:
+      return
+
+    starttime = int(time.time())
+    stoptime = starttime - (self.__history_buffer_size - 2) * terrariumCollector.STORE_MODULO
     timer = time.time()
+    with self.__read_connection() as db:
+      rows = db.execute('SELECT id, type, timestamp, ' + ', '.join(terrariumHistoryBuffer.FIELDS) + ' FROM ' + self.__get_partition_source('sensor_data',stoptime,starttime) +
+                        ' WHERE timestamp >= ? ORDER BY timestamp ASC',(stoptime,))
 
-    if self.__recovery:
-      logger.warn('TerrariumPI Collecter is in recovery mode. Cannot store new logging data!')
+      buffers = {}
+      for row in rows:
+        if (row['type'],row['id']) not in buffers:
+          buffers[(row['type'],row['id'])] = terrariumHistoryBuffer(self.__history_buffer_size)
+
+        buffers[(row['type'],row['id'])].append(row['timestamp'],row)
+
+    with self.__history_buffer_lock:
+      self.__history_buffers = buffers
+      self.__history_buffer_since = stoptime
+
+    logger.info('TerrariumPI Collecter loaded the history of %s sensors in memory in %.2f seconds' % (len(self.__history_buffers),time.time()-timer))
+
+  def __update_history_buffer(self,id,type,timestamp,data):
+    if not self.__history_buffer_enabled:
       return
 
+    with self.__history_buffer_lock:
+      if (type,id) not in self.__history_buffers:
+        self.__history_buffers[(type,id)] = terrariumHistoryBuffer(self.__history_buffer_size)
+
+      self.__history_buffers[(type,id)].append(timestamp,data)
+
+  def __get_memory_history(self,parameters,stoptime,starttime,period_stoptime,ids):
+    # Read the sensor history from memory when the period is completely in the history buffers. Else return None
+    if not self.__history_buffer_enabled or self.__history_buffer_since is None or \
+       stoptime < max(self.__history_buffer_since,int(time.time()) - (self.__history_buffer_size - 2) * terrariumCollector.STORE_MODULO):
+      return None
+
+    if len(parameters) > 0 and parameters[0] == 'average' and not self.__use_average_series(period_stoptime):
+      return None
+
+    selected = self.__get_history_selection(parameters,ids)
+    with self.__history_buffer_lock:
+      history = [buffer.get_history(id,type,stoptime,starttime) for (type, id), buffer in self.__history_buffers.items() if selected(type,id)]
+
+    # Same order as the database query
+    return heapq.merge(*history,key=lambda row: (row['timestamp'],row['type'],row['id']))
+
+  def __get_history_selection(self,parameters,ids):
+    # Select the same sensors as the history query
+    parameters = tuple(parameters)
+    ids = None if ids is None else tuple(ids)
+    if len(parameters) > 0 and parameters[0] == 'average':
+      return lambda type, id: id == terrariumCollector.AVERAGE_ID and (len(parameters) != 2 or type == parameters[1])
+    elif len(parameters) == 2 and parameters[0] in terrariumCollector.HISTORY_SENSOR_TYPES:
+      return lambda type, id: type == parameters[0] and id == parameters[1]
+    elif len(parameters) == 1 and parameters[0] in terrariumCollector.HISTORY_SENSOR_TYPES:
+      return lambda type, id: type == parameters[0] and id != terrariumCollector.AVERAGE_ID
+    elif len(parameters) == 1:
+      return lambda type, id: id == parameters[0]
+    elif len(parameters) == 0 and ids is not None:
+      return lambda type, id: id in ids
+    elif len(parameters) == 0:
+      return lambda type, id: id != terrariumCollector.AVERAGE_ID
+
+    return lambda type, id: True
+
+  def __fill_sensor_history(self,rows,fields,stoptime,starttime,average):
+    # Repeat the last stored value of sensors with a deadband every minute, so the history is the same as when all values are stored
+    series = {}
+    for row in rows:
+      key = (row['type'],row['id'])
+      if key not in series:
+        series[key] = []
+
+      series[key].append(dict(row))
+
+    history = []
+    for key in series:
+      items = series[key]
+      for index, row in enumerate(items):
+        if row['timestamp'] >= stoptime:
+          history.append(row)
+
+        period = self.__get_deadband_period(row['id'],row['type'],row['timestamp'])
+        if period is None:
+          # Not stored with a deadband, so a gap in the history is a real gap
+          continue
+
+        heartbeat, timestamp_end = period
+        # A value is stored at least every heartbeat, so the value at the heartbeat is a stored value
+        end = min(items[index + 1]['timestamp'] if index + 1 < len(items) else starttime + 1,row['timestamp'] + heartbeat,timestamp_end + 1)
+        for timestamp in range(row['timestamp'] + terrariumCollector.STORE_MODULO,end,terrariumCollector.STORE_MODULO):
+          if timestamp >= stoptime:
+            history.append(dict(row,timestamp=timestamp))
+
+    if average:
+      averages = {}
+      for row in history:
+        key = (row['timestamp'],row['type'])
+        if key not in averages:
+          averages[key] = {'id' : 'average', 'type' : row['type'], 'timestamp' : row['timestamp'], 'values' : {field : [] for field in fields}}
+
+        for field in fields:
+          if row[field] is not None:
+            averages[key]['values'][field].append(row[field])
+
+      history = []
+      for key in sorted(averages.keys()):
+        row = averages[key]
+        for field in fields:
+          row[field] = (sum(row['values'][field]) / len(row['values'][field])) if len(row['values'][field]) > 0 else None
+
+        del(row['values'])
+        history.append(row)
+
+      return history
+
+    return sorted(history,key=lambda row: (row['timestamp'],row['type'],row['id']))
+
+  def __store_sensor_data(self,id,type,timestamp,newdata):
+    self.__extend_history_cache(type,id,timestamp,newdata)
+    self.__update_history_buffer(id,type,timestamp,newdata)
+    if self.__compact_sensor_data:
+      sensor_key = self.__get_sensor_key(id,type)
+      self.__queue_data('REPLACE INTO ' + self.__get_partition_table('sensor_values',timestamp) + ' (sensor_key, timestamp, current, alarm) VALUES (?,?,?,?)',
+                        (sensor_key, timestamp, newdata['current'], newdata['alarm']))
+      self.__update_sensor_limits(sensor_key,timestamp,(newdata['limit_min'], newdata['limit_max'], newdata['alarm_min'], newdata['alarm_max']))
+    else:
+      self.__queue_data('REPLACE INTO ' + self.__get_partition_table('sensor_data',timestamp) + ' (id, type, timestamp, current, limit_min, limit_max, alarm_min, alarm_max, alarm) VALUES (?,?,?,?,?,?,?,?,?)',
+                        (id, type, timestamp, newdata['current'], newdata['limit_min'], newdata['limit_max'], newdata['alarm_min'], newdata['alarm_max'], newdata['alarm']))
+
+  def __log_data(self,type,id,newdata):
     now = int(time.time())
-    rows = []
     if type not in ['switches','door']:
       now -= (now % terrariumCollector.STORE_MODULO)
 
-    try:
-      with self.db as db:
-        cur = db.cursor()
-
-        if type in ['humidity','moisture','temperature','distance','ph','conductivity','light','uva','uvb','uvi','fertility','co2','volume']:
-          cur.execute('REPLACE INTO sensor_data (id, type, timestamp, current, limit_min, limit_max, alarm_min, alarm_max, alarm) VALUES (?,?,?,?,?,?,?,?,?)',
-                      (id, type, now, newdata['current'], newdata['limit_min'], newdata['limit_max'], newdata['alarm_min'], newdata['alarm_max'], newdata['alarm']))
+    if type in terrariumCollector.SENSOR_TYPES:
+      self.__update_rollups(id,type,now,newdata)
+      if id != terrariumCollector.AVERAGE_ID:
+        for alarm in terrariumCollector.__update_alarms(self.__open_alarms,id,type,now,newdata):
+          self.__queue_data('REPLACE INTO sensor_alarms (id, type, timestamp, timestamp_end, alarm, peak) VALUES (?,?,?,?,?,?)',alarm)
+
+      if not self.__deadband_changed(id,type,now,newdata):
+        # The history will repeat the last stored value
+        return
+
+      self.__store_sensor_data(id,type,now,newdata)
+
+    if type in ['weather']:
+      self.__invalidate_history_cache('weather')
+      self.__queue_data('REPLACE INTO ' + self.__get_partition_table('weather_data',now) + ' (timestamp, wind_speed, temperature, pressure, wind_direction, weather, icon) VALUES (?,?,?,?,?,?,?)',
+                        (now, newdata['wind_speed'], newdata['temperature'], newdata['pressure'], newdata['wind_direction'], newdata['weather'], newdata['icon']))
+
+    if type in ['system']:
+      self.__invalidate_history_cache('system')
+      self.__queue_data('REPLACE INTO ' + self.__get_partition_table('system_data',now) + ' (timestamp, load_load1, load_load5, load_load15, uptime, temperature, cores, memory_total, memory_used, memory_free, disk_total, disk_used, disk_free) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
+                        (now, newdata['load']['load1'], newdata['load']['load5'], newdata['load']['load15'], newdata['uptime'], newdata['temperature'], newdata['cores'], newdata['memory']['total'], newdata['memory']['used'], newdata['memory']['free'],newdata['disk']['total'], newdata['disk']['used'], newdata['disk']['free']))
+
+    if type in ['switches']:
+      if 'time' in newdata:
+        now = newdata['time']
+
+      self.__invalidate_history_cache('switches',None,id)
+      self.__queue_data('REPLACE INTO switch_data (id, timestamp, state, power_wattage, water_flow) VALUES (?,?,?,?,?)',
+                        (id, now, newdata['state'], newdata['current_power_wattage'], newdata['current_water_flow']))
+      self.__update_interval('switch_intervals',id,now,(newdata['state'], newdata['current_power_wattage'], newdata['current_water_flow']))
+
+    if type in ['door']:
+      self.__invalidate_history_cache('doors',None,id)
+      self.__queue_data('REPLACE INTO door_data (id, timestamp, state) VALUES (?,?,?)',
+                        (id, now, newdata))
+      self.__update_interval('door_intervals',id,now,(newdata,))
+
+  def flush(self):
+    with self.__write_lock:
+      # During a recovery the data is kept in the queue
+      if len(self.__write_queue) == 0 or self.__recovery:
+        return
+
+      timer = time.time()
+      queue = self.__write_queue
+      self.__write_queue = []
+
+      # Group the rows per query so they can be stored with executemany. The order of the rows per query is kept,
+      # so multiple updates on the same record will end up with the last value
+      batches = {}
+      for sql, data in queue:
+        if sql not in batches:
+          batches[sql] = []
+
+        batches[sql].append(data)
 
-        if type in ['weather']:
-          cur.execute('REPLACE INTO weather_data (timestamp, wind_speed, temperature, pressure, wind_direction, weather, icon) VALUES (?,?,?,?,?,?,?)',
-                      (now, newdata['wind_speed'], newdata['temperature'], newdata['pressure'], newdata['wind_direction'], newdata['weather'], newdata['icon']))
+      try:
+        with self.db as db:
+          cur = db.cursor()
+          for sql in batches:
+            cur.executemany(sql,batches[sql])
 
-        if type in ['system']:
-          cur.execute('REPLACE INTO system_data (timestamp, load_load1, load_load5, load_load15, uptime, temperature, cores, memory_total, memory_used, memory_free, disk_total, disk_used, disk_free) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)',
-                      (now, newdata['load']['load1'], newdata['load']['load5'], newdata['load']['load15'], newdata['uptime'], newdata['temperature'], newdata['cores'], newdata['memory']['total'], newdata['memory']['used'], newdata['memory']['free'],newdata['disk']['total'], newdata['disk']['used'], newdata['disk']['free']))
+          db.commit()
+      except sqlite3.DatabaseError as ex:
+        logger.error('TerrariumPI Collecter exception! %s', (ex,))
+        if 'database disk image is malformed' == str(ex):
+          # Put the data back in the queue, so it is stored after the recovery
+          self.__write_queue = queue + self.__write_queue
+          self.__recover()
 
-        if type in ['switches']:
-          if 'time' in newdata:
-            now = newdata['time']
+      duration = time.time() - timer
+      self.__write_stats['flushes'] += 1
+      self.__write_stats['rows'] += len(queue)
+      self.__write_stats['last_flush_rows'] = len(queue)
+      self.__write_stats['last_flush_duration'] = duration
+      self.__write_stats['max_flush_duration'] = max(duration,self.__write_stats['max_flush_duration'])
+      self.__write_stats['total_flush_duration'] += duration
 
-          cur.execute('REPLACE INTO switch_data (id, timestamp, state, power_wattage, water_flow) VALUES (?,?,?,?,?)',
-                      (id, now, newdata['state'], newdata['current_power_wattage'], newdata['current_water_flow']))
+    logger.debug('Timing: flushed %s rows in %s queries in %s seconds.' % (len(queue),len(batches),duration))
 
-        if type in ['door']:
-          cur.execute('REPLACE INTO door_data (id, timestamp, state) VALUES (?,?,?)',
-                      (id, now, newdata))
+  def get_write_queue_stats(self):
+    with self.__write_lock:
+      data = copy.copy(self.__write_stats)
+      data['depth'] = len(self.__write_queue)
 
-        db.commit()
-    except sqlite3.DatabaseError as ex:
-      logger.error('TerrariumPI Collecter exception! %s', (ex,))
-      if 'database disk image is malformed' == str(ex):
-        self.__recover()
+    data['size'] = self.__write_queue_size
+    data['flush_interval'] = self.__write_flush_interval
+    data['avg_flush_duration'] = (data['total_flush_duration'] / data['flushes']) if data['flushes'] > 0 else 0.0
+    del(data['total_flush_duration'])
 
-    logger.debug('Timing: updating %s data in %s seconds.' % (type,time.time()-timer))
+    return data
 
   def stop(self):
+    self.__running = False
+    # Aggregate the last logged minutes before storing the last data in the queue
+    for key in self.__rollup_pending:
+      self.__aggregate_rollups(key,self.__rollup_pending[key])
+
+    self.__rollup_pending = {}
+    self.__store_changed_statistics()
+    # The skipped values are lost after a restart, so end the deadband periods with the last values
+    for (id, type) in list(self.__deadband_periods.keys()):
+      self.__close_deadband(id,type)
+
+    if self.__recovery:
+      logger.warning('TerrariumPI Collecter is stopped during a recovery. Losing %s rows in the write queue' % (len(self.__write_queue),))
+
+    # Store the last data in the queue before closing the database
+    self.flush()
+    self.__close_read_connections()
     self.db.close()
     logger.info('Shutdown data collector')
 
-  def get_total_power_water_usage(self):
-    timer = time.time()
-
+  def get_total_power_water_usage(self,switchid = None):
     totals = {'power_wattage' : {'duration' : 0 , 'wattage' : 0.0},
               'water_flow'    : {'duration' : 0 , 'water'   : 0.0}}
 
-    sql = '''SELECT SUM(total_wattage) AS Watt, SUM(total_water) AS Water, MAX(timestamp2)-MIN(timestamp) AS TotalTime FROM (
-                SELECT
-                    t1.timestamp as timestamp,
-                    t2.timestamp as timestamp2,
-                    t2.timestamp-t1.timestamp AS duration_in_seconds,
-                   (t2.timestamp-t1.timestamp)          * t1.power_wattage AS total_wattage,
-                  ((t2.timestamp-t1.timestamp) / 60.0)  * t1.water_flow AS total_water
-                FROM switch_data AS t1
-                LEFT JOIN switch_data AS t2
-                ON t2.id = t1.id
-                AND t2.timestamp = (SELECT MIN(timestamp) FROM switch_data WHERE timestamp > t1.timestamp AND id = t1.id)
-                WHERE t1.state > 0)'''
+    # Only closed intervals are counted. They are updated on every switch state change
+    switch_totals = [self.__switch_totals[id] for id in self.__switch_totals if switchid is None or switchid == id]
+    if len(switch_totals) > 0:
+      duration = int(max([data['timestamp_last'] for data in switch_totals]) - min([data['timestamp_first'] for data in switch_totals]))
+      totals = {'power_wattage' : {'duration' : duration , 'wattage' : float(sum([data['power_wattage'] for data in switch_totals]))},
+                'water_flow'    : {'duration' : duration , 'water'   : float(sum([data['water_flow'] for data in switch_totals]))}}
 
-    with self.db as db:
-      cur = db.cursor()
-      cur.execute(sql)
-      row = cur.fetchone()
-      if row['TotalTime'] is not None and row['Watt'] is not None:
-        totals = {'power_wattage' : {'duration' : int(row['TotalTime']) , 'wattage' : float(row['Watt'])},
-                  'water_flow'    : {'duration' : int(row['TotalTime']) , 'water'   : float(row['Water'])}}
-
-    logger.debug('Timing: Total power and water usage calculation done in %s seconds.' % ((time.time() - timer),))
     return totals
 
+  def get_alarms(self, starttime = None, stoptime = None, id = None, type = None):
+    # Alarm periods that are (partly) in the requested period. Open alarm periods end now
+    if starttime is None:
+      starttime = int(time.time())
+
+    if stoptime is None:
+      stoptime = starttime - (24 * 60 * 60)
+
+    # Make sure all queued alarms are stored before reading them
+    self.flush()
+
+    sql = 'SELECT id, type, timestamp, timestamp_end, alarm, peak FROM sensor_alarms WHERE (timestamp_end IS NULL OR timestamp_end >= ?) AND timestamp <= ?'
+    filters = (stoptime,starttime,)
+    if id is not None:
+      sql = sql + ' AND id = ?'
+      filters += (id,)
+
+    if type is not None:
+      sql = sql + ' AND type = ?'
+      filters += (type,)
+
+    alarms = []
+    now = int(time.time())
+    with self.__read_connection() as db:
+      for row in db.execute(sql + ' ORDER BY timestamp ASC, type ASC, id ASC',filters):
+        alarm = dict(row)
+        alarm['duration'] = (now if alarm['timestamp_end'] is None else alarm['timestamp_end']) - alarm['timestamp']
+        alarms.append(alarm)
+
+    return alarms
+
+  def get_statistics(self, starttime = None, stoptime = None, id = None, type = None):
+    # Statistics per sensor per day and for the whole period. The statistics of the days are merged, so the raw history is not used
+    if starttime is None:
+      starttime = int(time.time())
+
+    if stoptime is None:
+      stoptime = starttime - (24 * 60 * 60)
+
+    # Make sure all changed statistics are stored before reading them
+    self.__store_changed_statistics()
+    self.flush()
+
+    sql = 'SELECT id, type, timestamp, amount, mean, m2, min, max, sketch FROM sensor_statistics WHERE timestamp >= ? AND timestamp <= ?'
+    filters = (terrariumCollector.__get_statistics_period(stoptime),starttime,)
+    if id is not None:
+      sql = sql + ' AND id = ?'
+      filters += (id,)
+
+    if type is not None:
+      sql = sql + ' AND type = ?'
+      filters += (type,)
+
+    statistics = {}
+    with self.__read_connection() as db:
+      for row in db.execute(sql + ' ORDER BY type ASC, id ASC, timestamp ASC',filters):
+        key = (row['id'],row['type'])
+        if key not in statistics:
+          statistics[key] = {'id' : row['id'], 'type' : row['type'], 'days' : [], 'period' : terrariumSensorStatistics()}
+
+        day = terrariumSensorStatistics.from_row(row)
+        statistics[key]['days'].append(dict(day.get_statistics(),timestamp=row['timestamp']))
+        statistics[key]['period'].merge(day)
+
+    statistics = list(statistics.values())
+    for item in statistics:
+      item['period'] = item['period'].get_statistics()
+
+    return statistics
+
+  def recalculate_total_power_water_usage(self):
+    timer = time.time()
+    # Make sure all queued data is stored before calculating
+    self.flush()
+
+    sql = '''SELECT id,
+                    SUM(timestamp_end - timestamp) AS duration,
+                    SUM((timestamp_end - timestamp) * power_wattage) AS power_wattage,
+                    SUM(((timestamp_end - timestamp) / 60.0) * water_flow) AS water_flow,
+                    MIN(timestamp) AS timestamp_first,
+                    MAX(timestamp_end) AS timestamp_last
+             FROM switch_intervals WHERE state > 0 AND timestamp_end IS NOT NULL
+             GROUP BY id'''
+
+    with self.__write_lock:
+      switch_totals = {}
+      with self.db as db:
+        for row in db.execute(sql):
+          switch_totals[row['id']] = dict(row)
+
+        db.execute('DELETE FROM switch_totals')
+        db.executemany('INSERT INTO switch_totals (id, duration, power_wattage, water_flow, timestamp_first, timestamp_last) VALUES (:id,:duration,:power_wattage,:water_flow,:timestamp_first,:timestamp_last)',
+                       list(switch_totals.values()))
+        db.execute('REPLACE INTO metadata (key, value) VALUES (?,?)',('switch_totals_calculated',int(timer)))
+        db.commit()
+
+      self.__switch_totals = switch_totals
+
+    logger.info('Recalculated total power and water usage for %s switches in %.3f seconds.' % (len(switch_totals),time.time() - timer))
+    return self.get_total_power_water_usage()
+
   def log_switch_data(self,data):
     if data['hardwaretype'] not in ['pwm-dimmer','remote-dimmer','dc-dimmer']:
       # Store normal switches with value 100 indicating full power (aka no dimming)
@@ -340,22 +1999,29 @@ class terrariumCollector(object):
   def log_sensor_data(self,data):
     self.__log_data(data['type'],data['id'],data)
 
+  def __use_average_series(self,stoptime):
+    return self.__average_since is not None and stoptime >= self.__average_since
+
+  def log_average_data(self,data):
+    # The averages per sensor type are stored as a sensor with id 'average', like average_temperature as temperature
+    now = int(time.time())
+    for average_type in data:
+      self.__log_data(average_type[8:],terrariumCollector.AVERAGE_ID,data[average_type])
+
+    if self.__average_since is None and len(data) > 0:
+      # Start with the next whole minute, as the current minute could miss averages
+      self.__average_since = now - (now % terrariumCollector.STORE_MODULO) + terrariumCollector.STORE_MODULO
+      self.__set_metadata('average_since',self.__average_since)
+
   def log_system_data(self, data):
     self.__log_data('system',None,data)
 
-  def get_history(self, parameters = [], starttime = None, stoptime = None, exclude_ids = None):
-    # Default return object
-    timer = time.time()
-    history = {}
+  def __get_history_query(self, logtype, parameters, starttime = None, stoptime = None, exclude_ids = None, rollups = True, raw_average = False, since = None, ids = None):
     periods = {'day' : 1 * 24,
                'week' : 7 * 24,
                'month' : 30 * 24,
                'year' : 365 * 24,
                'all' : 3650 * 24}
-    modulo = terrariumCollector.STORE_MODULO
-
-    logtype = parameters[0]
-    del(parameters[0])
 
     # Define start time
     if starttime is None:
@@ -367,85 +2033,96 @@ class terrariumCollector(object):
 
     if len(parameters) > 0 and parameters[-1] in periods:
       stoptime = starttime - periods[parameters[-1]] * 60 * 60
-      modulo = (periods[parameters[-1]] / 24) * terrariumCollector.STORE_MODULO
       del(parameters[-1])
 
+    # Only select the rows after the since timestamp. The tables and the average source are still based on the full period
+    period_stoptime = stoptime
+    if since is not None and since >= stoptime:
+      stoptime = since + 1
+
     sql = ''
     filters = (stoptime,starttime,)
     if logtype == 'sensors':
       fields = { 'current' : [], 'alarm_min' : [], 'alarm_max' : [] , 'limit_min' : [], 'limit_max' : []}
-      sql = 'SELECT id, type, timestamp,' + ', '.join(list(fields.keys())) + ' FROM sensor_data WHERE timestamp >= ? AND timestamp <= ?'
+      # Use the rollup tables for longer periods
+      sensor_table = self.__get_sensor_table(period_stoptime,starttime) if rollups else self.__get_partition_source('sensor_data',stoptime,starttime)
+      sql = 'SELECT id, type, timestamp,' + ', '.join(list(fields.keys())) + ' FROM ' + sensor_table + ' WHERE timestamp >= ? AND timestamp <= ?'
 
-      if len(parameters) > 0 and parameters[0] == 'average':
-        sql = 'SELECT "average" AS id, type, timestamp'
-        for field in fields:
-          sql = sql + ', AVG(' + field + ') as ' + field
-        sql = sql + ' FROM sensor_data WHERE timestamp >= ? AND timestamp <= ?'
+      if len(parameters) > 0 and parameters[0] == 'average' and self.__use_average_series(period_stoptime):
+        # Read the stored averages like a single sensor
+        sql = sql + ' AND id = ?'
+        filters = (stoptime,starttime,terrariumCollector.AVERAGE_ID,)
+
+        if len(parameters) == 2:
+          sql = sql + ' AND type = ?'
+          filters = (stoptime,starttime,terrariumCollector.AVERAGE_ID,parameters[1],)
+
+      elif len(parameters) > 0 and parameters[0] == 'average':
+        if not raw_average:
+          sql = 'SELECT "average" AS id, type, timestamp'
+          for field in fields:
+            sql = sql + ', AVG(' + field + ') as ' + field
+          sql = sql + ' FROM ' + sensor_table + ' WHERE timestamp >= ? AND timestamp <= ?'
 
         if exclude_ids is not None:
-          sql = sql + ' AND sensor_data.id NOT IN (\'' + '\',\''.join(exclude_ids) +'\')'
+          sql = sql + ' AND id NOT IN (\'' + '\',\''.join(exclude_ids + [terrariumCollector.AVERAGE_ID]) +'\')'
+        else:
+          sql = sql + ' AND id != \'' + terrariumCollector.AVERAGE_ID + '\''
 
         if len(parameters) == 2:
           sql = sql + ' AND type = ?'
           filters = (stoptime,starttime,parameters[1],)
 
-        sql = sql + ' GROUP BY type, timestamp'
+        if not raw_average:
+          sql = sql + ' GROUP BY type, timestamp'
 
-      elif len(parameters) == 2 and parameters[0] in ['temperature','humidity','distance','ph','conductivity','light','uva','uvb','uvi','fertility']:
+      elif len(parameters) == 2 and parameters[0] in terrariumCollector.HISTORY_SENSOR_TYPES:
         sql = sql + ' AND type = ? AND id = ?'
         filters = (stoptime,starttime,parameters[0],parameters[1],)
-      elif len(parameters) == 1 and parameters[0] in ['temperature','humidity','distance','ph','conductivity','light','uva','uvb','uvi','fertility']:
-        sql = sql + ' AND type = ?'
-        filters = (stoptime,starttime,parameters[0],)
+      elif len(parameters) == 1 and parameters[0] in terrariumCollector.HISTORY_SENSOR_TYPES:
+        sql = sql + ' AND type = ? AND id != ?'
+        filters = (stoptime,starttime,parameters[0],terrariumCollector.AVERAGE_ID,)
 
       elif len(parameters) == 1:
         sql = sql + ' AND id = ?'
         filters = (stoptime,starttime,parameters[0],)
 
+      elif len(parameters) == 0 and ids is not None:
+        # Multiple sensors in one query
+        sql = sql + ' AND id IN (' + ','.join(['?'] * len(ids)) + ')'
+        filters = (stoptime,starttime,) + tuple(ids)
+
+      elif len(parameters) == 0:
+        # The stored averages are not a sensor
+        sql = sql + ' AND id != ?'
+        filters = (stoptime,starttime,terrariumCollector.AVERAGE_ID,)
+
     elif logtype == 'switches':
       fields = { 'power_wattage' : [], 'water_flow' : [] }
-      sql = '''SELECT id, "switches" AS type, timestamp, timestamp2, state, ''' + ', '.join(list(fields.keys())) + ''' FROM (
-                 SELECT
-                   t1.id AS id,
-                   t1.timestamp AS timestamp,
-                   IFNULL(t2.timestamp, ''' + str(starttime) + ''') as timestamp2,
-                   t1.power_wattage AS power_wattage,
-                   t1.water_flow AS water_flow,
-                   t1.state AS state
-                 FROM switch_data AS t1
-                 LEFT JOIN switch_data AS t2
-                 ON t2.id = t1.id
-                 AND t2.timestamp = (SELECT MIN(timestamp) FROM switch_data WHERE switch_data.timestamp > t1.timestamp AND switch_data.id = t1.id) )
-              WHERE timestamp2 > IFNULL((SELECT MAX(timestamp) AS timelimit FROM switch_data AS ttable WHERE ttable.id = id AND ttable.timestamp < ?),0)
-              AND   timestamp <= ?'''
+      sql = '''SELECT id, "switches" AS type, timestamp, IFNULL(timestamp_end, ?) AS timestamp2, state, ''' + ', '.join(list(fields.keys())) + '''
+               FROM switch_intervals
+               WHERE (timestamp_end IS NULL OR timestamp_end > ?) AND timestamp <= ?'''
+      filters = (starttime,stoptime,starttime,)
 
       if len(parameters) > 0 and parameters[0] is not None:
         sql = sql + ' AND id = ?'
-        filters = (stoptime,starttime,parameters[0],)
+        filters = (starttime,stoptime,starttime,parameters[0],)
 
     elif logtype == 'doors':
       fields = {'state' : []}
-      sql = '''SELECT id, "doors" AS type, timestamp, timestamp2, (CASE WHEN state == 'open' THEN 1 ELSE 0 END) AS state FROM (
-                 SELECT
-                   t1.id AS id,
-                   t1.timestamp AS timestamp,
-                   IFNULL(t2.timestamp, ''' + str(starttime) + ''') as timestamp2,
-                   t1.state AS state
-                 FROM door_data AS t1
-                 LEFT JOIN door_data AS t2
-                 ON t2.id = t1.id
-                 AND t2.timestamp = (SELECT MIN(timestamp) FROM door_data WHERE door_data.timestamp > t1.timestamp AND door_data.id = t1.id) )
-              WHERE timestamp2 > IFNULL((SELECT MAX(timestamp) AS timelimit FROM door_data AS ttable WHERE ttable.id = id AND ttable.timestamp < ?),0)
-              AND   timestamp <= ?'''
+      sql = '''SELECT id, "doors" AS type, timestamp, IFNULL(timestamp_end, ?) AS timestamp2, (CASE WHEN state == 'open' THEN 1 ELSE 0 END) AS state
+               FROM door_intervals
+               WHERE (timestamp_end IS NULL OR timestamp_end > ?) AND timestamp <= ?'''
+      filters = (starttime,stoptime,starttime,)
 
       if len(parameters) > 0 and parameters[0] is not None:
         sql = sql + ' AND id = ?'
-        filters = (stoptime,starttime,parameters[0],)
+        filters = (starttime,stoptime,starttime,parameters[0],)
 
     elif logtype == 'weather':
       fields = { 'wind_speed' : [], 'temperature' : [], 'pressure' : [] , 'wind_direction' : [], 'rain' : [],
                  'weather' : [], 'icon' : []}
-      sql = 'SELECT "city" AS id, "weather" AS type, timestamp, ' + ', '.join(list(fields.keys())) + ' FROM weather_data WHERE timestamp >= ? AND timestamp <= ?'
+      sql = 'SELECT "city" AS id, "weather" AS type, timestamp, ' + ', '.join(list(fields.keys())) + ' FROM ' + self.__get_partition_source('weather_data',stoptime,starttime) + ' WHERE timestamp >= ? AND timestamp <= ?'
 
     elif logtype == 'system':
       fields = ['load_load1', 'load_load5','load_load15','uptime', 'temperature','cores', 'memory_total', 'memory_used' , 'memory_free', 'disk_total', 'disk_used' , 'disk_free']
@@ -463,60 +2140,473 @@ class terrariumCollector(object):
       elif len(parameters) > 0 and parameters[0] == 'disk':
         fields = ['disk_total', 'disk_used' , 'disk_free']
 
-      sql = 'SELECT "system" AS type, timestamp, ' + ', '.join(fields) + ' FROM system_data WHERE timestamp >= ? AND timestamp <= ?'
+      sql = 'SELECT "system" AS type, timestamp, ' + ', '.join(fields) + ' FROM ' + self.__get_partition_source('system_data',stoptime,starttime) + ' WHERE timestamp >= ? AND timestamp <= ?'
 
     sql = sql + ' ORDER BY timestamp ASC, type ASC' + (', id ASC' if logtype != 'system' else '')
 
-    if not self.__recovery:
-      try:
-        first_item = None
-        with self.db as db:
-          cur = db.cursor()
-          for row in cur.execute(sql, filters):
-            if row['type'] not in history:
-              history[row['type']] = {}
+    return (sql,filters,fields,starttime,stoptime)
+
+  def __downsample_bucket(self,bucket,previous,next_point,has_alarms):
+    # Select the point of the bucket with the largest alarm excursion, else the largest triangle with the previous selected point and the average of the next bucket
+    if has_alarms:
+      excursions = [(max(row['alarm_min'] - value if row['alarm_min'] is not None else 0,
+                         value - row['alarm_max'] if row['alarm_max'] is not None else 0),index) for index, (timestamp, value, row) in enumerate(bucket) if value is not None]
+
+      excursion = max(excursions) if len(excursions) > 0 else (0,0)
+      if excursion[0] > 0:
+        return bucket[excursion[1]][2]
+
+    if previous[1] is None or next_point[1] is None:
+      return bucket[0][2]
+
+    points = [(timestamp, value) for timestamp, value, row in bucket]
+    if numpy is not None and len(bucket) >= terrariumCollector.DOWNSAMPLE_NUMPY_MIN:
+      values = numpy.array([(timestamp, numpy.nan if value is None else value) for timestamp, value in points],dtype=float)
+      areas = numpy.abs((previous[0] - next_point[0]) * (values[:,1] - previous[1]) - (previous[0] - values[:,0]) * (next_point[1] - previous[1]))
+      if numpy.isnan(areas).all():
+        return bucket[0][2]
+
+      return bucket[int(numpy.nanargmax(areas))][2]
+
+    areas = [(-1 if value is None else abs((previous[0] - next_point[0]) * (value - previous[1]) - (previous[0] - timestamp) * (next_point[1] - previous[1])),index) for index, (timestamp, value) in enumerate(points)]
+    return bucket[max(areas)[1]][2]
+
+  def __downsample_history(self,rows,logtype,fields,stoptime,starttime,points):
+    # Largest-Triangle-Three-Buckets downsampling in one pass over the rows. The rows are ordered by time, so per series only
+    # the bucket that waits for the average of the next bucket and the current bucket are kept in memory
+    value_field = [field for field in terrariumCollector.DOWNSAMPLE_FIELDS[logtype] if field in fields][:1]
+    if len(value_field) == 0:
+      value_field = [field for field in fields]
+
+    value_field = value_field[0]
+    has_alarms = 'alarm_min' in fields and 'alarm_max' in fields
+    if points < 3:
+      # No room for buckets. Only the last point, and with two points also the first point of a series is kept
+      series = OrderedDict()
+      for row in rows:
+        series_id = 'system' if logtype == 'system' else (row['type'],row['id'])
+        if series_id not in series:
+          series[series_id] = None
+          if 2 == points:
+            yield row
+            continue
+
+        series[series_id] = row
 
-            if logtype == 'system':
-              for field in fields:
-                system_parts = field.split('_')
-                if system_parts[0] not in history[row['type']]:
-                  history[row['type']][system_parts[0]] = {} if len(system_parts) == 2 else []
+      for series_id in series:
+        if series[series_id] is not None:
+          yield series[series_id]
 
-                if len(system_parts) == 2:
-                  if system_parts[1] not in history[row['type']][system_parts[0]]:
-                    history[row['type']][system_parts[0]][system_parts[1]] = []
+      return
 
-                  history[row['type']][system_parts[0]][system_parts[1]].append([row['timestamp'] * 1000,row[field]])
-                else:
-                  history[row['type']][system_parts[0]].append([row['timestamp'] * 1000,row[field]])
+    # The first and last point of a series are always kept, so the other points are divided over the remaining buckets.
+    # The last bucket gives a point and the last point, so there is one bucket less than the remaining points
+    buckets = points - 2
+    bucket_size = max(1.0,(starttime - stoptime) / float(buckets))
+
+    def average(bucket):
+      values = [(timestamp, value) for timestamp, value, row in bucket if value is not None]
+      if len(values) == 0:
+        return (bucket[-1][0],None)
+
+      return (sum([timestamp for timestamp, value in values]) / float(len(values)),sum([value for timestamp, value in values]) / float(len(values)))
+
+    series = {}
+    for row in rows:
+      series_id = 'system' if logtype == 'system' else (row['type'],row['id'])
+      point = (row['timestamp'],row[value_field],row)
+      state = series.get(series_id)
+      if state is None:
+        # Always keep the first point
+        series[series_id] = {'previous' : point[:2], 'pending' : None, 'current' : [], 'index' : None}
+        yield row
+        continue
+
+      # Rows at the end time or before the start time stay in the outer buckets
+      index = min(buckets - 1,max(0,int((row['timestamp'] - stoptime) / bucket_size)))
+      if state['index'] is not None and index != state['index']:
+        if state['pending'] is not None:
+          selected = self.__downsample_bucket(state['pending'],state['previous'],average(state['current']),has_alarms)
+          state['previous'] = (selected['timestamp'],selected[value_field])
+          yield selected
+
+        state['pending'] = state['current']
+        state['current'] = []
+
+      state['index'] = index
+      state['current'].append(point)
+
+    for series_id in series:
+      state = series[series_id]
+      if len(state['current']) == 0:
+        continue
+
+      if state['pending'] is not None:
+        selected = self.__downsample_bucket(state['pending'],state['previous'],average(state['current']),has_alarms)
+        state['previous'] = (selected['timestamp'],selected[value_field])
+        yield selected
+
+      # Always keep the last point
+      if len(state['current']) > 1:
+        yield self.__downsample_bucket(state['current'][:-1],state['previous'],state['current'][-1][:2],has_alarms)
+
+      yield state['current'][-1][2]
+
+  def __update_history_totals(self,totals,row,stoptime):
+    if row['state'] > 0 and row['timestamp2'] is not None and '' != row['timestamp2']:
+      # Update totals data
+      duration = float(row['timestamp2'] - (row['timestamp'] if row['timestamp'] >= stoptime else stoptime))
+      totals['duration'] += duration
+
+      if 'switches' == row['type']:
+        totals['power_wattage'] += duration * float(row['power_wattage'])
+        # Devide by 60 to get Liters water used per minute based on seconds durations
+        totals['water_flow'] += (duration / 60.0) * float(row['water_flow'])
+
+  def __get_columnar_history(self,logtype,rows,fields,stoptime,starttime):
+    # One shared timestamp array (in seconds) per series and one value array per field.
+    # Switches and doors get an extra timestamp_end array instead of the duplicated graph points
+    history = {}
+    for row in rows:
+      if row['type'] not in history:
+        history[row['type']] = {}
+
+      series_id = 'system' if logtype == 'system' else row['id']
+      if series_id not in history[row['type']]:
+        history[row['type']][series_id] = {'timestamp' : [], 'fields' : {field : [] for field in fields}}
+
+        if row['type'] in ['switches','doors']:
+          history[row['type']][series_id]['timestamp_end'] = []
+          history[row['type']][series_id]['totals'] = {'duration' : 0, 'power_wattage' : 0, 'water_flow' : 0}
+
+      series = history[row['type']][series_id]
+      if row['type'] in ['switches','doors']:
+        self.__update_history_totals(series['totals'],row,stoptime)
+        series['timestamp'].append(row['timestamp'] if row['timestamp'] >= stoptime else stoptime)
+        series['timestamp_end'].append(row['timestamp2'])
+      else:
+        series['timestamp'].append(row['timestamp'])
 
+      for field in fields:
+        series['fields'][field].append(row[field])
+
+    if 'system' in history:
+      history['system'] = history['system']['system']
+
+    return history
+
+  def __get_history_from_rows(self,logtype,rows,fields,stoptime,starttime,fill_history,average,points,columnar):
+    history = {}
+    if fill_history:
+      rows = self.__fill_sensor_history(rows,fields,stoptime,starttime,average)
+
+    if points is not None and points > 0 and logtype in terrariumCollector.DOWNSAMPLE_FIELDS:
+      rows = self.__downsample_history(rows,logtype,fields,stoptime,starttime,points)
+
+    if columnar:
+      history = self.__get_columnar_history(logtype,rows,fields,stoptime,starttime)
+    else:
+      for row in rows:
+        if row['type'] not in history:
+          history[row['type']] = {}
+
+        if logtype == 'system':
+          for field in fields:
+            system_parts = field.split('_')
+            if system_parts[0] not in history[row['type']]:
+              history[row['type']][system_parts[0]] = {} if len(system_parts) == 2 else []
+
+            if len(system_parts) == 2:
+              if system_parts[1] not in history[row['type']][system_parts[0]]:
+                history[row['type']][system_parts[0]][system_parts[1]] = []
+
+              history[row['type']][system_parts[0]][system_parts[1]].append([row['timestamp'] * 1000,row[field]])
             else:
-              if row['id'] not in history[row['type']]:
-                history[row['type']][row['id']] = copy.deepcopy(fields)
+              history[row['type']][system_parts[0]].append([row['timestamp'] * 1000,row[field]])
+
+        else:
+          if row['id'] not in history[row['type']]:
+            history[row['type']][row['id']] = copy.deepcopy(fields)
+
+            if row['type'] in ['switches','doors']:
+              history[row['type']][row['id']]['totals'] = {'duration' : 0, 'power_wattage' : 0, 'water_flow' : 0}
+
+          if row['type'] in ['switches','doors']:
+            self.__update_history_totals(history[row['type']][row['id']]['totals'],row,stoptime)
+
+          for field in fields:
+            history[row['type']][row['id']][field].append([ (row['timestamp'] if row['timestamp'] >= stoptime else stoptime) * 1000,row[field]])
+
+            if row['type'] in ['switches','doors'] and row['timestamp2'] is not None and '' != row['timestamp2']:
+              # Add extra point for nicer graphing of doors and power switches
+              history[row['type']][row['id']][field].append([row['timestamp2'] * 1000,row[field]])
+
+    return history
+
+  def __get_history_cache_key(self,parameters,starttime,stoptime,exclude_ids,history_format,points,since,ids):
+    # Without a start time the history is relative to now. Those results are kept up to date with the new values, or expire after the stored minute
+    time_bucket = 'now' if starttime is None else starttime
+    return (tuple(parameters),time_bucket,stoptime,None if exclude_ids is None else tuple(sorted(exclude_ids)),history_format,points,since,None if ids is None else tuple(sorted(ids)))
+
+  def __get_history_cache_scope(self,logtype,parameters):
+    # The sensor type and id that are used in the history query, so only the matching results are invalidated on new data
+    if logtype == 'sensors':
+      if len(parameters) > 0 and parameters[0] == 'average':
+        return (logtype,parameters[1] if len(parameters) == 2 else None,None)
+      elif len(parameters) == 2 and parameters[0] in terrariumCollector.SENSOR_TYPES:
+        return (logtype,parameters[0],parameters[1])
+      elif len(parameters) == 1 and parameters[0] in terrariumCollector.SENSOR_TYPES:
+        return (logtype,parameters[0],None)
+      elif len(parameters) == 1:
+        return (logtype,None,parameters[0])
+
+    elif logtype in ['switches','doors'] and len(parameters) > 0 and parameters[0] is not None:
+      return (logtype,None,parameters[0])
+
+    return (logtype,None,None)
+
+  def __get_cached_history(self,key,since = None):
+    if self.__history_cache_size <= 0:
+      return None
+
+    with self.__history_cache_lock:
+      entry = self.__history_cache.get(key)
+      if entry is not None and entry['expires'] is not None and entry['expires'] <= time.time():
+        del(self.__history_cache[key])
+        entry = None
+
+      cut = False
+      if entry is None and since is not None:
+        # Incremental requests are cut from the cached history of the whole period
+        base_key = key[:6] + (None,) + key[7:]
+        if base_key in self.__history_cache and self.__history_cache[base_key]['extend'] is not None:
+          key = base_key
+          entry = self.__history_cache[key]
+          cut = True
+
+      if entry is None:
+        self.__history_cache_stats['misses'] += 1
+        return None
+
+      self.__history_cache_stats['hits'] += 1
+      self.__history_cache.move_to_end(key)
+      if entry['extend'] is not None:
+        self.__trim_cached_history(entry)
+
+      return self.__get_cached_history_since(entry,since) if cut else entry['history']
+
+  def __cache_history(self,key,scope,generation,history,extend = None,expires = None):
+    if self.__history_cache_size <= 0:
+      return
 
-                if row['type'] in ['switches','doors']:
-                  history[row['type']][row['id']]['totals'] = {'duration' : 0, 'power_wattage' : 0, 'water_flow' : 0}
+    with self.__history_cache_lock:
+      # New data is logged during the query, so the result could already be outdated
+      if generation != self.__history_cache_generation:
+        return
 
-              if row['type'] in ['switches','doors'] and row['state'] > 0 and row['timestamp2'] is not None and '' != row['timestamp2']:
-                # Update totals data
-                duration = float(row['timestamp2'] - (row['timestamp'] if row['timestamp'] >= stoptime else stoptime))
-                history[row['type']][row['id']]['totals']['duration'] += duration
+      self.__history_cache[key] = {'scope' : scope, 'history' : history, 'extend' : extend, 'expires' : expires}
+      self.__history_cache.move_to_end(key)
+      while len(self.__history_cache) > self.__history_cache_size:
+        self.__history_cache.popitem(last=False)
 
-                if 'switches' == row['type']:
-                  history[row['type']][row['id']]['totals']['power_wattage'] += duration * float(row['power_wattage'])
-                  # Devide by 60 to get Liters water used per minute based on seconds durations
-                  history[row['type']][row['id']]['totals']['water_flow'] += (duration / 60.0) * float(row['water_flow'])
+  def __trim_cached_history(self,entry):
+    # Remove the values that are moved out of the relative period
+    stoptime = int(time.time()) - entry['extend']['period']
+    if stoptime <= entry['extend']['stoptime']:
+      return
+
+    entry['extend']['stoptime'] = stoptime
+    history = entry['history']
+    for history_type in list(history.keys()):
+      for series_id in list(history[history_type].keys()):
+        series = history[history_type][series_id]
+        if entry['extend']['columnar']:
+          index = bisect.bisect_left(series['timestamp'],stoptime)
+          del(series['timestamp'][:index])
+          for field in series['fields']:
+            del(series['fields'][field][:index])
+
+          empty = len(series['timestamp']) == 0
+        else:
+          # Graph points are [timestamp in milliseconds, value]
+          for field in series:
+            del(series[field][:bisect.bisect_left(series[field],[stoptime * 1000])])
+
+          empty = all(len(series[field]) == 0 for field in series)
+
+        if empty:
+          del(history[history_type][series_id])
+
+      if len(history[history_type]) == 0:
+        del(history[history_type])
+
+  def __get_cached_history_since(self,entry,since):
+    # Only the values after the since timestamp, like the history query. Sensors without newer values are left out
+    history = {}
+    for history_type in entry['history']:
+      for series_id, series in entry['history'][history_type].items():
+        if entry['extend']['columnar']:
+          index = bisect.bisect_right(series['timestamp'],since)
+          if index == len(series['timestamp']):
+            continue
+
+          part = {'timestamp' : series['timestamp'][index:], 'fields' : {field : values[index:] for field, values in series['fields'].items()}}
+        else:
+          part = {field : points[bisect.bisect_left(points,[(since + 1) * 1000]):] for field, points in series.items()}
+          if all(len(part[field]) == 0 for field in part):
+            continue
 
-              for field in fields:
-                history[row['type']][row['id']][field].append([ (row['timestamp'] if row['timestamp'] >= stoptime else stoptime) * 1000,row[field]])
+        if history_type not in history:
+          history[history_type] = {}
 
-                if row['type'] in ['switches','doors'] and row['timestamp2'] is not None and '' != row['timestamp2']:
-                  # Add extra point for nicer graphing of doors and power switches
-                  history[row['type']][row['id']][field].append([row['timestamp2'] * 1000,row[field]])
+        history[history_type][series_id] = part
 
-          logger.debug('Timing: history %s query: %s seconds' % (logtype,time.time()-timer))
+    return history
+
+  def __extend_cached_history(self,entry,type,id,timestamp,data):
+    history = entry['history']
+    if type not in history or id not in history[type]:
+      # A new sensor in the period, so the cached history is not complete
+      return False
+
+    # The same values as read from the history buffers
+    values = {}
+    for field in terrariumHistoryBuffer.FIELDS:
+      try:
+        values[field] = float(data[field])
+        if math.isnan(values[field]):
+          values[field] = None
+      except (TypeError, ValueError) as ex:
+        values[field] = None
+
+    series = history[type][id]
+    if entry['extend']['columnar']:
+      last_timestamp = series['timestamp'][-1]
+    else:
+      last_timestamp = series[terrariumHistoryBuffer.FIELDS[0]][-1][0] // 1000
+
+    if last_timestamp > timestamp:
+      return False
+
+    if entry['extend']['columnar']:
+      if last_timestamp == timestamp:
+        # A new value in the same minute replaces the previous value, like in the database
+        for field in values:
+          series['fields'][field][-1] = values[field]
+      else:
+        series['timestamp'].append(timestamp)
+        for field in values:
+          series['fields'][field].append(values[field])
+    else:
+      for field in values:
+        if last_timestamp == timestamp:
+          series[field][-1] = [timestamp * 1000,values[field]]
+        else:
+          series[field].append([timestamp * 1000,values[field]])
+
+    return True
+
+  def __extend_history_cache(self,type,id,timestamp,data):
+    # Add a new sensor value to the cached history of the relative periods. Other cached results with this sensor are removed
+    with self.__history_cache_lock:
+      self.__history_cache_generation += 1
+      for key in list(self.__history_cache.keys()):
+        entry = self.__history_cache[key]
+        cache_logtype, cache_type, cache_id = entry['scope']
+        if cache_logtype != 'sensors' or \
+           (cache_type is not None and cache_type != type) or \
+           (cache_id is not None and cache_id != id):
+          continue
+
+        if entry['extend'] is not None:
+          if not entry['extend']['selected'](type,id):
+            continue
+
+          if self.__extend_cached_history(entry,type,id,timestamp,data):
+            self.__history_cache_stats['extensions'] += 1
+            continue
+
+        del(self.__history_cache[key])
+        self.__history_cache_stats['invalidations'] += 1
+
+  def __invalidate_history_cache(self,logtype = None,type = None,id = None):
+    with self.__history_cache_lock:
+      self.__history_cache_generation += 1
+      for key in list(self.__history_cache.keys()):
+        cache_logtype, cache_type, cache_id = self.__history_cache[key]['scope']
+        if logtype is not None:
+          if cache_logtype != logtype or \
+             (type is not None and cache_type is not None and cache_type != type) or \
+             (id is not None and cache_id is not None and cache_id != id):
+            continue
+
+        del(self.__history_cache[key])
+        self.__history_cache_stats['invalidations'] += 1
+
+  def get_history_cache_stats(self):
+    with self.__history_cache_lock:
+      data = copy.copy(self.__history_cache_stats)
+      data['entries'] = len(self.__history_cache)
+
+    data['size'] = self.__history_cache_size
+    data['hit_ratio'] = (data['hits'] / float(data['hits'] + data['misses'])) if data['hits'] + data['misses'] > 0 else 0.0
+
+    return data
+
+  def get_history(self, parameters = [], starttime = None, stoptime = None, exclude_ids = None, history_format = None, points = None, since = None, ids = None):
+    # Default return object
+    timer = time.time()
+    history = {}
+    columnar = history_format in ['columnar','binary']
+
+    # Cached results are shared between the callers, so they should not be changed
+    cache_key = self.__get_history_cache_key(parameters,starttime,stoptime,exclude_ids,history_format,points,since,ids)
+    cached_history = self.__get_cached_history(cache_key,since)
+    if cached_history is not None:
+      logger.debug('Timing: history %s from cache: %s seconds' % (parameters[0],time.time()-timer))
+      return cached_history
+
+    with self.__history_cache_lock:
+      cache_generation = self.__history_cache_generation
+
+    logtype = parameters[0]
+    del(parameters[0])
+
+    sql, filters, fields, starttime, stoptime = self.__get_history_query(logtype,parameters,starttime,stoptime,exclude_ids,ids=ids)
+
+    # History with sensors that use a deadband is filled when it is not read from the rollup tables
+    raw_sensor_data = 'sensors' == logtype and self.__get_sensor_table(stoptime,starttime) not in [rollup_table for rollup_table, period in terrariumCollector.ROLLUP_TABLES]
+    deadband_heartbeat = self.__get_deadband_heartbeat(stoptime,starttime) if raw_sensor_data else 0
+    fill_history = deadband_heartbeat > 0
+    average = fill_history and len(parameters) > 0 and parameters[0] == 'average' and not self.__use_average_series(stoptime)
+    period_stoptime = stoptime
+    if fill_history or (since is not None and since >= stoptime):
+      # Read only the rows after the since timestamp, and/or the values per sensor for filling the history
+      sql, filters, fields, starttime, stoptime = self.__get_history_query(logtype,parameters,starttime,stoptime,exclude_ids,raw_average=fill_history,since=since,ids=ids)
+      if fill_history:
+        # Include the last stored values before the requested period
+        filters = (stoptime - deadband_heartbeat,) + filters[1:]
+
+    # The recent sensor history is read from memory
+    rows = self.__get_memory_history(parameters,filters[0],starttime,period_stoptime,ids) if raw_sensor_data else None
+    if rows is not None:
+      history = self.__get_history_from_rows(logtype,rows,fields,stoptime,starttime,fill_history,average,points,columnar)
+      logger.debug('Timing: history %s from memory: %s seconds' % (logtype,time.time()-timer))
+
+    elif not self.__recovery:
+      # Make sure all queued data is stored before reading the history
+      self.flush()
+
+      try:
+        with self.__read_connection() as db:
+          cur = db.cursor()
+          rows = cur.execute(sql, filters)
+          history = self.__get_history_from_rows(logtype,rows,fields,stoptime,starttime,fill_history,average,points,columnar)
+
+        logger.debug('Timing: history %s query: %s seconds' % (logtype,time.time()-timer))
       except sqlite3.DatabaseError as ex:
         logger.error('TerrariumPI Collecter exception! %s', (ex,))
+        cache_generation = None
         if 'database disk image is malformed' == str(ex):
           self.__recover()
 
@@ -524,9 +2614,115 @@ class terrariumCollector(object):
     if logtype in ['switches','doors'] and logtype not in history and len(parameters) > 0:
       # Create 'empty' history array if single id is requested
       history[logtype] = {}
-      history[logtype][parameters[0]] = copy.deepcopy(fields)
-      for field in fields:
-        history[logtype][parameters[0]][field].append([stoptime  * 1000,0])
-        history[logtype][parameters[0]][field].append([starttime * 1000,0])
+      if columnar:
+        history[logtype][parameters[0]] = {'timestamp' : [stoptime], 'timestamp_end' : [starttime], 'fields' : {field : [0] for field in fields},
+                                           'totals' : {'duration' : 0, 'power_wattage' : 0, 'water_flow' : 0}}
+      else:
+        history[logtype][parameters[0]] = copy.deepcopy(fields)
+        for field in fields:
+          history[logtype][parameters[0]][field].append([stoptime  * 1000,0])
+          history[logtype][parameters[0]][field].append([starttime * 1000,0])
+
+    if 'binary' == history_format:
+      history = terrariumCollector.history_to_binary(history)
+
+    if not self.__recovery and cache_generation is not None:
+      extend = None
+      expires = None
+      if 'now' == cache_key[1]:
+        if raw_sensor_data and not fill_history and since is None and points is None and 'binary' != history_format and \
+           not (len(parameters) > 0 and parameters[0] == 'average' and not self.__use_average_series(period_stoptime)):
+          # The raw sensor history of a relative period is extended with the new values, and moves along with the time
+          extend = {'selected' : self.__get_history_selection(parameters,ids),
+                    'period' : starttime - period_stoptime,
+                    'stoptime' : period_stoptime,
+                    'columnar' : columnar}
+        else:
+          # Other relative history is valid till the next stored minute
+          expires = (int(time.time()) // terrariumCollector.STORE_MODULO + 1) * terrariumCollector.STORE_MODULO
+
+      self.__cache_history(cache_key,self.__get_history_cache_scope(logtype,parameters),cache_generation,history,extend,expires)
 
     return history
+
+  @staticmethod
+  def history_to_binary(history):
+    # Pack columnar history so it can be read with javascript typed arrays without parsing
+    # Layout: uint32 header length, JSON header (padded to 4 bytes), data buffers
+    # All numbers are little-endian. Timestamps are int32 seconds and values are float32, NULL values are NaN
+    # Text fields (like weather icons) are stored in the header. Buffer offsets are relative to the start of the data buffers
+    header = {'series' : []}
+    buffers = []
+    offset = 0
+
+    def add_buffer(values,typecode):
+      nonlocal offset
+      data = array.array(typecode,values)
+      if 'big' == sys.byteorder:
+        data.byteswap()
+
+      data = data.tobytes()
+      buffers.append(data)
+      offset += len(data)
+      return {'offset' : offset - len(data), 'type' : 'int32' if 'i' == typecode else 'float32'}
+
+    for history_type in history:
+      series_list = {None : history[history_type]} if 'system' == history_type else history[history_type]
+      for series_id in series_list:
+        series = series_list[series_id]
+        series_header = {'type' : history_type, 'id' : series_id, 'length' : len(series['timestamp']), 'fields' : {}}
+        series_header['timestamp'] = add_buffer(series['timestamp'],'i')
+        if 'timestamp_end' in series:
+          series_header['timestamp_end'] = add_buffer(series['timestamp_end'],'i')
+
+        if 'totals' in series:
+          series_header['totals'] = series['totals']
+
+        for field in series['fields']:
+          values = series['fields'][field]
+          if all(value is None or isinstance(value,(int,float)) for value in values):
+            series_header['fields'][field] = add_buffer([float('nan') if value is None else value for value in values],'f')
+          else:
+            series_header['fields'][field] = {'values' : values, 'type' : 'text'}
+
+        header['series'].append(series_header)
+
+    header = json.dumps(header).encode()
+    # Pad the header so the data buffers are 4 bytes aligned for the typed arrays
+    header += b' ' * ((4 - len(header) % 4) % 4)
+    return struct.pack('<I',len(header)) + header + b''.join(buffers)
+
+  def get_history_export(self, parameters = [], starttime = None, stoptime = None, exclude_ids = None):
+    # Generator that will first yield the field names and then all the rows directly from the database cursor
+    logtype = parameters[0]
+    del(parameters[0])
+
+    # Make sure all queued data is stored before reading the history
+    self.flush()
+
+    # Exports always use the raw data
+    sql, filters, fields, starttime, stoptime = self.__get_history_query(logtype,parameters,starttime,stoptime,exclude_ids,False)
+    fields = list(fields) if logtype == 'system' else ['id'] + list(fields.keys())
+    if 'weather' == logtype:
+      fields.remove('id')
+
+    yield ['timestamp'] + fields
+
+    if self.__recovery:
+      return
+
+    timer = time.time()
+    rows = 0
+    try:
+      with self.__read_connection() as db:
+        cur = db.cursor()
+        for row in cur.execute(sql, filters):
+          rows += 1
+          yield [row['timestamp']] + [row[field] for field in fields]
+
+    except sqlite3.DatabaseError as ex:
+      logger.error('TerrariumPI Collecter exception! %s', (ex,))
+      if 'database disk image is malformed' == str(ex):
+        self.__recover()
+
+    logger.debug('Timing: history %s export of %s rows: %s seconds' % (logtype,rows,time.time()-timer))
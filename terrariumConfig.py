@@ -616,6 +616,9 @@ class terrariumConfig(object):
   def get_meross_cloud(self):
     return self.__get_config('meross_cloud')
 
+  def get_collector(self):
+    return self.__get_config('collector')
+
   def set_meross_cloud(self,data):
     data = {'meross_username' : data['meross_username'],
             'meross_password' : data['meross_password']}
@@ -25,10 +25,11 @@ import pyfiglet
 
 from hashlib import md5
 from gevent import sleep
+from gevent.pool import Pool
 
 from terrariumConfig import terrariumConfig
 from terrariumWeather import terrariumWeather, terrariumWeatherSourceException
-from terrariumSensor import terrariumSensor
+from terrariumSensor import terrariumSensor, terrariumSensorAverage
 from terrariumSwitch import terrariumPowerSwitch
 from terrariumDoor import terrariumDoor
 from terrariumWebcam import terrariumWebcam, terrariumWebcamSourceException
@@ -37,12 +38,26 @@ from terrariumCollector import terrariumCollector
 from terrariumEnvironment import terrariumEnvironment
 from terrariumNotification import terrariumNotification
 from terrariumCalendar import terrariumCalendar
+from terrariumScheduler import terrariumScheduler
+from terrariumWebsocketDelta import terrariumWebsocketDelta
+from terrariumStateStore import terrariumStateStore
 
 from terrariumUtils import terrariumUtils
 
 class terrariumEngine(object):
 
   LOOP_TIMEOUT = 30
+  # Maximum amount of sensor buses that are read at the same time
+  SENSOR_CONCURRENCY = 4
+  # Amount of seconds between the runs of the engine jobs. Every sensor has its own update interval
+  JOB_INTERVALS = {'update_check' : 60 * 60,
+                   'weather'      : 60,
+                   'switches'     : LOOP_TIMEOUT,
+                   'status'       : LOOP_TIMEOUT,
+                   'system'       : LOOP_TIMEOUT,
+                   'display'      : LOOP_TIMEOUT}
+  # Maximum age in seconds of the system state. Same as the Expires time of the API calls
+  SYSTEM_STATE_MAX_AGE = 10
 
   def __init__(self):
     # Default system units
@@ -63,6 +78,14 @@ class terrariumEngine(object):
 
     # List of queues for websocket communication
     self.subscribed_queues = []
+    # Only the changes since the last message are send to the websocket clients
+    self.__websocket_delta = terrariumWebsocketDelta()
+    # Latest JSON data of the most requested resources. The data is only build again when it is requested after a change
+    self.state = terrariumStateStore()
+    self.state.add_source('sensors',lambda: self.get_sensors([]))
+    self.state.add_source('sensors/average',lambda: self.get_sensors(['average']))
+    self.state.add_source('switches',lambda: self.get_switches([]))
+    self.state.add_source('system',self.get_system_stats,terrariumEngine.SYSTEM_STATE_MAX_AGE)
 
     self.device = ''
     regex = r"product: (?P<device>.*)"
@@ -78,6 +101,14 @@ class terrariumEngine(object):
     self.pi_power_wattage = 5
 
     self.environment = None
+    # Running averages per sensor type
+    self.__sensor_averages = terrariumSensorAverage()
+    self.__average_data = None
+    self.__system_data = None
+
+    # All the updates are done by the scheduler, each with its own interval
+    self.scheduler = terrariumScheduler()
+    self.scheduler.add_group('sensors',self.__update_sensors)
 
     # Load config
     logger.info('Loading terrariumPI config')
@@ -104,7 +135,7 @@ class terrariumEngine(object):
 
     # Load data collector for historical data
     logger.info('Loading terrariumPI collector')
-    self.collector = terrariumCollector(self.current_version)
+    self.collector = terrariumCollector(self.current_version,**self.config.get_collector())
     logger.info('Done loading terrariumPI collector')
 
     # Set the Pi power usage (including usb devices directly on the PI)
@@ -167,6 +198,7 @@ class terrariumEngine(object):
                                                self.get_audio_playing)
 
     # Start system update loop
+    self.__schedule_jobs()
     self.__running = True
     _thread.start_new_thread(self.__engine_loop, ())
     _thread.start_new_thread(self.__webcam_loop, ())
@@ -257,6 +289,15 @@ class terrariumEngine(object):
       if 'exclude_avg' in sensordata and sensordata['exclude_avg'] is not None:
         sensor.set_exclude_avg(sensordata['exclude_avg'])
 
+      if 'deadband' in sensordata and terrariumUtils.is_float(sensordata['deadband']):
+        sensor.set_deadband(sensordata['deadband'])
+
+      if 'heartbeat' in sensordata and terrariumUtils.is_float(sensordata['heartbeat']):
+        sensor.set_heartbeat(sensordata['heartbeat'])
+
+      if 'update_interval' in sensordata and terrariumUtils.is_float(sensordata['update_interval']):
+        sensor.set_update_interval(sensordata['update_interval'])
+
       seen_sensors.append(sensor.get_id())
 
 
@@ -264,9 +305,19 @@ class terrariumEngine(object):
       for sensor_id in set(self.sensors) - set(seen_sensors):
         # clean up old deleted sensors
         del(self.sensors[sensor_id])
+        self.__websocket_delta.forget('sensor_gauge',sensor_id)
 
       self.environment.set_sensors(self.sensors)
 
+    average_groups = self.__sensor_averages.get_groups()
+    self.__update_sensor_averages()
+    for average_group in set(average_groups) - set(self.__sensor_averages.get_groups()):
+      # No sensors left of this type
+      self.__websocket_delta.forget('sensor_gauge',average_group)
+
+    self.__schedule_sensors()
+    self.update_state('sensors')
+
     logger.info('Done %s terrariumPI sensors. Found %d sensors in %.3f seconds' % ('reloading' if reloading else 'loading',
                                                                                       len(self.sensors),
                                                                                       time.time()-starttime))
@@ -370,6 +421,7 @@ class terrariumEngine(object):
       for power_switch_id in set(self.power_switches) - set(seen_power_switches):
         # clean up old deleted switches
         del(self.power_switches[power_switch_id])
+        self.__websocket_delta.forget('switches',power_switch_id)
 
       # Should not be needed.... environment needs callback to engine to get this information
       self.environment.set_power_switches(self.power_switches)
@@ -413,6 +465,7 @@ class terrariumEngine(object):
       for door_id in set(self.doors) - set(seen_doors):
         # clean up old deleted switches
         del(self.doors[door_id])
+        self.__websocket_delta.forget('doors',door_id)
 
     logger.info('Done %s terrariumPI doors. Found %d doors in %.3f seconds' % ('reloading' if reloading else 'loading',
                                                                               len(self.doors),
@@ -594,120 +647,183 @@ class terrariumEngine(object):
           # More then 12 seconds to late.... probably never fast enough...
           time_short = 0
 
-  def __engine_loop(self):
-    time_short = 0
-    error_counter = 0
-    logger.info('Start terrariumPI engine')
-    while self.__running:
-      starttime = time.time()
+  def __update_sensor_bus(self,sensorids):
+    for sensorid in sensorids:
+      try:
+        # Update the current sensor. The other buses continue while this sensor waits for its hardware
+        self.sensors[sensorid].update()
+
+        self.__update_sensor_average(self.sensors[sensorid])
+        # Save new data to database
+        self.collector.log_sensor_data(self.sensors[sensorid].get_data())
+        # Websocket callback
+        self.get_sensors([sensorid],socket=True)
+        # Send notification when needed and enabled
+        if self.sensors[sensorid].is_active() and self.sensors[sensorid].notification_enabled() and self.sensors[sensorid].get_alarm():
+          self.notification.message('sensor_alarm_' + ('low' if self.sensors[sensorid].get_current() < self.sensors[sensorid].get_alarm_min() else 'high'),self.sensors[sensorid].get_data())
+
+      except Exception as err:
+        logger.exception('Engine loop: Sensor has problems: {}'.format(err))
+
+  def __update_sensors(self,sensorids):
+    # Sensors on the same bus are read one after the other. The buses are read at the same time, so the update takes as long as the slowest bus
+    starttime = time.time()
+    buses = {}
+    for sensorid in sensorids:
+      if sensorid not in self.sensors:
+        # Sensor is removed after it was scheduled
+        continue
 
-      # Version update check
-      self.__update_check()
+      bus = self.sensors[sensorid].get_bus()
+      if bus not in buses:
+        buses[bus] = []
 
-      motddata = {'average' : [],
-                  'system' : 0,
-                  'duration' : 0,
-                  'error' : ''}
+      buses[bus].append(sensorid)
 
-      # Update weather
-      if self.weather is not None:
-        self.weather.update()
-        weather_data = self.weather.get_data()
-        if 'hour_forecast' in weather_data and len(weather_data['hour_forecast']) > 0:
-          self.collector.log_weather_data(weather_data['hour_forecast'][0])
+    pool = Pool(terrariumEngine.SENSOR_CONCURRENCY)
+    for bus in buses:
+      pool.spawn(self.__update_sensor_bus,buses[bus])
 
-      # Update sensors
-      for sensorid in self.sensors:
-        try:
-          # Update the current sensor.
-          self.sensors[sensorid].update()
-          # Save new data to database
-          self.collector.log_sensor_data(self.sensors[sensorid].get_data())
-          # Websocket callback
-          self.get_sensors([sensorid],socket=True)
-          # Send notification when needed and enabled
-          if self.sensors[sensorid].is_active() and self.sensors[sensorid].notification_enabled() and self.sensors[sensorid].get_alarm():
-            self.notification.message('sensor_alarm_' + ('low' if self.sensors[sensorid].get_current() < self.sensors[sensorid].get_alarm_min() else 'high'),self.sensors[sensorid].get_data())
+    pool.join()
 
-        except Exception as err:
-          logger.exception('Engine loop: Sensor has problems: {}'.format(err))
+    # Store all the sensor data in one transaction
+    self.collector.flush()
+    self.update_state('sensors')
+    logger.debug('Updated %s sensors on %s buses in %.5f seconds' % (sum(len(buses[bus]) for bus in buses),len(buses),time.time()-starttime))
 
-        # Make time for other web request
-        sleep(0.1)
+  def __update_sensor_average(self,sensor):
+    group = None
+    # Exclude Chirp light sensors for average calculation in favour of Lux measurements
+    if sensor.get_current() is not None and not (sensor.get_exclude_avg() or (sensor.get_sensor_type() == 'light' and sensor.get_type() == 'chirp')):
+      group = 'average_' + sensor.get_sensor_type()
 
-      # Update (remote) power switches
-      motddata['power_switches'] = []
-      for power_switch_id in self.power_switches:
-        try:
-          # Update timer trigger if activated
-          #self.power_switches[power_switch_id].timer()
-          # Update the current sensor.
-          self.power_switches[power_switch_id].update()
-          if self.power_switches[power_switch_id].get_state() > 0:
-            power_state = '{}%'.format(self.power_switches[power_switch_id].get_state())
-            if not self.power_switches[power_switch_id].is_dimmer():
-              power_state = 'on' if self.power_switches[power_switch_id].is_on() else 'off'
-
-            motddata['power_switches'].append({'name' : self.power_switches[power_switch_id].get_name(),
-                                               'state' : power_state})
+    self.__sensor_averages.set(sensor.get_id(),group,[sensor.get_current(),sensor.get_alarm_min(),sensor.get_alarm_max(),sensor.get_limit_min(),sensor.get_limit_max()])
 
-        except Exception as err:
-          logger.exception('Engine loop: Power switch has problems: {}'.format(err))
+    if self.environment is not None:
+      self.environment.update_sensor(sensor)
 
-        # Make time for other web request
-        sleep(0.1)
+  def __update_sensor_averages(self):
+    for sensorid in self.__sensor_averages.get_sensors():
+      if sensorid not in self.sensors:
+        self.__sensor_averages.remove(sensorid)
 
-      # Get the current average temperatures
-      average_data = self.get_sensors(['average'])['sensors']
-      motddata['average'] = average_data
+    for sensorid in self.sensors:
+      self.__update_sensor_average(self.sensors[sensorid])
 
-      # Websocket callback
-      self.__send_message({'type':'sensor_gauge','data':average_data})
+  def __schedule_sensors(self):
+    for sensorid in self.sensors:
+      job = self.scheduler.get_job('sensor_' + sensorid)
+      if job is None or job.interval != self.sensors[sensorid].get_update_interval():
+        self.scheduler.add_job('sensor_' + sensorid,self.sensors[sensorid].get_update_interval(),group='sensors',data=sensorid)
+
+    for job in self.scheduler.get_jobs():
+      if 'sensors' == job['group'] and job['name'][len('sensor_'):] not in self.sensors:
+        self.scheduler.remove_job(job['name'])
+
+  def __schedule_jobs(self):
+    # The first version check is already done at startup
+    self.scheduler.add_job('update_check',terrariumEngine.JOB_INTERVALS['update_check'],self.__update_check,delay=terrariumEngine.JOB_INTERVALS['update_check'])
+    self.scheduler.add_job('weather',terrariumEngine.JOB_INTERVALS['weather'],self.__update_weather)
+    self.scheduler.add_job('switches',terrariumEngine.JOB_INTERVALS['switches'],self.__update_power_switches)
+    self.scheduler.add_job('status',terrariumEngine.JOB_INTERVALS['status'],self.__update_status)
+    self.scheduler.add_job('system',terrariumEngine.JOB_INTERVALS['system'],self.__update_system)
+    self.scheduler.add_job('display',terrariumEngine.JOB_INTERVALS['display'],self.__update_display)
+
+  def __update_weather(self):
+    if self.weather is not None:
+      self.weather.update()
+      weather_data = self.weather.get_data()
+      if 'hour_forecast' in weather_data and len(weather_data['hour_forecast']) > 0:
+        self.collector.log_weather_data(weather_data['hour_forecast'][0])
+
+  def __update_power_switches(self):
+    for power_switch_id in list(self.power_switches):
+      try:
+        # Update timer trigger if activated
+        #self.power_switches[power_switch_id].timer()
+        # Update the current sensor.
+        self.power_switches[power_switch_id].update()
+
+      except Exception as err:
+        logger.exception('Engine loop: Power switch has problems: {}'.format(err))
+
+      # Make time for other web request
+      sleep(0.1)
+
+    self.update_state('switches')
+
+  def __update_status(self):
+    # Get the current average temperatures
+    self.__average_data = self.get_sensors(['average'])['sensors']
+    # Store the averages as their own history
+    self.collector.log_average_data(self.__average_data)
+
+    # Websocket callback
+    self.__send_message({'type':'sensor_gauge','data':self.__average_data})
+
+    # Websocket messages back
+    self.get_uptime(socket=True)
+    self.get_power_usage_water_flow(socket=True)
+    self.get_environment(socket=True)
+    self.get_audio_playing(socket=True)
 
-      # Websocket messages back
-      self.get_uptime(socket=True)
-      self.get_power_usage_water_flow(socket=True)
-      self.get_environment(socket=True)
-      self.get_audio_playing(socket=True)
+  def __update_system(self):
+    # Log system stats
+    self.__system_data = self.get_system_stats()
+    self.collector.log_system_data(self.__system_data)
+    self.state.set('system',self.__system_data)
+    self.get_system_stats(socket=True)
 
-      # Log system stats
-      system_data = self.get_system_stats()
-      motddata['system'] = system_data
-      self.collector.log_system_data(system_data)
-      self.get_system_stats(socket=True)
+  def __update_display(self):
+    if self.__average_data is None or self.__system_data is None:
+      return
 
-      display_message = ['%s %s' % (_('Uptime'),terrariumUtils.format_uptime(system_data['uptime']),),
-                         '%s %s %s %s' % (_('Load'),system_data['load']['load1'],system_data['load']['load5'],system_data['load']['load15']),
-                         '%s %.2f%s' % (_('CPU Temp.'),system_data['temperature'],self.get_temperature_indicator())]
+    motddata = {'average' : self.__average_data,
+                'system' : self.__system_data,
+                'power_switches' : [],
+                'error' : ''}
 
-      for env_part in average_data:
-        alarm_icon = '!' if average_data[env_part]['alarm'] else ''
-        display_message.append('%s%s %.2f%s%s' % (alarm_icon,_(env_part.replace('average_','').title()), average_data[env_part]['current'],average_data[env_part]['indicator'],alarm_icon))
+    for power_switch_id in self.power_switches:
+      if self.power_switches[power_switch_id].get_state() > 0:
+        power_state = '{}%'.format(self.power_switches[power_switch_id].get_state())
+        if not self.power_switches[power_switch_id].is_dimmer():
+          power_state = 'on' if self.power_switches[power_switch_id].is_on() else 'off'
 
-      self.notification.send_display("\n".join(display_message))
+        motddata['power_switches'].append({'name' : self.power_switches[power_switch_id].get_name(),
+                                           'state' : power_state})
 
-      duration = (time.time() - starttime) + time_short
-      motddata['duration'] = duration
-      if duration < terrariumEngine.LOOP_TIMEOUT:
-        if error_counter > 0:
-          error_counter -= 1
-        logger.info('Update done in %.5f seconds. Waiting for %.5f seconds for next update' % (duration,terrariumEngine.LOOP_TIMEOUT - duration))
-        time_short = 0
-        sleep(terrariumEngine.LOOP_TIMEOUT - duration) # TODO: Config setting
-      else:
-        error_counter += 1
-        if error_counter > 9:
-          error_message = 'Updating is having problems keeping up. Could not update in {} seconds for {} times!'.format(terrariumEngine.LOOP_TIMEOUT,error_counter)
-          motddata['error'] = error_message
-          logger.error(error_message)
+    late_jobs = self.scheduler.get_late_jobs()
+    if len(late_jobs) > 0:
+      error_message = 'Updating is having problems keeping up. Jobs {} are running late!'.format(', '.join(job['name'] for job in late_jobs))
+      motddata['error'] = error_message
+      logger.error(error_message)
 
-        logger.warning('Updating took to much time. Needed %.5f seconds which is %.5f more then the limit %s' % (duration,duration-terrariumEngine.LOOP_TIMEOUT,terrariumEngine.LOOP_TIMEOUT))
-        time_short = duration - terrariumEngine.LOOP_TIMEOUT
-        if time_short > 12:
-          # More then 12 seconds to late.... probably never fast enough...
-          time_short = 0
+    display_message = ['%s %s' % (_('Uptime'),terrariumUtils.format_uptime(self.__system_data['uptime']),),
+                       '%s %s %s %s' % (_('Load'),self.__system_data['load']['load1'],self.__system_data['load']['load5'],self.__system_data['load']['load15']),
+                       '%s %.2f%s' % (_('CPU Temp.'),self.__system_data['temperature'],self.get_temperature_indicator())]
+
+    for env_part in self.__average_data:
+      alarm_icon = '!' if self.__average_data[env_part]['alarm'] else ''
+      display_message.append('%s%s %.2f%s%s' % (alarm_icon,_(env_part.replace('average_','').title()), self.__average_data[env_part]['current'],self.__average_data[env_part]['indicator'],alarm_icon))
+
+    self.notification.send_display("\n".join(display_message))
+    self.__update_motd(motddata)
+
+  def update_state(self, resource = None):
+    # Mark the resources as changed. The state store builds them again on the next request
+    if resource in [None,'sensors']:
+      self.state.changed('sensors')
+      self.state.changed('sensors/average')
+
+    if resource in [None,'switches']:
+      self.state.changed('switches')
 
-      self.__update_motd(motddata)
+    if resource in [None,'system']:
+      self.state.changed('system')
+
+  def __engine_loop(self):
+    logger.info('Start terrariumPI engine')
+    self.scheduler.run()
 
   def __update_motd(self,data):
     template = """#!/bin/bash
@@ -850,7 +966,14 @@ reset=$(tput sgr0)
 
     os.chmod('motd.sh', 0o755)
 
-  def __send_message(self,message):
+  def __send_message(self,message,complete = False):
+    message = self.__websocket_delta.delta(message,complete)
+    if message is None:
+      # Nothing changed since the last message
+      return
+
+    # Encode once for all the clients
+    message = json.dumps(message)
     clients = self.subscribed_queues
     for queue in clients:
       queue.put(message)
@@ -876,6 +999,7 @@ reset=$(tput sgr0)
   def stop(self):
     # Stop engine processing first....
     self.__running = False
+    self.scheduler.stop()
 
     self.environment.stop()
 
@@ -956,39 +1080,17 @@ reset=$(tput sgr0)
     if len(parameters) > 0 and parameters[0] is not None:
       filtertype = parameters[0]
 
-    # Filter is based on sensorid
-    if filtertype is not None and filtertype in self.sensors:
-      data.append(self.sensors[filtertype].get_data(temperature_type=temperature_type))
-
-    else:
-      for sensorid in self.sensors:
-        # Filter based on sensor type
-        # Exclude Chirp light sensors for average calculation in favour of Lux measurements
-        if filtertype is None or (filtertype == 'average' and not (self.sensors[sensorid].get_exclude_avg() or (self.sensors[sensorid].get_sensor_type() == 'light' and self.sensors[sensorid].get_type() == 'chirp'))) or filtertype == self.sensors[sensorid].get_sensor_type():
-          data.append(self.sensors[sensorid].get_data(temperature_type=temperature_type))
-
     if 'average' == filtertype or len(parameters) == 2 and parameters[1] == 'average':
+      # The averages are kept up to date with every sensor change
       average = {}
-      for sensor in data:
-        if sensor['current'] is None:
+      for averagetype in self.__sensor_averages.get_groups():
+        if 'average' != filtertype and averagetype != 'average_' + filtertype:
           continue
 
-        sensor['type'] = 'average_' +  sensor['type']
-        if sensor['type'] not in average:
-          average[sensor['type']] = {'current' : 0.0, 'alarm_min' : 0.0, 'alarm_max' : 0.0, 'limit_min' : 0.0, 'limit_max':0.0, 'amount' : 0.0}
-
-        average[sensor['type']]['current'] += sensor['current']
-        average[sensor['type']]['alarm_min'] += sensor['alarm_min']
-        average[sensor['type']]['alarm_max'] += sensor['alarm_max']
-        average[sensor['type']]['limit_min'] += sensor['limit_min']
-        average[sensor['type']]['limit_max'] += sensor['limit_max']
-        average[sensor['type']]['amount'] += 1.0
-
-      for averagetype in average:
-        amount = average[averagetype]['amount']
-        del(average[averagetype]['amount'])
-        for field in average[averagetype]:
-          average[averagetype][field] /= amount
+        average[averagetype] = self.__sensor_averages.get(averagetype)
+        if 'temperature' == averagetype[8:] and temperature_type is not None and temperature_type != self.__unit_type('temperature'):
+          for field in average[averagetype]:
+            average[averagetype][field] = terrariumUtils.convert_from_to(average[averagetype][field],self.__unit_type('temperature'),temperature_type)
 
         average[averagetype]['alarm'] = not (average[averagetype]['alarm_min'] <= average[averagetype]['current'] <= average[averagetype]['alarm_max'])
         average[averagetype]['type'] = averagetype
@@ -996,6 +1098,16 @@ reset=$(tput sgr0)
 
       data = average
 
+    # Filter is based on sensorid
+    elif filtertype is not None and filtertype in self.sensors:
+      data.append(self.sensors[filtertype].get_data(temperature_type=temperature_type))
+
+    else:
+      for sensorid in self.sensors:
+        # Filter based on sensor type
+        if filtertype is None or filtertype == self.sensors[sensorid].get_sensor_type():
+          data.append(self.sensors[sensorid].get_data(temperature_type=temperature_type))
+
 #    if temperature_type is not None and temperature_type != terrariumConfig.get_temperature_indicator():
 #      if 'C' == temperature_type:
 #        pass
@@ -1005,7 +1117,8 @@ reset=$(tput sgr0)
 #        pass
 
     if socket:
-      self.__send_message({'type':'sensor_gauge','data':data})
+      # Without a filter the list has all the sensors
+      self.__send_message({'type':'sensor_gauge','data':data},filtertype is None)
     else:
       return {'sensors' : data}
 
@@ -1024,7 +1137,8 @@ reset=$(tput sgr0)
     if len(parameters) > 0 and parameters[0] is not None:
       filter = parameters[0]
 
-    if filter is not None and filter in self.power_switches:
+    complete = not (filter is not None and filter in self.power_switches)
+    if not complete:
       data.append(self.power_switches[filter].get_data())
 
     else:
@@ -1032,7 +1146,7 @@ reset=$(tput sgr0)
         data.append(self.power_switches[switchid].get_data())
 
     if socket:
-      self.__send_message({'type':'switches','data':data})
+      self.__send_message({'type':'switches','data':data},complete)
     else:
       return {'switches' : data}
 
@@ -1041,10 +1155,12 @@ reset=$(tput sgr0)
 
   def set_switches_config(self, data):
     self.__load_power_switches(data)
+    self.update_state('switches')
     return self.config.save_power_switches(self.power_switches)
 
   def toggle_power_switch(self,data):
     self.collector.log_switch_data(data)
+    self.update_state('switches')
     self.get_switches(socket=True)
     self.get_power_usage_water_flow(socket=True)
 
@@ -1062,7 +1178,8 @@ reset=$(tput sgr0)
     if len(parameters) > 0 and parameters[0] is not None:
       filter = parameters[0]
 
-    if filter is not None and filter in self.doors:
+    complete = not (filter is not None and filter in self.doors)
+    if not complete:
       data.append(self.doors[filter].get_data())
 
     else:
@@ -1070,7 +1187,7 @@ reset=$(tput sgr0)
         data.append(self.doors[doorid].get_data())
 
     if socket:
-      self.__send_message({'type':'doors','data':data})
+      self.__send_message({'type':'doors','data':data},complete)
     else:
       return {'doors' : data}
 
@@ -1392,6 +1509,10 @@ reset=$(tput sgr0)
     self.authentication = { username : password }
 
   def subscribe(self,queue):
+    # New clients start with the full state, and get the changes after that
+    for message in self.__websocket_delta.snapshot():
+      queue.put(json.dumps(message))
+
     self.subscribed_queues.append(queue)
     self.__send_message({'type':'dashboard_online', 'data':True})
 
@@ -1416,7 +1537,11 @@ reset=$(tput sgr0)
             'uptime' : uptime['uptime'],
             'cores' : psutil.cpu_count(),
             'temperature' : cpu_temp,
-            'external_calendar_url': self.config.get_external_calender_url()}
+            'external_calendar_url': self.config.get_external_calender_url(),
+            'collector' : self.collector.get_write_queue_stats(),
+            'history_cache' : self.collector.get_history_cache_stats(),
+            'scheduler' : self.scheduler.get_jobs(),
+            'websocket' : self.__websocket_delta.get_stats()}
 
     indicator = self.__unit_type('temperature').lower()
     if 'f' == indicator:
@@ -1453,6 +1578,10 @@ reset=$(tput sgr0)
     else:
       return data
 
+  def recalculate_power_usage_water_flow(self):
+    self.collector.recalculate_total_power_water_usage()
+    self.get_power_usage_water_flow(socket=True)
+
   def get_power_usage_water_flow(self, socket = False):
     data = self.__get_current_power_usage_water_flow()
     totaldata = self.__get_total_power_usage_water_flow()
@@ -1624,6 +1753,9 @@ reset=$(tput sgr0)
         self.set_distance_indicator(self.config.get_distance_indicator())
         self.set_windspeed_indicator(self.config.get_windspeed_indicator())
         self.set_volume_indicator(self.config.get_volume_indicator())
+        # The sensor values are changed to the new units
+        self.__update_sensor_averages()
+        self.update_state()
 
     return update_ok
 
@@ -1641,27 +1773,77 @@ reset=$(tput sgr0)
   # End system functions part
 
   # Histroy part (Collector)
-  def get_history(self, parameters = [], socket = False):
+  def __get_history_options(self, parameters):
+    exclude_ids = None
+    # We exclude Chirp light sensors for average calculations as they are less reliable
+    if 'sensors' in parameters and 'average' in parameters:
+      exclude_ids = []
+      for sensorid in self.sensors:
+        if self.sensors[sensorid].get_exclude_avg() or ('chirp' == self.sensors[sensorid].get_type() and 'light' == self.sensors[sensorid].get_sensor_type()):
+          exclude_ids.append(self.sensors[sensorid].get_id())
+
+    stoptime = None
+    if 'switches' in parameters and 'lr' in parameters:
+      stoptime = int(datetime.datetime.strptime(self.power_switches[parameters[1]].get_last_hardware_replacement(),'%Y-%m-%d').strftime('%s'))
+
+    return (stoptime, exclude_ids)
+
+  def get_history(self, parameters = [], socket = False, history_format = None, points = None, since = None, ids = None):
     data = {}
+    # The collector removes the used parameters, so keep a copy for the socket message
+    history_parameters = list(parameters)
     if len(parameters) == 0:
       data = {'history' : 'ERROR, select a history type'}
     else:
-      exclude_ids = None
-      # We exclude Chirp light sensors for average calculations as they are less reliable
-      if 'sensors' in parameters and 'average' in parameters:
-        exclude_ids = []
-        for sensorid in self.sensors:
-          if self.sensors[sensorid].get_exclude_avg() or ('chirp' == self.sensors[sensorid].get_type() and 'light' == self.sensors[sensorid].get_sensor_type()):
-            exclude_ids.append(self.sensors[sensorid].get_id())
-
-      stoptime = None
-      if 'switches' in parameters and 'lr' in parameters:
-        stoptime = int(datetime.datetime.strptime(self.power_switches[parameters[1]].get_last_hardware_replacement(),'%Y-%m-%d').strftime('%s'))
-
-      data = self.collector.get_history(parameters=parameters,stoptime=stoptime,exclude_ids=exclude_ids)
+      stoptime, exclude_ids = self.__get_history_options(parameters)
+      data = self.collector.get_history(parameters=parameters,stoptime=stoptime,exclude_ids=exclude_ids,history_format=history_format,points=points,since=since,ids=ids)
 
     if socket:
-      self.__send_message({'type':'history_graph','data': data})
+      self.__send_message({'type':'history_graph','data': data, 'parameters' : history_parameters, 'since' : since, 'ids' : ids})
     else:
       return data
+
+  def __get_period_range(self, parameters, start = None, end = None):
+    # The last parameter can be a period till the end time. Default is one day till now
+    periods = {'day' : 1,
+               'week' : 7,
+               'month' : 30,
+               'year' : 365,
+               'all' : 3650}
+
+    period = 'day'
+    if len(parameters) > 0 and parameters[-1] in periods:
+      period = parameters[-1]
+      del(parameters[-1])
+
+    if end is None:
+      end = int(time.time())
+
+    if start is None:
+      start = end - periods[period] * 24 * 60 * 60
+
+    return (start, end)
+
+  def get_alarms(self, parameters = [], start = None, end = None, type = None):
+    start, end = self.__get_period_range(parameters,start,end)
+    alarms = self.collector.get_alarms(starttime=end,stoptime=start,id=parameters[0] if len(parameters) > 0 else None,type=type)
+    for alarm in alarms:
+      alarm['name'] = self.sensors[alarm['id']].get_name() if alarm['id'] in self.sensors else None
+
+    return {'alarms' : alarms}
+
+  def get_statistics(self, parameters = [], start = None, end = None, type = None):
+    start, end = self.__get_period_range(parameters,start,end)
+    statistics = self.collector.get_statistics(starttime=end,stoptime=start,id=parameters[0] if len(parameters) > 0 else None,type=type)
+    for item in statistics:
+      item['name'] = self.sensors[item['id']].get_name() if item['id'] in self.sensors else None
+
+    return {'statistics' : statistics}
+
+  def get_history_export(self, parameters = [], start = None, end = None):
+    stoptime, exclude_ids = self.__get_history_options(parameters)
+    if start is not None:
+      stoptime = start
+
+    return self.collector.get_history_export(parameters=parameters,starttime=end,stoptime=stoptime,exclude_ids=exclude_ids)
   # End Histroy part (Collector)
@@ -13,6 +13,7 @@ from gevent import sleep
 
 from threading import Timer
 from terrariumUtils import terrariumUtils
+from terrariumSensor import terrariumSensorAverage
 
 class terrariumEnvironmentPart(object):
 
@@ -25,6 +26,8 @@ class terrariumEnvironmentPart(object):
                    'day_night_source' : day_night_source}
 
     self.sensor_data = {'current': 0, 'alarm_min' : 0, 'alarm_max' : 0, 'limit_min' : 0, 'limit_max' : 0}
+    # Running average of the active sensors of this part
+    self.sensor_average = terrariumSensorAverage()
     self.night_mode = False
     self.sensors_error = False
     self.timer_min_data = {'lastaction' : 0, 'power_state' : None}
@@ -214,30 +217,29 @@ class terrariumEnvironmentPart(object):
         for sensor in self.get_sensors(sensorlist):
           sensor.set_alarm_min(sensor.get_alarm_min() + (self.get_day_night_difference() * (1 if is_night else -1)))
           sensor.set_alarm_max(sensor.get_alarm_max() + (self.get_day_night_difference() * (1 if is_night else -1)))
+          self.update_sensor(sensor)
 
         self.night_mode = is_night
 
-  def update_average_data(self,sensorlist):
-    self.sensor_data = {'current':0.0, 'alarm_min' : 0.0, 'alarm_max' : 0.0, 'limit_min' : 0.0, 'limit_max' : 0.0}
-    amount_of_sensors = 0
-
-    for sensor in self.get_sensors(sensorlist):
-      if not sensor.is_active():
-        # Skip sensor in error state...
-        continue
+  def update_sensor(self,sensor):
+    # Skip sensor in error state...
+    self.sensor_average.set(sensor.get_id(),
+                            'sensors' if sensor.is_active() and sensor.get_current() is not None else None,
+                            [sensor.get_current(),sensor.get_alarm_min(),sensor.get_alarm_max(),sensor.get_limit_min(),sensor.get_limit_max()])
 
-      self.sensor_data['current']   += sensor.get_current()
-      self.sensor_data['alarm_min'] += sensor.get_alarm_min()
-      self.sensor_data['alarm_max'] += sensor.get_alarm_max()
-      self.sensor_data['limit_min'] += sensor.get_limit_min()
-      self.sensor_data['limit_max'] += sensor.get_limit_max()
-      amount_of_sensors += 1
+  def load_sensors(self,sensorlist):
+    for sensorid in self.sensor_average.get_sensors():
+      if sensorid not in sensorlist:
+        self.sensor_average.remove(sensorid)
 
-    if amount_of_sensors > 0:
-      for part in self.sensor_data:
-        self.sensor_data[part] /= float(amount_of_sensors)
+    for sensor in self.get_sensors(sensorlist):
+      self.update_sensor(sensor)
 
-    self.sensors_error = amount_of_sensors == 0 and len(self.get_sensors()) > 0
+  def update_average_data(self,sensorlist):
+    # The average is updated with every sensor change
+    average = self.sensor_average.get('sensors')
+    self.sensor_data = {'current':0.0, 'alarm_min' : 0.0, 'alarm_max' : 0.0, 'limit_min' : 0.0, 'limit_max' : 0.0} if average is None else average
+    self.sensors_error = average is None and len(self.get_sensors()) > 0
 
   def update_powerswitches_data(self,powerswitchList):
     self.__get_power_state(powerswitchList)
@@ -747,6 +749,8 @@ class terrariumEnvironment(object):
                                       120.0    if 'alarm_max_settle' not in env_conf else env_conf['alarm_max_settle'],
                                       []       if ('alarm_max_powerswitches' not in env_conf or env_conf['alarm_max_powerswitches'] in ['',None]) else env_conf['alarm_max_powerswitches'])
 
+    self.load_sensors()
+
     logger.info('Done %s terrariumPI Environment %.3f seconds' % ('reloading' if reloading else 'loading',
                                                                                       time.time()-starttime))
     if reloading:
@@ -899,8 +903,19 @@ class terrariumEnvironment(object):
 
     return on
 
+  def load_sensors(self):
+    for env_part in self.__environment_parts:
+      if self.__environment_parts[env_part] is not None:
+        self.__environment_parts[env_part].load_sensors(self.sensors)
+
+  def update_sensor(self,sensor):
+    for env_part in self.__environment_parts:
+      if self.__environment_parts[env_part] is not None and sensor.get_id() in self.__environment_parts[env_part].get_sensors():
+        self.__environment_parts[env_part].update_sensor(sensor)
+
   def set_sensors(self,sensorlist):
     self.sensors = sensorlist
+    self.load_sensors()
     self.update()
 
   def set_power_switches(self,powerswitchlist):
@@ -14,6 +14,8 @@ from terrariumUtils import terrariumUtils
 class terrariumGPIOSensor(terrariumSensorSource):
   TYPE = None
   VALID_SENSOR_TYPES = []
+  # Reading GPIO sensors is timing critical, so they are never read at the same time
+  BUS = 'gpio'
 
   def __init__(self, sensor_id, sensor_type, address, name = '', callback_indicator = None):
     super(terrariumGPIOSensor,self).__init__(sensor_id, sensor_type, address, name, callback_indicator)
@@ -36,6 +36,7 @@ from terrariumUtils import terrariumUtils
 class terrariumI2CSensor(terrariumSensorSource):
   TYPE = None
   VALID_SENSOR_TYPES = ['temperature','humidity']
+  BUS = 'i2c'
 
   # control constants
   SOFTRESET = 0xFE
@@ -47,6 +48,11 @@ class terrariumI2CSensor(terrariumSensorSource):
   TRIGGER_HUMIDITY_NO_HOLD = 0xF5
   HUMIDITY_WAIT_TIME = 0.1
 
+  def get_bus(self):
+    # The I2C bus number is the optional second part of the address. Default is bus 1
+    address = str(self.get_address()).split(',')
+    return '{}:{}'.format(self.BUS,1 if len(address) == 1 else address[1].strip())
+
   def load_data(self):
     self.i2c_bus = None
 
@@ -142,6 +148,8 @@ class terrariumSHT2XSensor(terrariumI2CSensor):
 class terrariumSHT3XSensor(terrariumSensorSource):
   TYPE = 'sht3x'
   VALID_SENSOR_TYPES = ['temperature','humidity']
+  BUS = terrariumI2CSensor.BUS
+  get_bus = terrariumI2CSensor.get_bus
 
   # Datasheet: https://cdn-shop.adafruit.com/product-files/2857/Sensirion_Humidity_SHT3x_Datasheet_digital-767294.pdf
   def load_data(self):
@@ -162,6 +170,8 @@ class terrariumSHT3XSensor(terrariumSensorSource):
 class terrariumSHT3XDSensor(terrariumSensorSource):
   TYPE = 'sht3xd'
   VALID_SENSOR_TYPES = ['temperature','humidity']
+  BUS = terrariumI2CSensor.BUS
+  get_bus = terrariumI2CSensor.get_bus
 
   # https://github.com/adafruit/Adafruit_CircuitPython_SHT31D/
   def load_data(self):
@@ -389,6 +399,8 @@ class terrariumVEML6075Sensor(terrariumI2CSensor):
 class terrariumChirpSensor(terrariumSensorSource):
   TYPE = 'chirp'
   VALID_SENSOR_TYPES = ['temperature','moisture','light']
+  BUS = terrariumI2CSensor.BUS
+  get_bus = terrariumI2CSensor.get_bus
 
   # Datasheet: https://wemakethings.net/chirp/
   def __init__(self, sensor_id, sensor_type, address, name = '', callback_indicator = None):
@@ -457,6 +469,8 @@ class terrariumChirpSensor(terrariumSensorSource):
 class terrariumMLX90614Sensor(terrariumSensorSource):
   TYPE = 'mlx90614'
   VALID_SENSOR_TYPES = ['temperature']
+  BUS = terrariumI2CSensor.BUS
+  get_bus = terrariumI2CSensor.get_bus
 
   def set_address(self,address):
     super(terrariumMLX90614Sensor,self).set_address(address)
@@ -565,6 +579,8 @@ class terrariumAM2320Sensor(terrariumI2CSensor):
 class terrariumAMG8833Sensor(terrariumSensorSource):
   TYPE = 'amg8833'
   VALID_SENSOR_TYPES = ['temperature']
+  BUS = terrariumI2CSensor.BUS
+  get_bus = terrariumI2CSensor.get_bus
 
   def set_address(self,address):
     super(terrariumAMG8833Sensor,self).set_address(address)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import terrariumLogging
+logger = terrariumLogging.logging.getLogger(__name__)
+
+import heapq
+import time
+
+from gevent import sleep
+
+class terrariumSchedulerJob(object):
+  def __init__(self, name, interval, callback = None, group = None, data = None):
+    self.name = name
+    self.interval = float(interval)
+    self.callback = callback
+    self.group = group
+    self.data = data
+
+    self.due = None
+    self.last_run = None
+    self.lag = 0.0
+    self.duration = 0.0
+    self.runs = 0
+    self.missed = 0
+    # Removed jobs stay in the queue until they are due, and are then ignored
+    self.removed = False
+
+  def get_data(self):
+    return {'name' : self.name,
+            'interval' : self.interval,
+            'group' : self.group,
+            'next_run' : None if self.due is None else time.time() + (self.due - time.monotonic()),
+            'last_run' : self.last_run,
+            'lag' : self.lag,
+            'duration' : self.duration,
+            'runs' : self.runs,
+            'missed' : self.missed}
+
+class terrariumScheduler(object):
+  # Maximum amount of seconds to sleep, so new jobs and stopping are noticed in time
+  MAX_SLEEP = 1.0
+  # Log a warning when a job starts more then X seconds too late
+  LAG_WARNING = 5.0
+
+  def __init__(self):
+    self.__jobs = {}
+    self.__groups = {}
+    self.__queue = []
+    self.__counter = 0
+    self.__running = False
+
+  def __push(self,job,due):
+    job.due = due
+    # The counter keeps jobs that are due at the same time in the order they are added
+    self.__counter += 1
+    heapq.heappush(self.__queue,(due,self.__counter,job))
+
+  def __reschedule(self,job,now):
+    due = job.due + job.interval
+    if due <= now:
+      # Skip the runs that are missed, instead of running the job multiple times to catch up
+      missed = int((now - due) // job.interval) + 1
+      job.missed += missed
+      due += missed * job.interval
+
+    self.__push(job,due)
+
+  def __run_jobs(self,jobs):
+    # Jobs with a group are run together with one call, at the place of the first job of the group
+    tasks = {}
+    for job in jobs:
+      key = job.name if job.group is None else 'group_' + job.group
+      if key not in tasks:
+        tasks[key] = []
+
+      tasks[key].append(job)
+
+    for key in tasks:
+      starttime = time.time()
+      try:
+        if tasks[key][0].group is None:
+          tasks[key][0].callback()
+        else:
+          self.__groups[tasks[key][0].group]([job.data for job in tasks[key]])
+
+      except Exception as ex:
+        logger.exception('Scheduler job {} has problems: {}'.format(key,ex))
+
+      duration = time.time() - starttime
+      for job in tasks[key]:
+        job.last_run = starttime
+        job.duration = duration
+        job.runs += 1
+
+  def add_group(self, group, callback):
+    self.__groups[group] = callback
+
+  def add_job(self, name, interval, callback = None, group = None, data = None, delay = 0):
+    self.remove_job(name)
+
+    job = terrariumSchedulerJob(name, interval, callback, group, data)
+    self.__jobs[name] = job
+    self.__push(job,time.monotonic() + delay)
+    logger.debug('Added scheduler job {} with an interval of {} seconds'.format(name,interval))
+    return job
+
+  def remove_job(self, name):
+    if name in self.__jobs:
+      self.__jobs[name].removed = True
+      del(self.__jobs[name])
+
+  def get_job(self, name):
+    return self.__jobs.get(name)
+
+  def get_jobs(self):
+    return [self.__jobs[name].get_data() for name in sorted(self.__jobs)]
+
+  def get_late_jobs(self):
+    # Jobs that started more then an interval too late are not keeping up
+    return [self.__jobs[name].get_data() for name in sorted(self.__jobs) if self.__jobs[name].lag > self.__jobs[name].interval]
+
+  def run(self):
+    self.__running = True
+    while self.__running:
+      now = time.monotonic()
+      # Drop the removed jobs at the front of the queue
+      while len(self.__queue) > 0 and self.__queue[0][2].removed:
+        heapq.heappop(self.__queue)
+
+      if len(self.__queue) == 0 or self.__queue[0][0] > now:
+        sleep(terrariumScheduler.MAX_SLEEP if len(self.__queue) == 0 else min(terrariumScheduler.MAX_SLEEP,self.__queue[0][0] - now))
+        continue
+
+      jobs = []
+      while len(self.__queue) > 0 and self.__queue[0][0] <= now:
+        job = heapq.heappop(self.__queue)[2]
+        if job.removed:
+          continue
+
+        job.lag = now - job.due
+        if job.lag > terrariumScheduler.LAG_WARNING:
+          logger.warning('Scheduler job {} started {:.5f} seconds too late'.format(job.name,job.lag))
+
+        jobs.append(job)
+
+      self.__run_jobs(jobs)
+
+      now = time.monotonic()
+      for job in jobs:
+        if not job.removed:
+          self.__reschedule(job,now)
+
+      # Make time for other web request
+      sleep(0)
+
+  def stop(self):
+    self.__running = False
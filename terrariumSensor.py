@@ -11,9 +11,10 @@ import serial
 
 from glob import iglob
 from time import time
+from urllib.parse import urlparse
 from pyownet import protocol
 from hashlib import md5
-from gevent import sleep
+from gevent import sleep, get_hub
 
 from terrariumUtils import terrariumUtils, terrariumSingleton
 
@@ -47,9 +48,76 @@ class terrariumSensorCache(terrariumSingleton):
   def clear_running(self,sensor_hash):
     del(self.__running[sensor_hash])
 
+class terrariumSensorAverage(object):
+  # Running sums of sensor values per group, so an average is read without walking all the sensors.
+  # Every sensor is in at most one group, and is updated when its values change
+  FIELDS = ['current','alarm_min','alarm_max','limit_min','limit_max']
+  # Rebuild the sums of a group after X changes, to remove the rounding errors of adding and subtracting
+  RECALCULATE = 1000
+
+  def __init__(self):
+    self.__sensors = {}
+    self.__groups = {}
+
+  def __add(self,group,values,sign):
+    if group not in self.__groups:
+      self.__groups[group] = {'sums' : [0.0] * len(terrariumSensorAverage.FIELDS), 'amount' : 0, 'changes' : 0}
+
+    data = self.__groups[group]
+    for index, value in enumerate(values):
+      data['sums'][index] += sign * value
+
+    data['amount'] += sign
+    data['changes'] += 1
+
+    if data['amount'] == 0:
+      del(self.__groups[group])
+
+    elif data['changes'] >= terrariumSensorAverage.RECALCULATE:
+      sensors = [self.__sensors[sensorid][1] for sensorid in self.__sensors if self.__sensors[sensorid][0] == group]
+      data['sums'] = [sum(values[index] for values in sensors) for index in range(len(terrariumSensorAverage.FIELDS))]
+      data['changes'] = 0
+
+  def set(self,sensorid,group,values = None):
+    # Use group None or values None to remove the sensor from the averages
+    values = None if group is None or values is None else tuple(float(value) for value in values)
+    old = self.__sensors.get(sensorid)
+    if old is not None and values is not None and old[0] == group and old[1] == values:
+      return
+
+    if old is not None:
+      del(self.__sensors[sensorid])
+      self.__add(old[0],old[1],-1)
+
+    if values is not None:
+      self.__sensors[sensorid] = (group,values)
+      self.__add(group,values,1)
+
+  def remove(self,sensorid):
+    self.set(sensorid,None)
+
+  def get_sensors(self):
+    return list(self.__sensors.keys())
+
+  def get_groups(self):
+    return list(self.__groups.keys())
+
+  def get(self,group):
+    if group not in self.__groups:
+      return None
+
+    data = self.__groups[group]
+    return {field : data['sums'][index] / data['amount'] for index, field in enumerate(terrariumSensorAverage.FIELDS)}
+
 class terrariumSensorSource(object):
   TYPE = None
   VALID_SENSOR_TYPES = []
+  # Sensors on the same bus are read one after the other. Sensors on different buses can be read at the same time
+  BUS = 'local'
+  # Set to True when the raw hardware read blocks without using gevent. Only that read is then done in a separate thread
+  BLOCKING_IO = False
+  # Default amount of seconds between two readings
+  UPDATE_INTERVAL = 30
 
   def __init__(self, sensor_id, sensor_type, address, name = '', callback_indicator = None):
     self.__sensor_cache = terrariumSensorCache()
@@ -60,6 +128,9 @@ class terrariumSensorSource(object):
     self.__last_update = 0
 
     self.exclude_avg = False
+    self.deadband = 0.0
+    self.heartbeat = 0
+    self.update_interval = self.UPDATE_INTERVAL
 
     self.sensor_id = sensor_id
     self.notification = True
@@ -110,7 +181,8 @@ class terrariumSensorSource(object):
       new_data = self.load_data()
 
       if new_data is not None:
-        self.__sensor_cache.set_sensor_data(self.get_sensor_cache_key(),new_data,terrariumSensor.UPDATE_TIMEOUT)
+        # Keep the data till just before the next reading, so sensors on the same hardware share one reading
+        self.__sensor_cache.set_sensor_data(self.get_sensor_cache_key(),new_data,self.get_update_interval() - 1)
         cached_data = new_data
 
       self.__sensor_cache.clear_running(self.get_sensor_cache_key())
@@ -187,7 +259,10 @@ class terrariumSensorSource(object):
             'max_diff' : self.get_max_diff(),
             'alarm' : self.get_alarm(),
             'error' : not self.is_active(),
-            'exclude_avg' : self.get_exclude_avg()
+            'exclude_avg' : self.get_exclude_avg(),
+            'deadband' : self.get_deadband(),
+            'heartbeat' : self.get_heartbeat(),
+            'update_interval' : self.get_update_interval()
             }
 
     if 'temperature' == self.get_sensor_type() and temperature_type is not None and temperature_type != self.get_indicator():
@@ -200,6 +275,19 @@ class terrariumSensorSource(object):
   def get_type(self):
     return self.TYPE
 
+  def get_bus(self):
+    return self.BUS
+
+  def is_blocking_io(self):
+    return self.BLOCKING_IO
+
+  def read_blocking(self,function,*args):
+    # The function runs in a native thread, so it must not use gevent, logging or the sensor cache
+    if self.is_blocking_io():
+      return get_hub().threadpool.apply(function,args)
+
+    return function(*args)
+
   def get_last_update(self):
     return self.__last_update
 
@@ -268,6 +356,26 @@ class terrariumSensorSource(object):
   def get_exclude_avg(self):
     return self.exclude_avg
 
+  def set_deadband(self,value):
+    self.deadband = abs(float(value))
+
+  def get_deadband(self):
+    return self.deadband
+
+  def set_heartbeat(self,value):
+    self.heartbeat = abs(int(float(value)))
+
+  def get_heartbeat(self):
+    return self.heartbeat
+
+  def set_update_interval(self,value):
+    value = int(float(value))
+    # Use 0 for the default hardware interval. Stay below the error timeout, else the sensor will be marked as failing
+    self.update_interval = self.UPDATE_INTERVAL if value <= 0 else min(max(value,terrariumSensor.MIN_UPDATE_INTERVAL),terrariumSensor.MAX_UPDATE_INTERVAL)
+
+  def get_update_interval(self):
+    return self.update_interval
+
   def get_indicator(self):
     # Use a callback from terrariumEngine for 'realtime' updates
     return self.__indicator(self.get_sensor_type())
@@ -301,6 +409,11 @@ class terrariumSensorSource(object):
 class terrariumRemoteSensor(terrariumSensorSource):
   TYPE = 'remote'
   VALID_SENSOR_TYPES = []
+  BUS = 'remote'
+
+  def get_bus(self):
+    # Every remote host is a separate bus
+    return '{}:{}'.format(self.BUS,urlparse(self.get_address()).netloc)
 
   def load_data(self):
     data = terrariumUtils.get_remote_data(self.get_address())
@@ -312,6 +425,10 @@ class terrariumRemoteSensor(terrariumSensorSource):
 class terrariumScriptSensor(terrariumSensorSource):
   TYPE = 'script'
   VALID_SENSOR_TYPES = []
+  BUS = 'script'
+
+  def get_bus(self):
+    return '{}:{}'.format(self.BUS,self.get_address())
 
   def load_data(self):
     data = terrariumUtils.get_script_data(self.get_address())
@@ -323,6 +440,11 @@ class terrariumScriptSensor(terrariumSensorSource):
 class terrarium1WSensor(terrariumSensorSource):
   TYPE = 'w1'
   VALID_SENSOR_TYPES = ['temperature']
+  BUS = 'w1'
+  # Reading the w1_slave file blocks in the kernel for almost a second
+  BLOCKING_IO = True
+  # Every 1-wire reading blocks the bus for almost a second, and water and substrate temperatures change slowly
+  UPDATE_INTERVAL = 60
 
   W1_BASE_PATH = '/sys/bus/w1/devices/'
   W1_TEMP_REGEX = re.compile(r'(?P<type>t|f)=(?P<value>[0-9\-]+)',re.IGNORECASE)
@@ -331,12 +453,11 @@ class terrarium1WSensor(terrariumSensorSource):
     data = None
     try:
       if self.get_address() is not None:
-        with open(os.path.join(terrarium1WSensor.W1_BASE_PATH,self.get_address(),'w1_slave'), 'r') as w1data:
-          data = w1data.read()
-          w1data = terrarium1WSensor.W1_TEMP_REGEX.search(data)
-          if w1data:
-            # Found data
-            data = float(w1data.group('value')) / 1000.0
+        data = self.read_blocking(terrarium1WSensor.read_w1_slave,os.path.join(terrarium1WSensor.W1_BASE_PATH,self.get_address(),'w1_slave'))
+        w1data = terrarium1WSensor.W1_TEMP_REGEX.search(data)
+        if w1data:
+          # Found data
+          data = float(w1data.group('value')) / 1000.0
     except Exception as ex:
       logger.exception('Error loading 1 Wire data at location: {} with error: {}'.format(os.path.join(terrarium1WSensor.W1_BASE_PATH,self.get_address(),'w1_slave'),ex))
 
@@ -345,6 +466,11 @@ class terrarium1WSensor(terrariumSensorSource):
 
     return { self.get_sensor_type() : data}
 
+  @staticmethod
+  def read_w1_slave(path):
+    with open(path, 'r') as w1data:
+      return w1data.read()
+
   @staticmethod
   def scan_sensors(callback = None):
     # Scanning w1 system bus
@@ -367,6 +493,7 @@ class terrarium1WSensor(terrariumSensorSource):
 class terrariumOWFSSensor(terrariumSensorSource):
   TYPE = 'owfs'
   VALID_SENSOR_TYPES = ['temperature','humidity']
+  BUS = 'owfs'
 
   def __init__(self, sensor_id, sensor_type, address, name = '', callback_indicator = None):
     self.__host = 'localhost'
@@ -430,6 +557,10 @@ class terrariumOWFSSensor(terrariumSensorSource):
 class terrariumMHZ19Sensor(terrariumSensorSource):
   TYPE = 'mh-z19'
   VALID_SENSOR_TYPES = ['co2','temperature']
+  BUS = 'serial'
+
+  def get_bus(self):
+    return '{}:{}'.format(self.BUS,self.get_address())
 
   def set_address(self,address):
     # Address is not needed according to source....
@@ -456,6 +587,10 @@ class terrariumK30CO2Sensor(terrariumSensorSource):
   # https://computenodes.net/2017/08/18/__trashed-4/ , https://github.com/theyosh/TerrariumPI/issues/177
   TYPE = 'k30co2'
   VALID_SENSOR_TYPES = ['co2']
+  BUS = 'serial'
+
+  def get_bus(self):
+    return '{}:{}'.format(self.BUS,self.get_address())
 
   def load_data(self):
     data = None
@@ -484,6 +619,10 @@ class terrariumCOZIRCO2Sensor(terrariumSensorSource):
   # http://www.co2meters.com/Documentation/AppNotes/AN127-COZIR-sensor-raspberry-pi-uart.pdf
   TYPE = 'cozirco2'
   VALID_SENSOR_TYPES = ['co2']
+  BUS = 'serial'
+
+  def get_bus(self):
+    return '{}:{}'.format(self.BUS,self.get_address())
 
   def load_data(self):
     data = None
@@ -527,8 +666,9 @@ class terrariumSensorTypeException(TypeError):
 
 # Factory class
 class terrariumSensor(object):
-  UPDATE_TIMEOUT = 29
   ERROR_TIMEOUT = 10 * 60 # 10 minutes
+  MIN_UPDATE_INTERVAL = 5
+  MAX_UPDATE_INTERVAL = ERROR_TIMEOUT // 2
 
   SENSORS = [terrariumRemoteSensor,
              terrariumScriptSensor,
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import terrariumLogging
+logger = terrariumLogging.logging.getLogger(__name__)
+
+import json
+import time
+
+class terrariumStateStore(object):
+  # Latest state per resource as JSON, so requests are served without building and encoding the data again.
+  # Every change gets a new version number, which is also used as ETag
+  def __init__(self):
+    # Versions start again after a restart, so the start time is part of the ETag
+    self.__instance = int(time.time())
+    self.__version = 0
+    self.__resources = {}
+    self.__sources = {}
+
+  def add_source(self,resource,source,max_age = None):
+    # The source function gives the data of the resource. It is only called on a request after a change,
+    # or when the state is older then max_age seconds
+    self.__sources[resource] = {'source' : source, 'max_age' : max_age, 'changed' : True, 'refreshed' : None}
+
+  def changed(self,resource):
+    if resource in self.__sources:
+      self.__sources[resource]['changed'] = True
+
+  def set(self,resource,data):
+    if resource in self.__sources:
+      self.__sources[resource]['changed'] = False
+      self.__sources[resource]['refreshed'] = time.time()
+
+    data = json.dumps(data).encode()
+    if resource in self.__resources and self.__resources[resource]['data'] == data:
+      # Nothing changed, keep the version
+      return False
+
+    self.__version += 1
+    self.__resources[resource] = {'data' : data,
+                                  'version' : self.__version,
+                                  'etag' : '"{}-{}"'.format(self.__instance,self.__version),
+                                  'timestamp' : time.time()}
+
+    logger.debug('Updated state {} to version {} with {} bytes'.format(resource,self.__version,len(data)))
+    return True
+
+  def get(self,resource):
+    source = self.__sources.get(resource)
+    if source is not None and (source['changed'] or source['refreshed'] is None or \
+                               (source['max_age'] is not None and time.time() - source['refreshed'] >= source['max_age'])):
+      try:
+        self.set(resource,source['source']())
+      except Exception as ex:
+        # Keep serving the last known state
+        logger.exception('Error updating state {}: {}'.format(resource,ex))
+
+    return self.__resources.get(resource)
+
+  def get_version(self):
+    return self.__version
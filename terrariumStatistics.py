@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+import terrariumLogging
+logger = terrariumLogging.logging.getLogger(__name__)
+
+import math
+import json
+
+class terrariumQuantileSketch(object):
+  # Quantile sketch with a relative error (like DDSketch). Values are counted in logarithmic buckets, so a day of
+  # sensor values fits in a few hundred counters and sketches of multiple days can be merged for longer periods
+  RELATIVE_ACCURACY = 0.01
+  # Values closer to zero are counted as zero
+  MIN_VALUE = 1e-9
+
+  def __init__(self):
+    self.__gamma = (1 + terrariumQuantileSketch.RELATIVE_ACCURACY) / (1 - terrariumQuantileSketch.RELATIVE_ACCURACY)
+    self.__log_gamma = math.log(self.__gamma)
+    self.__positive = {}
+    self.__negative = {}
+    self.__zero = 0
+
+  def __len__(self):
+    return self.__zero + sum(self.__positive.values()) + sum(self.__negative.values())
+
+  def __index(self,value):
+    return int(math.ceil(math.log(value) / self.__log_gamma))
+
+  def __value(self,index):
+    return 2.0 * math.pow(self.__gamma,index) / (self.__gamma + 1)
+
+  def add(self,value):
+    if value > terrariumQuantileSketch.MIN_VALUE:
+      index = self.__index(value)
+      self.__positive[index] = self.__positive.get(index,0) + 1
+    elif value < -terrariumQuantileSketch.MIN_VALUE:
+      index = self.__index(-value)
+      self.__negative[index] = self.__negative.get(index,0) + 1
+    else:
+      self.__zero += 1
+
+  def merge(self,other):
+    for index, amount in other.__positive.items():
+      self.__positive[index] = self.__positive.get(index,0) + amount
+
+    for index, amount in other.__negative.items():
+      self.__negative[index] = self.__negative.get(index,0) + amount
+
+    self.__zero += other.__zero
+
+  def quantile(self,quantile):
+    amount = len(self)
+    if amount == 0:
+      return None
+
+    rank = quantile * (amount - 1)
+    counted = 0
+    # From the lowest negative value till the highest positive value
+    for index in sorted(self.__negative.keys(),reverse=True):
+      counted += self.__negative[index]
+      if counted > rank:
+        return -self.__value(index)
+
+    counted += self.__zero
+    if counted > rank:
+      return 0.0
+
+    for index in sorted(self.__positive.keys()):
+      counted += self.__positive[index]
+      if counted > rank:
+        return self.__value(index)
+
+    return self.__value(max(self.__positive.keys())) if len(self.__positive) > 0 else 0.0
+
+  def to_json(self):
+    return json.dumps({'positive' : self.__positive, 'negative' : self.__negative, 'zero' : self.__zero},separators=(',',':'))
+
+  @staticmethod
+  def from_json(data):
+    sketch = terrariumQuantileSketch()
+    if data is not None and '' != data:
+      data = json.loads(data)
+      # JSON keys are always text
+      sketch.__positive = {int(index) : amount for index, amount in data['positive'].items()}
+      sketch.__negative = {int(index) : amount for index, amount in data['negative'].items()}
+      sketch.__zero = data['zero']
+
+    return sketch
+
+class terrariumSensorStatistics(object):
+  # Online statistics of a sensor. The mean and variance are updated with Welford's algorithm and the percentiles
+  # are read from a quantile sketch, so no values need to be stored
+  PERCENTILES = [5, 50, 95]
+
+  def __init__(self, amount = 0, mean = 0.0, m2 = 0.0, minimum = None, maximum = None, sketch = None):
+    self.amount = amount
+    self.mean = mean
+    self.m2 = m2
+    self.minimum = minimum
+    self.maximum = maximum
+    self.sketch = terrariumQuantileSketch() if sketch is None else sketch
+
+  def add(self,value):
+    value = float(value)
+    self.amount += 1
+    delta = value - self.mean
+    self.mean += delta / self.amount
+    self.m2 += delta * (value - self.mean)
+    self.minimum = value if self.minimum is None else min(self.minimum,value)
+    self.maximum = value if self.maximum is None else max(self.maximum,value)
+    self.sketch.add(value)
+
+  def merge(self,other):
+    if other.amount == 0:
+      return
+
+    amount = self.amount + other.amount
+    delta = other.mean - self.mean
+    self.mean += delta * other.amount / amount
+    self.m2 += other.m2 + delta * delta * self.amount * other.amount / amount
+    self.amount = amount
+    self.minimum = other.minimum if self.minimum is None else min(self.minimum,other.minimum)
+    self.maximum = other.maximum if self.maximum is None else max(self.maximum,other.maximum)
+    self.sketch.merge(other.sketch)
+
+  def get_statistics(self):
+    statistics = {'amount' : self.amount,
+                  'mean' : None,
+                  'stddev' : None,
+                  'min' : self.minimum,
+                  'max' : self.maximum}
+
+    for percentile in terrariumSensorStatistics.PERCENTILES:
+      statistics['p' + str(percentile)] = None
+
+    if self.amount > 0:
+      statistics['mean'] = self.mean
+      statistics['stddev'] = math.sqrt(self.m2 / self.amount)
+      for percentile in terrariumSensorStatistics.PERCENTILES:
+        # The sketch value is an estimate, so keep it between the real min and max values
+        statistics['p' + str(percentile)] = min(self.maximum,max(self.minimum,self.sketch.quantile(percentile / 100.0)))
+
+    return statistics
+
+  @staticmethod
+  def from_row(row):
+    return terrariumSensorStatistics(row['amount'],row['mean'],row['m2'],row['min'],row['max'],terrariumQuantileSketch.from_json(row['sketch']))
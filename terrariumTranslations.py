@@ -48,6 +48,9 @@ class terrariumTranslations(object):
     self.translations['sensor_field_max_moist'] = _('Holds the sensor highest moisture value measured in full water. %s') % ('<a href="https://github.com/ageir/chirp-rpi#calibration" target="_blank" title="' + _('More calibration information') + '"><i>' + _('More calibration information') + '</i></a>')
     self.translations['sensor_field_temperature_offset'] = _('Holds the temperature offset value.')
     self.translations['sensor_field_max_diff'] = _('Holds the maximum number that a sensor may change in value up or down.')
+    self.translations['sensor_field_deadband'] = _('Holds the minimal change in value before a new value is stored in the history. Use 0 to store every change.')
+    self.translations['sensor_field_heartbeat'] = _('Holds the maximum amount of seconds between two stored values when the value does not change. Use 0 to store every minute, unless a deadband is set.')
+    self.translations['sensor_field_update_interval'] = _('Holds the amount of seconds between two sensor readings. Use 0 for the default interval of the hardware.')
     # End sensors
 
     # Switches
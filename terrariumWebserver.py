@@ -11,10 +11,14 @@ except ImportError as ex:
 import json
 import os
 import datetime
+import time
 import hashlib
 import functools
+import csv
+import io
+import zlib
 
-from bottle import BaseRequest, Bottle, request, abort, static_file, template, error, response, auth_basic, HTTPError
+from bottle import BaseRequest, Bottle, request, abort, static_file, template, error, response, auth_basic, HTTPError, HTTPResponse
 #Increase bottle memory to max 5MB to process images in WYSIWYG editor
 BaseRequest.MEMFILE_MAX = 5 * 1024 * 1024
 
@@ -147,6 +151,12 @@ class terrariumWebserver(object):
                      apply=self.__authenticate(True)
                     )
 
+    self.__app.route('/api/history/totals/recalculate',
+                     method=['POST'],
+                     callback=self.__recalculate_totals,
+                     apply=self.__authenticate(True)
+                    )
+
     self.__app.route('/api/switch/toggle/<switchid:path>',
                      method=['POST'],
                      callback=self.__toggle_switch,
@@ -368,6 +378,12 @@ class terrariumWebserver(object):
     result = {}
     parameters = path.strip('/').split('/')
 
+    # The most requested resources are served straight from the engine state store
+    if '/'.join(parameters) in ['sensors','sensors/average','switches','system']:
+      state = self.__get_state('/'.join(parameters))
+      if state is not None:
+        return state
+
     action = parameters[0]
     del(parameters[0])
 
@@ -432,39 +448,126 @@ class terrariumWebserver(object):
       # TODO: New way of data processing.... fix other config options
       result = self.__terrariumEngine.get_config(parameters[0] if len(parameters) == 1 else None)
 
-    elif 'history' == action or 'export' == action:
+    elif 'history' == action:
       response.headers['Expires'] = (datetime.datetime.utcnow() + datetime.timedelta(minutes=1)).strftime('%a, %d %b %Y %H:%M:%S GMT')
-      if 'export' == action:
-        parameters.append('all')
-      result = self.__terrariumEngine.get_history(parameters)
-
-      if 'export' == action:
-        csv = ''
-        export_name = 'error'
-        for datatype in result:
-          for dataid in result[datatype]:
-            export_name = datatype + '_' + dataid + '.csv'
-            # Header
-            fields = list(result[datatype][dataid].keys())
-            if 'totals' in fields:
-              fields.remove('totals')
-            csv = '"' + '","'.join(['timestamp'] + fields) + "\"\n"
-
-            for counter in range(0,len(result[datatype][dataid][fields[0]])):
-              # Timestamp
-              row = [datetime.datetime.fromtimestamp(int(str(int(result[datatype][dataid][fields[0]][counter][0]/1000)))).strftime('%Y-%m-%d %H:%M:%S')]
-              for field in fields:
-                # Row values
-                row.append(str(result[datatype][dataid][field][counter][1]))
-
-              csv += '"' + '","'.join(row) + "\"\n"
-
-        response.headers['Content-Type'] = 'application/csv'
-        response.headers['Content-Disposition'] = 'attachment; filename=' + export_name
-        return csv
+      history_format = request.query.get('format')
+      if history_format not in ['columnar','binary']:
+        history_format = None
+
+      # Optional maximum amount of points per graph line
+      points = request.query.get('points')
+      points = int(float(points)) if terrariumUtils.is_float(points) and float(points) >= 1 else None
+
+      # Optional timestamp (in seconds) of the last known point. Only newer history is returned
+      since = request.query.get('since')
+      since = int(float(since)) if terrariumUtils.is_float(since) else None
+
+      # Optional list of sensor ids to get the history of multiple sensors in one request
+      ids = [sensor_id.strip() for sensor_id in request.query.get('ids','').split(',') if '' != sensor_id.strip()]
+      ids = ids if len(ids) > 0 else None
+
+      result = self.__terrariumEngine.get_history(parameters,history_format=history_format,points=points,since=since,ids=ids)
+      if 'binary' == history_format:
+        # Binary data cannot be JSON encoded, so return it directly
+        response.headers['Content-Type'] = 'application/octet-stream'
+        return result
+
+    elif 'export' == action:
+      return self.__export_history(parameters)
+
+    elif 'alarms' == action:
+      result = self.__terrariumEngine.get_alarms(parameters,type=request.query.get('type') or None,**self.__get_time_range())
+
+    elif 'statistics' == action:
+      result = self.__terrariumEngine.get_statistics(parameters,type=request.query.get('type') or None,**self.__get_time_range())
 
     return result
 
+  def __get_state(self,resource):
+    state = self.__terrariumEngine.state.get(resource)
+    if state is None:
+      return None
+
+    response.headers['Etag'] = state['etag']
+    if state['etag'] in [etag.strip() for etag in request.headers.get('If-None-Match','').split(',')]:
+      response.status = 304
+      return b''
+
+    response.headers['Content-Type'] = 'application/json'
+    return state['data']
+
+  def __get_time_range(self):
+    # Optional start and end query parameters as timestamp or date
+    time_range = {}
+    for key in ['start','end']:
+      value = request.query.get(key)
+      if value is None or '' == value:
+        continue
+
+      if terrariumUtils.is_float(value):
+        time_range[key] = int(float(value))
+        continue
+
+      try:
+        time_range[key] = int(time.mktime(datetime.datetime.strptime(value,'%Y-%m-%d').timetuple()))
+      except ValueError as ex:
+        raise HTTPResponse(json.dumps({'ok' : False, 'title' : _('Error!'), 'message' : _('Invalid {} date \'{}\'. Use a timestamp or a date like YYYY-MM-DD').format(key,value)}),
+                           status=400,
+                           headers={'Content-Type' : 'application/json'})
+
+    return time_range
+
+  def __export_history(self,parameters):
+    export_format = 'ndjson' if 'ndjson' == request.query.get('format') else 'csv'
+    export_gzip = terrariumUtils.is_true(request.query.get('gzip',False))
+    export_range = self.__get_time_range()
+
+    export_name = '_'.join(parameters) + '.' + export_format
+    if 'start' not in export_range:
+      parameters.append('all')
+
+    export = self.__terrariumEngine.get_history_export(parameters,**export_range)
+    fields = next(export)
+
+    def export_rows():
+      compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if export_gzip else None
+      buffer = io.StringIO()
+      writer = csv.writer(buffer,quoting=csv.QUOTE_ALL,lineterminator='\n')
+
+      if 'csv' == export_format:
+        writer.writerow(fields)
+
+      # Send the data in chunks of 1000 rows, so memory usage stays the same for every export size
+      for counter, row in enumerate(export,1):
+        row[0] = datetime.datetime.fromtimestamp(row[0]).strftime('%Y-%m-%d %H:%M:%S')
+        if 'csv' == export_format:
+          writer.writerow(row)
+        else:
+          buffer.write(json.dumps(dict(zip(fields,row))) + '\n')
+
+        if counter % 1000 == 0:
+          chunk = buffer.getvalue().encode()
+          buffer.seek(0)
+          buffer.truncate()
+          yield compressor.compress(chunk) if export_gzip else chunk
+
+      chunk = buffer.getvalue().encode()
+      yield (compressor.compress(chunk) + compressor.flush()) if export_gzip else chunk
+
+    response.headers['Content-Type'] = 'application/csv' if 'csv' == export_format else 'application/x-ndjson'
+    if export_gzip:
+      response.headers['Content-Type'] = 'application/gzip'
+      export_name += '.gz'
+
+    response.headers['Content-Disposition'] = 'attachment; filename=' + export_name
+    return export_rows()
+
+  def __recalculate_totals(self):
+    self.__terrariumEngine.recalculate_power_usage_water_flow()
+    return {'ok' : True,
+            'title' : _('Totals recalculated'),
+            'message' : _('The total power and water usage is recalculated from the history')}
+
   def __toggle_switch(self,switchid):
     if switchid in self.__terrariumEngine.power_switches:
       self.__terrariumEngine.power_switches[switchid].toggle()
@@ -476,6 +579,7 @@ class terrariumWebserver(object):
     if switchid in self.__terrariumEngine.power_switches:
       self.__terrariumEngine.power_switches[switchid].set_manual_mode(not self.__terrariumEngine.power_switches[switchid].in_manual_mode())
       self.__terrariumEngine.config.save_power_switch(self.__terrariumEngine.power_switches[switchid].get_data())
+      self.__terrariumEngine.update_state('switches')
       return {'ok' : True}
 
     return {'ok' : False}
@@ -520,13 +624,15 @@ class terrariumWebserver(object):
         message = messages.get()
 
         try:
-          socket.send(json.dumps(message))
+          # Messages are already JSON encoded by the engine
+          socket.send(message)
         except Exception as ex:
           # Socket connection is lost, stop looping....
           break
 
         messages.task_done()
 
+    listening = False
     while True:
       try:
 
@@ -538,13 +644,30 @@ class terrariumWebserver(object):
         message = json.loads(message)
 
         if message['type'] == 'client_init':
+          # Bring the state up to date, the new client gets the full state when subscribing
+          terrariumWebserver.app.terrarium.get_doors_status(socket=True)
+          terrariumWebserver.app.terrarium.get_uptime(socket=True)
+          terrariumWebserver.app.terrarium.get_environment(socket=True)
+          terrariumWebserver.app.terrarium.get_power_usage_water_flow(socket=True)
+
           _thread.start_new_thread(listen_for_messages, (messages,socket))
+          listening = True
           terrariumWebserver.app.terrarium.subscribe(messages)
 
-        terrariumWebserver.app.terrarium.get_doors_status(socket=True)
-        terrariumWebserver.app.terrarium.get_uptime(socket=True)
-        terrariumWebserver.app.terrarium.get_environment(socket=True)
-        terrariumWebserver.app.terrarium.get_power_usage_water_flow(socket=True)
+        elif message['type'] == 'history_graph' and 'parameters' in message.get('data',{}):
+          since = message['data'].get('since')
+          since = int(float(since)) if terrariumUtils.is_float(since) else None
+          ids = message['data']['ids'] if isinstance(message['data'].get('ids'),list) else None
+          # The engine removes the used parameters, so keep a copy for the reply
+          parameters = list(message['data']['parameters'])
+          data = terrariumWebserver.app.terrarium.get_history(list(parameters),since=since,ids=ids)
+
+          # Only the requesting client gets the history. After the client_init the reply is send in order with the other messages
+          reply = json.dumps({'type':'history_graph','data': data, 'parameters' : parameters, 'since' : since, 'ids' : ids})
+          if listening:
+            messages.put(reply)
+          else:
+            socket.send(reply)
 
   def start(self):
     # Start the webserver
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import terrariumLogging
+logger = terrariumLogging.logging.getLogger(__name__)
+
+import json
+
+class terrariumWebsocketDelta(object):
+  # Messages with a list or dict of items. Only the changed items are send, with only the changed fields
+  ITEM_MESSAGES = ['sensor_gauge','switches','doors','environment']
+  # Messages with one value. Only the changed fields are send
+  FIELD_MESSAGES = ['uptime','power_usage_water_flow','door_status','player_indicator','update_weather']
+
+  def __init__(self):
+    # The last send fields per message type and item. The fields are stored as JSON, so changes to the original data are detected
+    self.__state = {}
+    self.__counters = {'send' : 0, 'skipped' : 0}
+
+  def __encode(self,value):
+    return json.dumps(value,sort_keys=True)
+
+  def __delta_fields(self,state,key,data,item_id = None):
+    if not isinstance(data,dict):
+      value = self.__encode(data)
+      if key in state and state[key]['value'] == value:
+        return None
+
+      state[key] = {'value' : value}
+      return data
+
+    if key not in state or 'fields' not in state[key]:
+      state[key] = {'fields' : {}}
+
+    fields = state[key]['fields']
+    delta = {}
+    for field in data:
+      value = self.__encode(data[field])
+      if fields.get(field) != value:
+        fields[field] = value
+        delta[field] = data[field]
+
+    if len(delta) == 0:
+      return None
+
+    if item_id is not None:
+      # List items are merged by their id
+      delta['id'] = item_id
+
+    return delta
+
+  def delta(self,message,complete = False):
+    # With complete, a list message holds all the items, and the items that are not in the message are removed
+    if message['type'] not in terrariumWebsocketDelta.ITEM_MESSAGES + terrariumWebsocketDelta.FIELD_MESSAGES:
+      return message
+
+    if message['type'] not in self.__state:
+      self.__state[message['type']] = {}
+
+    state = self.__state[message['type']]
+    data = None
+    if message['type'] in terrariumWebsocketDelta.FIELD_MESSAGES:
+      data = self.__delta_fields(state,None,message['data'])
+      delta = 'fields'
+
+    elif isinstance(message['data'],list):
+      if not all(isinstance(item,dict) and 'id' in item for item in message['data']):
+        return message
+
+      if complete:
+        item_ids = [item['id'] for item in message['data']]
+        for key in [key for key in state if 'list' == key[0] and key[1] not in item_ids]:
+          del(state[key])
+
+      data = []
+      for item in message['data']:
+        item_delta = self.__delta_fields(state,('list',item['id']),item,item['id'])
+        if item_delta is not None:
+          data.append(item_delta)
+
+      delta = 'items'
+
+    elif isinstance(message['data'],dict):
+      data = {}
+      for key in message['data']:
+        item_delta = self.__delta_fields(state,('dict',key),message['data'][key])
+        if item_delta is not None:
+          data[key] = item_delta
+
+      delta = 'items'
+
+    else:
+      return message
+
+    if data is None or (delta == 'items' and len(data) == 0):
+      self.__counters['skipped'] += 1
+      return None
+
+    self.__counters['send'] += 1
+    return dict(message, **{'data' : data, 'delta' : delta})
+
+  def forget(self,message_type,item_id):
+    # Remove the last send fields of a removed item, so new clients do not get it anymore
+    if message_type not in self.__state:
+      return
+
+    self.__state[message_type].pop(('list',item_id),None)
+    self.__state[message_type].pop(('dict',item_id),None)
+
+  def snapshot(self):
+    # The full last state of all the messages, for new clients
+    messages = []
+    for message_type in self.__state:
+      state = self.__state[message_type]
+      if message_type in terrariumWebsocketDelta.FIELD_MESSAGES:
+        if None not in state:
+          continue
+
+        data = json.loads(state[None]['value']) if 'value' in state[None] else {field : json.loads(value) for field, value in state[None]['fields'].items()}
+        messages.append({'type' : message_type, 'data' : data, 'delta' : 'fields'})
+        continue
+
+      list_items = []
+      dict_items = {}
+      for (shape, key) in state:
+        item = {field : json.loads(value) for field, value in state[(shape, key)]['fields'].items()} if 'fields' in state[(shape, key)] else json.loads(state[(shape, key)]['value'])
+        if 'list' == shape:
+          list_items.append(item)
+        else:
+          dict_items[key] = item
+
+      if len(list_items) > 0:
+        messages.append({'type' : message_type, 'data' : list_items, 'delta' : 'items'})
+
+      if len(dict_items) > 0:
+        messages.append({'type' : message_type, 'data' : dict_items, 'delta' : 'items'})
+
+    return messages
+
+  def get_stats(self):
+    return dict(self.__counters)
@@ -80,12 +80,18 @@
             var sensor_types = '{{sensor_type}}'.split(',');
             $.each(sensor_types,function(counter,sensor_type){
               $.get('/api/sensors/' + sensor_type,function(json_data) {
+                var graphs = [];
                 $.each(sortByKey(json_data.sensors,'name'),function(index,sensor_data){
                   add_sensor_status_row(sensor_data);
                   update_sensor(sensor_data);
                   sensor_gauge('sensor_' + sensor_data.id, sensor_data);
-                  load_history_graph('sensor_' + sensor_data.id,sensor_type + (sensor_type == 'light' && sensor_data.firmware === undefined ? '_percentage' : '') ,'/api/history/sensors/' + sensor_data.id);
+                  graphs.push({'id' : 'sensor_' + sensor_data.id,
+                               'sensor_id' : sensor_data.id,
+                               'type' : sensor_type + (sensor_type == 'light' && sensor_data.firmware === undefined ? '_percentage' : ''),
+                               'data_url' : '/api/history/sensors/' + sensor_data.id});
                 });
+                // Load all graphs with one history request
+                load_history_graphs(graphs,'/api/history/sensors');
                 $('div.row.jumbotron').toggle($('div.row.sensor:visible').length == 0);
                 reload_reload_theme();
               });
@@ -42,6 +42,15 @@
               <li>
                 <strong>{{_('Max diff')}}</strong>: {{translations.get_translation('sensor_field_max_diff')}}
               </li>
+              <li>
+                <strong>{{_('Deadband')}}</strong>: {{translations.get_translation('sensor_field_deadband')}}
+              </li>
+              <li>
+                <strong>{{_('Heartbeat')}}</strong>: {{translations.get_translation('sensor_field_heartbeat')}}
+              </li>
+              <li>
+                <strong>{{_('Update interval')}}</strong>: {{translations.get_translation('sensor_field_update_interval')}}
+              </li>
               <li>
                 <strong>{{_('Current')}}</strong>: {{translations.get_translation('sensor_field_current')}}
               </li>
@@ -182,6 +191,18 @@
                             <label for="sensor_[nr]_max_diff">{{_('Max diff')}}</label>
                             <input class="form-control" name="sensor_[nr]_max_diff" placeholder="{{_('Max diff')}}" type="text" required="required" pattern="[0-9\.-]+" data-toggle="tooltip" data-placement="bottom" title="" data-original-title="{{translations.get_translation('sensor_field_max_diff')}}">
                           </div>
+                          <div class="col-md-2 col-sm-2 col-xs-6 form-group">
+                            <label for="sensor_[nr]_deadband">{{_('Deadband')}}</label>
+                            <input class="form-control" name="sensor_[nr]_deadband" placeholder="{{_('Deadband')}}" type="text" pattern="[0-9\.]+" data-toggle="tooltip" data-placement="bottom" title="" data-original-title="{{translations.get_translation('sensor_field_deadband')}}">
+                          </div>
+                          <div class="col-md-2 col-sm-2 col-xs-6 form-group">
+                            <label for="sensor_[nr]_heartbeat">{{_('Heartbeat')}}</label>
+                            <input class="form-control" name="sensor_[nr]_heartbeat" placeholder="{{_('Heartbeat')}}" type="text" pattern="[0-9]+" data-toggle="tooltip" data-placement="bottom" title="" data-original-title="{{translations.get_translation('sensor_field_heartbeat')}}">
+                          </div>
+                          <div class="col-md-2 col-sm-2 col-xs-6 form-group">
+                            <label for="sensor_[nr]_update_interval">{{_('Update interval')}}</label>
+                            <input class="form-control" name="sensor_[nr]_update_interval" placeholder="{{_('Update interval')}}" type="text" pattern="[0-9]+" data-toggle="tooltip" data-placement="bottom" title="" data-original-title="{{translations.get_translation('sensor_field_update_interval')}}">
+                          </div>
                           <div class="col-md-2 col-sm-2 col-xs-6 form-group">
                             <label for="sensor_[nr]_current">{{_('Current')}}</label>
                             <input class="form-control" name="sensor_[nr]_current" placeholder="{{_('Current')}}" readonly="readonly" type="text" data-toggle="tooltip" data-placement="bottom" title="" data-original-title="{{translations.get_translation('sensor_field_current')}}">